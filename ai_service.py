@@ -1,9 +1,15 @@
-import requests
 import json
+import requests
+import threading
 import time
+from contextlib import contextmanager
 from typing import Optional, Dict, Any, Tuple
 from config import Config
-from models import db, AIConfig, GenerationLog, TokenUsage, Novel
+from models import db, AIConfig, GenerationLog, TokenUsage, Novel, accumulate_token_usage
+from check_parser import CheckParseError, build_response_format, format_instruction, parse_check_result
+from llm_traffic import TrafficRecorder, request_digest
+from event_bus import event_bus
+from passage_index import estimate_tokens
 
 
 class AIService:
@@ -19,12 +25,46 @@ class AIService:
         'default': {'prompt': 0.01, 'completion': 0.03}  # 默认价格
     }
 
+    # 不支持 response_format 的 (api_base, model)，首次被拒绝后不再携带该参数
+    _response_format_unsupported = set()
+
+    # 检查结果解析统计（进程内累计）
+    check_parse_stats = {
+        'parse_failures': 0,  # 解析失败次数
+        'reparse_calls': 0,  # 因解析失败而重新发起的检查调用
+        'exhausted': 0  # 重试用尽仍无法解析的检查
+    }
+    _stats_lock = threading.Lock()
+
     def __init__(self):
         self.api_base = Config.AI_API_BASE
         self.api_key = Config.AI_API_KEY
         self.model = Config.AI_MODEL
         # 延迟加载配置，避免在应用上下文外访问数据库
 
+        # LLM调用录制（配置 LLM_RECORD_DIR 开启）与回放（由回放脚本设置）
+        self.recorder = TrafficRecorder(Config.LLM_RECORD_DIR) if Config.LLM_RECORD_DIR else None
+        self.replayer = None
+        # 当前线程正在统计的Token消耗（见 track_usage）
+        self._local = threading.local()
+
+    @contextmanager
+    def track_usage(self):
+        """统计代码块内当前线程所有调用的Token消耗，用于记录生成某个版本的成本
+
+        用法：
+            with ai_service.track_usage() as usage:
+                content = ai_service.generate_chapter_content(...)
+            usage['total_tokens']
+        """
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cost': 0.0}
+        previous = getattr(self._local, 'usage', None)
+        self._local.usage = usage
+        try:
+            yield usage
+        finally:
+            self._local.usage = previous
+
     def _load_active_config(self, is_check: bool = False):
         """加载激活的AI配置
 
@@ -66,49 +106,60 @@ class AIService:
 
     def _call_api(self, messages: list, temperature: float = 0.7, max_tokens: int = 4000,
                   novel_id: int = None, operation: str = None, stage: str = None,
-                  chapter_number: int = None, is_check: bool = False) -> Tuple[Optional[str], Optional[Dict]]:
+                  chapter_number: int = None, is_check: bool = False,
+                  response_format: Dict = None) -> Tuple[Optional[str], Optional[Dict]]:
         """调用AI API并记录Token使用
 
         Args:
             is_check: 是否为校验操作，用于选择合适的模型配置
+            response_format: 结构化输出参数，服务端不支持时自动去掉后重试
         """
         # 尝试加载激活的配置（根据是否为校验操作选择不同配置）
         self._load_active_config(is_check=is_check)
 
         start_time = time.time()
+        digest = request_digest({
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        })
 
         try:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.api_key}'
-            }
-
-            data = {
-                'model': self.model,
-                'messages': messages,
-                'temperature': temperature,
-                'max_tokens': max_tokens
-            }
-
-            response = requests.post(
-                f'{self.api_base}/chat/completions',
-                headers=headers,
-                json=data,
-                timeout=120
-            )
+            if self.replayer:
+                status_code, result, error_text, entry = self.replayer.replay(operation, chapter_number, digest)
+                if entry and entry.get('model'):
+                    self.model = entry['model']
+            else:
+                on_delta = None
+                # 流式输出只用于生成类调用，检查结果需要完整JSON
+                if Config.AI_STREAM and novel_id and not is_check and response_format is None:
+                    def on_delta(text):
+                        event_bus.publish(novel_id, 'delta', {
+                            'stage': stage,
+                            'operation': operation,
+                            'chapter_number': chapter_number,
+                            'text': text
+                        })
+                status_code, result, error_text = self._post(messages, temperature, max_tokens,
+                                                             response_format, on_delta)
 
             duration = time.time() - start_time
 
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
                 content = result['choices'][0]['message']['content']
 
-                # 提取Token使用信息
-                usage = result.get('usage', {})
+                # 提取Token使用信息；接口未返回用量时按字数估算，避免记为0
+                usage = result.get('usage') or {}
+                if not usage.get('total_tokens'):
+                    usage = self._estimate_usage(messages, content)
+                    print(f"接口未返回Token用量，按字数估算为 {usage['total_tokens']}")
                 prompt_tokens = usage.get('prompt_tokens', 0)
                 completion_tokens = usage.get('completion_tokens', 0)
                 total_tokens = usage.get('total_tokens', 0)
 
+                self._record_traffic(novel_id, operation, stage, chapter_number, digest, duration,
+                                     status=200, content=content, usage=usage)
+
                 # 计算费用
                 cost = self._calculate_cost(prompt_tokens, completion_tokens, self.model)
 
@@ -136,13 +187,162 @@ class AIService:
 
                 return content, usage_info
             else:
-                print(f"API调用失败: {response.status_code} - {response.text}")
+                self._record_traffic(novel_id, operation, stage, chapter_number, digest, duration,
+                                     status=status_code, error=error_text[:1000])
+                print(f"API调用失败: {status_code} - {error_text}")
                 return None, None
 
         except Exception as e:
+            self._record_traffic(novel_id, operation, stage, chapter_number, digest,
+                                 time.time() - start_time, status=0, error=str(e))
             print(f"API调用异常: {str(e)}")
             return None, None
 
+    def _post(self, messages: list, temperature: float, max_tokens: int,
+              response_format: Dict = None, on_delta=None) -> Tuple[int, Optional[Dict], str]:
+        """向模型接口发送请求
+
+        Args:
+            on_delta: 设置后以流式方式请求，每收到一段增量文本调用一次
+
+        Returns:
+            (状态码, 响应JSON, 响应文本)。流式请求的分片会拼装成与非流式相同的响应JSON。
+        """
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self.api_key}'
+        }
+
+        data = {
+            'model': self.model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }
+
+        if on_delta:
+            data['stream'] = True
+            data['stream_options'] = {'include_usage': True}
+
+        format_key = (self.api_base, self.model)
+        if response_format and format_key not in self._response_format_unsupported:
+            data['response_format'] = response_format
+
+        response = requests.post(
+            f'{self.api_base}/chat/completions',
+            headers=headers,
+            json=data,
+            timeout=120,
+            stream=bool(on_delta)
+        )
+
+        if response.status_code in (400, 422) and 'response_format' in data:
+            # 只有错误信息明确指向 response_format 时才记住该模型不支持，
+            # 其他 4xx（上下文超长、参数校验失败等）仅本次去掉参数重试
+            error_text = response.text.lower()
+            if 'response_format' in error_text or 'json_schema' in error_text:
+                print(f"模型 {self.model} 不支持 response_format，改用普通输出")
+                self._response_format_unsupported.add(format_key)
+            else:
+                print(f"请求返回 {response.status_code}，去掉 response_format 重试一次")
+            del data['response_format']
+            response = requests.post(
+                f'{self.api_base}/chat/completions',
+                headers=headers,
+                json=data,
+                timeout=120
+            )
+
+        if response.status_code == 200:
+            if on_delta:
+                result = self._read_stream(response, on_delta)
+                if result is None:
+                    # 按失败处理，由调用方重试，不把截断的内容当作完整结果
+                    return 0, None, '流式响应在结束前中断（未收到 [DONE] 或 finish_reason）'
+                return 200, result, ''
+            return 200, response.json(), ''
+        return response.status_code, None, response.text
+
+    @staticmethod
+    def _estimate_usage(messages: list, content: str) -> Dict:
+        """接口未返回用量时按字数估算Token"""
+        prompt_tokens = sum(estimate_tokens(message.get('content') or '') + 4 for message in messages)
+        completion_tokens = estimate_tokens(content or '')
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'estimated': True
+        }
+
+    @staticmethod
+    def _read_stream(response, on_delta, flush_chars: int = 200,
+                     flush_interval: float = 0.5) -> Optional[Dict]:
+        """读取 SSE 流式响应，按字数或时间间隔合并增量后回调，返回拼装好的响应JSON
+
+        既没有收到 [DONE] 也没有收到 finish_reason 时视为流被截断，返回 None。
+        """
+        parts = []
+        usage = {}
+        done = False
+        finish_reason = None
+        pending = ''
+        last_flush = time.time()
+
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                done = True
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+
+            usage = chunk.get('usage') or usage
+            for choice in chunk.get('choices') or []:
+                finish_reason = choice.get('finish_reason') or finish_reason
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    parts.append(text)
+                    pending += text
+
+            if pending and (len(pending) >= flush_chars or time.time() - last_flush >= flush_interval):
+                on_delta(pending)
+                pending = ''
+                last_flush = time.time()
+
+        if pending:
+            on_delta(pending)
+
+        if not done and finish_reason is None:
+            return None
+
+        return {
+            'choices': [{
+                'message': {'role': 'assistant', 'content': ''.join(parts)},
+                'finish_reason': finish_reason
+            }],
+            'usage': usage
+        }
+
+    def _record_traffic(self, novel_id: int, operation: str, stage: str, chapter_number: int,
+                        digest: str, duration: float, **fields):
+        """录制模式下记录本次调用"""
+        if not self.recorder or not novel_id or self.replayer:
+            return
+        self.recorder.record(novel_id, dict(
+            fields,
+            operation=operation,
+            stage=stage,
+            chapter_number=chapter_number,
+            model=self.model,
+            request_digest=digest,
+            duration=round(duration, 3)
+        ))
+
     def _record_token_usage(self, novel_id: int, stage: str, operation: str,
                            prompt_tokens: int, completion_tokens: int, total_tokens: int,
                            cost: float, duration: float, chapter_number: int = None):
@@ -161,6 +361,14 @@ class AIService:
                 duration=duration
             )
             db.session.add(token_usage)
+            accumulate_token_usage(token_usage)
+
+            tracked = getattr(self._local, 'usage', None)
+            if tracked is not None:
+                tracked['prompt_tokens'] += prompt_tokens
+                tracked['completion_tokens'] += completion_tokens
+                tracked['total_tokens'] += total_tokens
+                tracked['cost'] += cost
 
             # 更新小说的总Token统计
             novel = Novel.query.get(novel_id)
@@ -171,6 +379,16 @@ class AIService:
                 novel.total_cost = (novel.total_cost or 0.0) + cost
 
             db.session.commit()
+
+            event_bus.publish(novel_id, 'tokens', {
+                'stage': stage,
+                'operation': operation,
+                'chapter_number': chapter_number,
+                'total_tokens': total_tokens,
+                'cost': cost,
+                'novel_total_tokens': novel.total_tokens if novel else None,
+                'novel_total_cost': novel.total_cost if novel else None
+            })
         except Exception as e:
             print(f"记录Token使用失败: {str(e)}")
             db.session.rollback()
@@ -283,47 +501,15 @@ class AIService:
             {'role': 'user', 'content': prompt}
         ]
 
-        result, usage = self._call_api(
+        return self._run_check(
             messages,
-            temperature=0.2,
+            check_type='settings',
+            label='设定检查',
             max_tokens=2000,
             novel_id=novel_id,
-            operation='check_settings',
-            stage='check',
-            is_check=True
+            operation='check_settings'
         )
 
-        if result:
-            try:
-                # 尝试提取JSON内容
-                json_str = result.strip()
-
-                # 如果结果包含markdown代码块，提取其中的JSON
-                if '```json' in json_str:
-                    json_str = json_str.split('```json')[1].split('```')[0].strip()
-                elif '```' in json_str:
-                    json_str = json_str.split('```')[1].split('```')[0].strip()
-
-                # 尝试解析JSON
-                check_result = json.loads(json_str)
-                self._log(novel_id, 'check', f'设定检查完成，总分：{check_result.get("total_score", 0)}')
-                return check_result
-            except json.JSONDecodeError as e:
-                self._log(novel_id, 'check', f'设定检查结果解析失败: {str(e)}。原始返回: {result[:200]}...', 'error')
-                # 返回一个默认通过的结果，避免阻塞流程
-                return {
-                    'passed': True,
-                    'total_score': 40,
-                    'error': '解析失败，默认通过',
-                    'raw_response': result
-                }
-            except Exception as e:
-                self._log(novel_id, 'check', f'设定检查异常: {str(e)}', 'error')
-                return {'passed': True, 'total_score': 40, 'error': '检查异常，默认通过'}
-        else:
-            self._log(novel_id, 'check', '设定检查失败', 'error')
-            return {'passed': False, 'error': 'API调用失败'}
-
     def generate_outline(self, settings: str, target_chapters: int, novel_id: int) -> Optional[str]:
         """生成小说大纲"""
         self._log(novel_id, 'outline', '开始生成小说大纲...')
@@ -439,43 +625,15 @@ class AIService:
             {'role': 'user', 'content': prompt}
         ]
 
-        result, usage = self._call_api(
+        return self._run_check(
             messages,
-            temperature=0.2,
+            check_type='outline',
+            label='大纲检查',
             max_tokens=2000,
             novel_id=novel_id,
-            operation='check_outline',
-            stage='check',
-            is_check=True
+            operation='check_outline'
         )
 
-        if result:
-            try:
-                # 尝试提取JSON内容
-                json_str = result.strip()
-                if '```json' in json_str:
-                    json_str = json_str.split('```json')[1].split('```')[0].strip()
-                elif '```' in json_str:
-                    json_str = json_str.split('```')[1].split('```')[0].strip()
-
-                check_result = json.loads(json_str)
-                self._log(novel_id, 'check', f'大纲检查完成，总分：{check_result.get("total_score", 0)} (Tokens: {usage["total_tokens"]})')
-                return check_result
-            except json.JSONDecodeError as e:
-                self._log(novel_id, 'check', f'大纲检查结果解析失败: {str(e)}。原始返回: {result[:200]}...', 'error')
-                return {
-                    'passed': True,
-                    'total_score': 40,
-                    'error': '解析失败，默认通过',
-                    'raw_response': result
-                }
-            except Exception as e:
-                self._log(novel_id, 'check', f'大纲检查异常: {str(e)}', 'error')
-                return {'passed': True, 'total_score': 40, 'error': '检查异常，默认通过'}
-        else:
-            self._log(novel_id, 'check', '大纲检查失败', 'error')
-            return {'passed': False, 'error': 'API调用失败'}
-
     def generate_detailed_outline(self, chapter_info: str, settings: str, outline: str,
                                   chapter_number: int, target_words: int, novel_id: int) -> Optional[str]:
         """生成章节细纲"""
@@ -588,49 +746,33 @@ class AIService:
             {'role': 'user', 'content': prompt}
         ]
 
-        result, usage = self._call_api(
+        return self._run_check(
             messages,
-            temperature=0.2,
+            check_type='detailed_outline',
+            label=f'第{chapter_number}章细纲检查',
             max_tokens=1500,
             novel_id=novel_id,
             operation='check_detailed_outline',
-            stage='check',
-            chapter_number=chapter_number,
-            is_check=True
+            chapter_number=chapter_number
         )
 
-        if result:
-            try:
-                # 尝试提取JSON内容
-                json_str = result.strip()
-                if '```json' in json_str:
-                    json_str = json_str.split('```json')[1].split('```')[0].strip()
-                elif '```' in json_str:
-                    json_str = json_str.split('```')[1].split('```')[0].strip()
-
-                check_result = json.loads(json_str)
-                self._log(novel_id, 'check', f'第{chapter_number}章细纲检查完成，总分：{check_result.get("total_score", 0)} (Tokens: {usage["total_tokens"]})')
-                return check_result
-            except json.JSONDecodeError as e:
-                self._log(novel_id, 'check', f'第{chapter_number}章细纲检查结果解析失败: {str(e)}', 'error')
-                return {
-                    'passed': True,
-                    'total_score': 32,
-                    'error': '解析失败，默认通过',
-                    'raw_response': result
-                }
-            except Exception as e:
-                self._log(novel_id, 'check', f'第{chapter_number}章细纲检查异常: {str(e)}', 'error')
-                return {'passed': True, 'total_score': 32, 'error': '检查异常，默认通过'}
-        else:
-            self._log(novel_id, 'check', f'第{chapter_number}章细纲检查失败', 'error')
-            return {'passed': False, 'error': 'API调用失败'}
-
     def generate_chapter_content(self, detailed_outline: str, settings: str,
                                  chapter_title: str, target_words: int,
-                                 novel_id: int, chapter_number: int) -> Optional[str]:
-        """生成章节正文内容"""
+                                 novel_id: int, chapter_number: int,
+                                 related_context: str = None) -> Optional[str]:
+        """生成章节正文内容
+
+        Args:
+            related_context: 从前文检索出的相关片段，用于保持人物、物品、伏笔前后一致
+        """
         self._log(novel_id, 'content', f'开始生成第{chapter_number}章正文...')
+        context_section = ''
+        if related_context:
+            context_section = f"""
+【前文相关片段】（仅供保持前后一致，不要复述）
+{related_context}
+"""
+            self._log(novel_id, 'content', f'第{chapter_number}章附带前文相关片段 {len(related_context)} 字')
 
         # 使用您提供的专业写作Prompt
         writing_rules = """【角色设定】
@@ -665,7 +807,7 @@ class AIService:
 
 【章节细纲】
 {detailed_outline}
-
+{context_section}
 【写作要求】
 - 目标字数：{target_words}字左右
 - 严格按照细纲展开情节
@@ -779,43 +921,82 @@ class AIService:
             {'role': 'user', 'content': prompt}
         ]
 
-        result, usage = self._call_api(
+        return self._run_check(
             messages,
-            temperature=0.2,
+            check_type='chapter_content',
+            label=f'第{chapter_number}章正文检查',
             max_tokens=2000,
             novel_id=novel_id,
             operation='check_chapter_content',
-            stage='check',
-            chapter_number=chapter_number,
-            is_check=True
+            chapter_number=chapter_number
         )
 
-        if result:
+    def _run_check(self, messages: list, check_type: str, label: str, max_tokens: int,
+                   novel_id: int, operation: str, chapter_number: int = None) -> Dict[str, Any]:
+        """执行质量检查并解析结果
+
+        优先请求结构化输出，解析失败时只重新发起检查调用（不重新生成内容），
+        并附上无法解析的回复和格式要求；重试用尽后返回未通过并标记 parse_failed / needs_recheck，
+        由调用方保留内容待复查，不按检查不合格重新生成。
+        """
+        response_format = build_response_format(check_type)
+        max_attempts = Config.CHECK_PARSE_RETRIES + 1
+        request_messages = messages
+
+        for attempt in range(max_attempts):
+            if attempt > 0:
+                self._count_check_parse('reparse_calls')
+
+            result, usage = self._call_api(
+                request_messages,
+                temperature=0.2,
+                max_tokens=max_tokens,
+                novel_id=novel_id,
+                operation=operation if attempt == 0 else f'{operation}_reparse',
+                stage='check',
+                chapter_number=chapter_number,
+                is_check=True,
+                response_format=response_format
+            )
+
+            if not result:
+                self._log(novel_id, 'check', f'{label}失败', 'error')
+                return {'passed': False, 'error': 'API调用失败'}
+
             try:
-                # 尝试提取JSON内容
-                json_str = result.strip()
-                if '```json' in json_str:
-                    json_str = json_str.split('```json')[1].split('```')[0].strip()
-                elif '```' in json_str:
-                    json_str = json_str.split('```')[1].split('```')[0].strip()
-
-                check_result = json.loads(json_str)
-                self._log(novel_id, 'check', f'第{chapter_number}章正文检查完成，总分：{check_result.get("total_score", 0)} (Tokens: {usage["total_tokens"]})')
+                check_result = parse_check_result(result, check_type)
+                self._log(novel_id, 'check', f'{label}完成，总分：{check_result["total_score"]} (Tokens: {usage["total_tokens"]})')
                 return check_result
-            except json.JSONDecodeError as e:
-                self._log(novel_id, 'check', f'第{chapter_number}章正文检查结果解析失败: {str(e)}', 'error')
-                return {
-                    'passed': True,
-                    'total_score': 40,
-                    'error': '解析失败，默认通过',
-                    'raw_response': result
-                }
-            except Exception as e:
-                self._log(novel_id, 'check', f'第{chapter_number}章正文检查异常: {str(e)}', 'error')
-                return {'passed': True, 'total_score': 40, 'error': '检查异常，默认通过'}
-        else:
-            self._log(novel_id, 'check', f'第{chapter_number}章正文检查失败', 'error')
-            return {'passed': False, 'error': 'API调用失败'}
+            except CheckParseError as e:
+                self._count_check_parse('parse_failures')
+                self._log(novel_id, 'check', f'{label}结果解析失败 (尝试 {attempt + 1}/{max_attempts}): {str(e)}', 'warning')
+                request_messages = messages + [
+                    {'role': 'assistant', 'content': result[:2000]},
+                    {'role': 'user', 'content': f'上面的回复无法解析（{e}）。{format_instruction(check_type)}'}
+                ]
+
+        self._count_check_parse('exhausted')
+        self._log(novel_id, 'check', f'{label}结果多次解析失败，保留内容待复查', 'error')
+        return {
+            'passed': False,
+            'total_score': 0,
+            'error': '解析失败',
+            'parse_failed': True,
+            'needs_recheck': True,
+            'raw_response': result[:2000]
+        }
+
+    @classmethod
+    def _count_check_parse(cls, key: str):
+        """累加检查解析统计"""
+        with cls._stats_lock:
+            cls.check_parse_stats[key] += 1
+
+    @classmethod
+    def get_check_parse_stats(cls) -> Dict[str, int]:
+        """获取检查解析统计快照"""
+        with cls._stats_lock:
+            return dict(cls.check_parse_stats)
 
     def _log(self, novel_id: int, stage: str, message: str, level: str = 'info'):
         """记录日志"""
@@ -828,6 +1009,7 @@ class AIService:
             )
             db.session.add(log)
             db.session.commit()
+            event_bus.publish(novel_id, 'log', log.to_dict())
         except Exception as e:
             print(f"日志记录失败: {str(e)}")
 
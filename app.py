@@ -1,12 +1,28 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
 import threading
-from flask import Flask, request, jsonify, send_file, render_template
+import time
+from flask import Flask, request, jsonify, send_file, render_template, make_response, Response, abort, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timedelta
-from sqlalchemy import func
-from models import db, Novel, Chapter, GenerationLog, AIConfig, TokenUsage
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+from sqlalchemy import func, and_, or_, select
+from sqlalchemy.orm import undefer_group
+from models import (db, configure_engine, Novel, Chapter, GenerationLog, AIConfig, TokenUsage,
+                    TokenUsageDaily, TokenUsageChapter, Revision)
 from novel_generator import NovelGenerator
-from exporter import NovelExporter
+from exporter import NovelExporter, MIMETYPES, COMPRESSIBLE_FORMATS
 from config import Config
+from event_bus import event_bus
+from blob_store import blob_store
+from text_codec import referenced_digests
+import fulltext
+from revisions import CHECK_FIELDS, NOVEL_FIELDS, record_revision, revision_text, previous_revision, diff_text
+from migrate import run_migrations
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -15,9 +31,17 @@ Config.init_app(app)
 CORS(app)
 db.init_app(app)
 
+with app.app_context():
+    configure_engine(
+        db.engine,
+        journal_mode=Config.SQLITE_JOURNAL_MODE,
+        synchronous=Config.SQLITE_SYNCHRONOUS,
+        busy_timeout=Config.DB_BUSY_TIMEOUT
+    )
+
 # 初始化服务
 novel_generator = NovelGenerator()
-exporter = NovelExporter(Config.EXPORT_DIR)
+exporter = NovelExporter(Config.EXPORT_DIR, workers=Config.EXPORT_WORKERS)
 
 
 # ==================== 前端页面 ====================
@@ -30,18 +54,159 @@ def index():
 
 # ==================== 小说管理 API ====================
 
+def _encode_cursor(created_at: datetime, row_id: int) -> str:
+    """把 (created_at, id) 编码为分页游标"""
+    raw = f"{created_at.isoformat() if created_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(row_id)
+    except (UnicodeError, ValueError):
+        raise ValueError('无效的分页游标')
+
+
+def _parse_datetime_arg(name: str):
+    """解析 ISO 格式的日期参数，格式错误时抛出 ValueError"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'{name} 日期格式错误，应为 ISO 格式')
+
+
+def _make_etag(*parts) -> str:
+    """由资源版本信息生成强 ETag"""
+    raw = '|'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _not_modified(etag: str, last_modified: datetime = None):
+    """校验 If-None-Match / If-Modified-Since，客户端缓存仍有效时返回 304 响应
+
+    If-None-Match 存在时优先按 ETag 判断，否则按秒级精度比较修改时间。
+    在序列化之前调用，命中时不构造任何 ORM 对象。
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    return _with_validators(Response(status=304), etag, last_modified)
+
+
+def _with_validators(response, etag: str, last_modified: datetime = None):
+    """给响应加上 ETag / Last-Modified，并要求客户端每次重新验证"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _chapters_version(novel_id: int):
+    """章节集合的版本：(章节数, 最近更新时间)，一次聚合查询，走 (novel_id, chapter_number) 索引"""
+    return db.session.query(
+        func.count(Chapter.id), func.max(Chapter.updated_at)
+    ).filter(Chapter.novel_id == novel_id).one()
+
+
 @app.route('/api/novels', methods=['GET'])
 def get_novels():
-    """获取所有小说列表"""
-    novels = Novel.query.order_by(Novel.created_at.desc()).all()
-    return jsonify([novel.to_dict() for novel in novels])
+    """分页获取小说列表
+
+    查询参数：
+        limit: 每页数量（默认50，最大200）
+        cursor: 上一页返回的 next_cursor
+        status: 状态筛选，多个用逗号分隔
+        created_after / created_before: 创建时间范围（ISO格式）
+        view: summary（默认，不含大文本）或 full
+        fields: 指定返回字段，逗号分隔，优先于 view
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    view = request.args.get('view', 'summary')
+
+    if request.args.get('fields'):
+        fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in Novel.ALL_FIELDS]
+        if unknown:
+            return jsonify({'error': f'不支持的字段: {", ".join(unknown)}'}), 400
+    elif view == 'full':
+        fields = list(Novel.ALL_FIELDS)
+    elif view == 'summary':
+        fields = list(Novel.SUMMARY_FIELDS)
+    else:
+        return jsonify({'error': '不支持的 view，可选 summary 或 full'}), 400
+
+    query = Novel.query
+    if any(field in Novel.CONTENT_FIELDS for field in fields):
+        query = query.options(undefer_group('content'))
+
+    if request.args.get('status'):
+        query = query.filter(Novel.status.in_(request.args['status'].split(',')))
+
+    try:
+        created_after = _parse_datetime_arg('created_after')
+        created_before = _parse_datetime_arg('created_before')
+        cursor = _decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if created_after:
+        query = query.filter(Novel.created_at >= created_after)
+    if created_before:
+        query = query.filter(Novel.created_at < created_before)
+
+    # 按 (created_at, id) 倒序做游标分页
+    if cursor:
+        cursor_created_at, cursor_id = cursor
+        query = query.filter(or_(
+            Novel.created_at < cursor_created_at,
+            and_(Novel.created_at == cursor_created_at, Novel.id < cursor_id)
+        ))
+
+    novels = query.order_by(Novel.created_at.desc(), Novel.id.desc()).limit(limit + 1).all()
+    has_more = len(novels) > limit
+    novels = novels[:limit]
+
+    chapter_fields = {'chapter_count', 'completed_chapters', 'total_word_count'}
+    chapter_stats = Chapter.stats_for(novel.id for novel in novels) if chapter_fields & set(fields) else {}
+
+    return jsonify({
+        'items': [novel.to_dict(chapter_stats.get(novel.id), fields=fields) for novel in novels],
+        'next_cursor': _encode_cursor(novels[-1].created_at, novels[-1].id) if has_more else None
+    })
 
 
 @app.route('/api/novels/<int:novel_id>', methods=['GET'])
 def get_novel(novel_id):
-    """获取单个小说详情"""
-    novel = Novel.query.get_or_404(novel_id)
-    return jsonify(novel.to_dict())
+    """获取单个小说详情，支持 ETag / Last-Modified 条件请求"""
+    novel_updated_at = db.session.query(Novel.updated_at).filter(Novel.id == novel_id).first()
+    if novel_updated_at is None:
+        abort(404)
+
+    # 详情中含章节统计，章节变化时小说本身的 updated_at 不一定变化
+    chapter_count, chapters_updated_at = _chapters_version(novel_id)
+    last_modified = max(filter(None, [novel_updated_at[0], chapters_updated_at]), default=None)
+    etag = _make_etag('novel', novel_id, novel_updated_at[0], chapter_count, chapters_updated_at)
+
+    not_modified = _not_modified(etag, last_modified)
+    if not_modified:
+        return not_modified
+
+    novel = Novel.query.options(undefer_group('content')).get_or_404(novel_id)
+    response = jsonify(novel.to_dict(Chapter.stats_for([novel_id]).get(novel_id)))
+    return _with_validators(response, etag, last_modified)
 
 
 @app.route('/api/novels', methods=['POST'])
@@ -94,6 +259,7 @@ def pause_generation(novel_id):
 
     novel.is_paused = True
     db.session.commit()
+    novel_generator.publish_novel(novel)
 
     return jsonify({'message': '已发送暂停信号，生成将在当前步骤完成后暂停'})
 
@@ -109,6 +275,7 @@ def resume_generation(novel_id):
     novel.is_paused = False
     novel.status = 'generating'
     db.session.commit()
+    novel_generator.publish_novel(novel)
 
     # 在后台线程中继续生成
     def generate():
@@ -134,143 +301,155 @@ def regenerate_content(novel_id, content_type):
     chapter_id = data.get('chapter_id')
 
     try:
-        if content_type == 'settings':
-            # 重新生成小说设定
-            if custom_prompt:
-                # 使用自定义提示词
-                result = novel_generator.ai_service.generate_settings_with_custom_prompt(
-                    theme=novel.theme,
-                    background=novel.background,
-                    target_words=novel.target_words,
-                    target_chapters=novel.target_chapters,
-                    custom_prompt=custom_prompt,
-                    novel_id=novel.id
-                )
-            else:
-                # 使用默认提示词
-                result = novel_generator.ai_service.generate_settings(
-                    theme=novel.theme,
-                    background=novel.background,
-                    target_words=novel.target_words,
-                    target_chapters=novel.target_chapters,
-                    novel_id=novel.id
-                )
-
-            if result:
-                novel.settings = result
-                db.session.commit()
-                return jsonify({'message': '设定重新生成成功', 'content': result})
-            else:
-                return jsonify({'error': '设定生成失败'}), 500
-
-        elif content_type == 'outline':
-            # 重新生成大纲
-            if not novel.settings:
-                return jsonify({'error': '请先生成小说设定'}), 400
-
-            if custom_prompt:
-                result = novel_generator.ai_service.generate_outline_with_custom_prompt(
-                    settings=novel.settings,
-                    target_chapters=novel.target_chapters,
-                    custom_prompt=custom_prompt,
-                    novel_id=novel.id
-                )
-            else:
-                result = novel_generator.ai_service.generate_outline(
-                    settings=novel.settings,
-                    target_chapters=novel.target_chapters,
-                    novel_id=novel.id
-                )
-
-            if result:
-                novel.outline = result
-                db.session.commit()
-                return jsonify({'message': '大纲重新生成成功', 'content': result})
-            else:
-                return jsonify({'error': '大纲生成失败'}), 500
-
-        elif content_type == 'chapter_outline':
-            # 重新生成章节细纲
-            if not chapter_id:
-                return jsonify({'error': '缺少章节ID'}), 400
-
-            chapter = Chapter.query.get_or_404(chapter_id)
-            if chapter.novel_id != novel_id:
-                return jsonify({'error': '章节不属于该小说'}), 400
-
-            chapter_info = novel_generator._get_chapter_info_from_outline(novel.outline, chapter.chapter_number)
-            words_per_chapter = novel.target_words // novel.target_chapters
-
-            if custom_prompt:
-                result = novel_generator.ai_service.generate_detailed_outline_with_custom_prompt(
-                    chapter_info=chapter_info,
-                    settings=novel.settings,
-                    outline=novel.outline,
-                    chapter_number=chapter.chapter_number,
-                    target_words=words_per_chapter,
-                    custom_prompt=custom_prompt,
-                    novel_id=novel.id
-                )
-            else:
-                result = novel_generator.ai_service.generate_detailed_outline(
-                    chapter_info=chapter_info,
-                    settings=novel.settings,
-                    outline=novel.outline,
-                    chapter_number=chapter.chapter_number,
-                    target_words=words_per_chapter,
-                    novel_id=novel.id
-                )
-
-            if result:
-                chapter.detailed_outline = result
-                db.session.commit()
-                return jsonify({'message': f'第{chapter.chapter_number}章细纲重新生成成功', 'content': result})
-            else:
-                return jsonify({'error': '细纲生成失败'}), 500
-
-        elif content_type == 'chapter_content':
-            # 重新生成章节内容
-            if not chapter_id:
-                return jsonify({'error': '缺少章节ID'}), 400
-
-            chapter = Chapter.query.get_or_404(chapter_id)
-            if chapter.novel_id != novel_id:
-                return jsonify({'error': '章节不属于该小说'}), 400
-
-            if not chapter.detailed_outline:
-                return jsonify({'error': '请先生成章节细纲'}), 400
-
-            words_per_chapter = novel.target_words // novel.target_chapters
-
-            if custom_prompt:
-                result = novel_generator.ai_service.generate_chapter_content_with_custom_prompt(
-                    detailed_outline=chapter.detailed_outline,
-                    settings=novel.settings,
-                    chapter_title=chapter.title,
-                    target_words=words_per_chapter,
-                    custom_prompt=custom_prompt,
-                    novel_id=novel.id,
-                    chapter_number=chapter.chapter_number
-                )
-            else:
-                result = novel_generator.ai_service.generate_chapter_content(
-                    detailed_outline=chapter.detailed_outline,
-                    settings=novel.settings,
-                    chapter_title=chapter.title,
-                    target_words=words_per_chapter,
-                    novel_id=novel.id,
-                    chapter_number=chapter.chapter_number
-                )
-
-            if result:
-                chapter.content = result
-                chapter.word_count = len(result)
-                db.session.commit()
-                return jsonify({'message': f'第{chapter.chapter_number}章内容重新生成成功', 'content': result})
+        # 统计本次重新生成的Token消耗，记入版本历史
+        with novel_generator.ai_service.track_usage() as usage:
+            if content_type == 'settings':
+                # 重新生成小说设定
+                if custom_prompt:
+                    # 使用自定义提示词
+                    result = novel_generator.ai_service.generate_settings_with_custom_prompt(
+                        theme=novel.theme,
+                        background=novel.background,
+                        target_words=novel.target_words,
+                        target_chapters=novel.target_chapters,
+                        custom_prompt=custom_prompt,
+                        novel_id=novel.id
+                    )
+                else:
+                    # 使用默认提示词
+                    result = novel_generator.ai_service.generate_settings(
+                        theme=novel.theme,
+                        background=novel.background,
+                        target_words=novel.target_words,
+                        target_chapters=novel.target_chapters,
+                        novel_id=novel.id
+                    )
+
+                if result:
+                    record_revision(novel.id, 0, 'settings', result, 'regenerate',
+                                    usage=usage, previous=novel.settings)
+                    novel.settings = result
+                    db.session.commit()
+                    return jsonify({'message': '设定重新生成成功', 'content': result})
+                else:
+                    return jsonify({'error': '设定生成失败'}), 500
+
+            elif content_type == 'outline':
+                # 重新生成大纲
+                if not novel.settings:
+                    return jsonify({'error': '请先生成小说设定'}), 400
+
+                if custom_prompt:
+                    result = novel_generator.ai_service.generate_outline_with_custom_prompt(
+                        settings=novel.settings,
+                        target_chapters=novel.target_chapters,
+                        custom_prompt=custom_prompt,
+                        novel_id=novel.id
+                    )
+                else:
+                    result = novel_generator.ai_service.generate_outline(
+                        settings=novel.settings,
+                        target_chapters=novel.target_chapters,
+                        novel_id=novel.id
+                    )
+
+                if result:
+                    record_revision(novel.id, 0, 'outline', result, 'regenerate',
+                                    usage=usage, previous=novel.outline)
+                    novel_generator.update_outline(novel, result)
+                    db.session.commit()
+                    return jsonify({'message': '大纲重新生成成功', 'content': result})
+                else:
+                    return jsonify({'error': '大纲生成失败'}), 500
+
+            elif content_type == 'chapter_outline':
+                # 重新生成章节细纲
+                if not chapter_id:
+                    return jsonify({'error': '缺少章节ID'}), 400
+
+                chapter = Chapter.query.get_or_404(chapter_id)
+                if chapter.novel_id != novel_id:
+                    return jsonify({'error': '章节不属于该小说'}), 400
+
+                chapter_info = novel_generator.get_chapter_info(novel, chapter.chapter_number)
+                words_per_chapter = novel.target_words // novel.target_chapters
+
+                if custom_prompt:
+                    result = novel_generator.ai_service.generate_detailed_outline_with_custom_prompt(
+                        chapter_info=chapter_info,
+                        settings=novel.settings,
+                        outline=novel.outline,
+                        chapter_number=chapter.chapter_number,
+                        target_words=words_per_chapter,
+                        custom_prompt=custom_prompt,
+                        novel_id=novel.id
+                    )
+                else:
+                    result = novel_generator.ai_service.generate_detailed_outline(
+                        chapter_info=chapter_info,
+                        settings=novel.settings,
+                        outline=novel.outline,
+                        chapter_number=chapter.chapter_number,
+                        target_words=words_per_chapter,
+                        novel_id=novel.id
+                    )
+
+                if result:
+                    record_revision(novel.id, chapter.chapter_number, 'detailed_outline', result, 'regenerate',
+                                    usage=usage, previous=chapter.detailed_outline)
+                    chapter.detailed_outline = result
+                    db.session.commit()
+                    return jsonify({'message': f'第{chapter.chapter_number}章细纲重新生成成功', 'content': result})
+                else:
+                    return jsonify({'error': '细纲生成失败'}), 500
+
+            elif content_type == 'chapter_content':
+                # 重新生成章节内容
+                if not chapter_id:
+                    return jsonify({'error': '缺少章节ID'}), 400
+
+                chapter = Chapter.query.get_or_404(chapter_id)
+                if chapter.novel_id != novel_id:
+                    return jsonify({'error': '章节不属于该小说'}), 400
+
+                if not chapter.detailed_outline:
+                    return jsonify({'error': '请先生成章节细纲'}), 400
+
+                words_per_chapter = novel.target_words // novel.target_chapters
+
+                if custom_prompt:
+                    result = novel_generator.ai_service.generate_chapter_content_with_custom_prompt(
+                        detailed_outline=chapter.detailed_outline,
+                        settings=novel.settings,
+                        chapter_title=chapter.title,
+                        target_words=words_per_chapter,
+                        custom_prompt=custom_prompt,
+                        novel_id=novel.id,
+                        chapter_number=chapter.chapter_number
+                    )
+                else:
+                    result = novel_generator.ai_service.generate_chapter_content(
+                        detailed_outline=chapter.detailed_outline,
+                        settings=novel.settings,
+                        chapter_title=chapter.title,
+                        target_words=words_per_chapter,
+                        novel_id=novel.id,
+                        chapter_number=chapter.chapter_number,
+                        related_context=novel_generator.get_related_context(novel, chapter)
+                    )
+
+                if result:
+                    record_revision(novel.id, chapter.chapter_number, 'content', result, 'regenerate',
+                                    usage=usage, previous=chapter.content)
+                    chapter.content = result
+                    chapter.word_count = len(result)
+                    db.session.commit()
+                    novel_generator.index_chapter(chapter)
+                    return jsonify({'message': f'第{chapter.chapter_number}章内容重新生成成功', 'content': result})
+                else:
+                    return jsonify({'error': '内容生成失败'}), 500
             else:
-                return jsonify({'error': '内容生成失败'}), 500
-        else:
-            return jsonify({'error': '不支持的内容类型'}), 400
+                return jsonify({'error': '不支持的内容类型'}), 400
 
     except Exception as e:
         return jsonify({'error': f'重新生成失败: {str(e)}'}), 500
@@ -282,6 +461,8 @@ def delete_novel(novel_id):
     novel = Novel.query.get_or_404(novel_id)
     db.session.delete(novel)
     db.session.commit()
+    event_bus.forget(novel_id)
+    exporter.remove_artifacts(novel_id)
     return jsonify({'message': '删除成功'})
 
 
@@ -289,53 +470,482 @@ def delete_novel(novel_id):
 
 @app.route('/api/novels/<int:novel_id>/chapters', methods=['GET'])
 def get_chapters(novel_id):
-    """获取小说的所有章节"""
-    chapters = Chapter.query.filter_by(novel_id=novel_id).order_by(Chapter.chapter_number).all()
-    return jsonify([chapter.to_dict() for chapter in chapters])
+    """分页获取小说的章节
+
+    查询参数：
+        view: full（默认，含细纲、正文和检查结果）或 summary（仅元数据）
+        limit: 每页数量（默认200，最大500）
+        after: 上一页返回的 next_cursor（章节号）
+        since: 只返回 updated_at >= since 的章节（ISO格式），用于增量同步；
+            响应中的 next_since 可作为下一次请求的 since
+
+    next_since 是查询时刻减去 CHAPTER_SYNC_OVERLAP，而不是本页章节的最大 updated_at：
+    updated_at 在提交前生成，先生成时间戳的章节可能后提交，回看一段时间才不会漏掉。
+    回看区间内的章节会重复返回，客户端按 id 合并。翻页同步时应使用第一页的 next_since
+    （各页中最小的一个），翻页期间提交的更新会在下一次同步中取回。
+    """
+    sync_started = datetime.utcnow()
+    view = request.args.get('view', 'full')
+    if view not in ('full', 'summary'):
+        return jsonify({'error': '不支持的 view，可选 summary 或 full'}), 400
+
+    limit = min(max(request.args.get('limit', 200, type=int), 1), 500)
+    after = request.args.get('after', type=int)
+    try:
+        since = _parse_datetime_arg('since')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 版本覆盖该小说的全部章节，查询参数不同的响应通过 ETag 区分
+    chapter_count, chapters_updated_at = _chapters_version(novel_id)
+    etag = _make_etag('chapters', novel_id, chapter_count, chapters_updated_at,
+                      request.query_string.decode('utf-8', 'replace'))
+    not_modified = _not_modified(etag, chapters_updated_at)
+    if not_modified:
+        return not_modified
+
+    if view == 'summary':
+        query = Chapter.summary_query().filter(Chapter.novel_id == novel_id)
+    else:
+        query = Chapter.query.filter(Chapter.novel_id == novel_id)
+
+    if after is not None:
+        query = query.filter(Chapter.chapter_number > after)
+    if since:
+        # 边界时间的章节会重复返回，客户端按 id 合并即可，避免漏掉同一时刻的更新
+        query = query.filter(Chapter.updated_at >= since)
+
+    rows = query.order_by(Chapter.chapter_number).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if view == 'summary':
+        items = [Chapter.summary_to_dict(row) for row in rows]
+    else:
+        items = [row.to_dict() for row in rows]
+
+    next_since = sync_started - timedelta(seconds=Config.CHAPTER_SYNC_OVERLAP)
+
+    response = jsonify({
+        'items': items,
+        'next_cursor': rows[-1].chapter_number if has_more else None,
+        'next_since': next_since.isoformat()
+    })
+    return _with_validators(response, etag, chapters_updated_at)
 
 
 @app.route('/api/chapters/<int:chapter_id>', methods=['GET'])
 def get_chapter(chapter_id):
-    """获取单个章节详情"""
+    """获取单个章节详情，支持 ETag / Last-Modified 条件请求"""
+    updated_at = db.session.query(Chapter.updated_at).filter(Chapter.id == chapter_id).first()
+    if updated_at is None:
+        abort(404)
+
+    etag = _make_etag('chapter', chapter_id, updated_at[0])
+    not_modified = _not_modified(etag, updated_at[0])
+    if not_modified:
+        return not_modified
+
     chapter = Chapter.query.get_or_404(chapter_id)
-    return jsonify(chapter.to_dict())
+    return _with_validators(jsonify(chapter.to_dict()), etag, updated_at[0])
+
+
+# ==================== 进度事件 API ====================
+
+def _sse(event: str, data, event_id: int = None) -> str:
+    """格式化一条 SSE 消息"""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+@app.route('/api/novels/<int:novel_id>/events', methods=['GET'])
+def novel_events(novel_id):
+    """订阅小说生成进度（Server-Sent Events）
+
+    事件类型：
+        snapshot: 连接建立时的小说概要（不含大文本）
+        novel: 状态/阶段变化，updated 字段表示设定或大纲已更新
+        chapter: 章节状态或内容变化，字段同章节列表 view=summary
+        log: 新的生成日志
+        delta: 流式生成的增量文本（开启 AI_STREAM 时）
+        tokens: 单次调用的Token和费用，以及小说累计值
+        resync: 错过了部分事件，客户端应重新拉取全量状态
+    断线重连时浏览器会带上 Last-Event-ID，服务端补发之后的事件。
+    """
+    novel = Novel.query.get_or_404(novel_id)
+
+    # 先订阅再取快照，快照之后发生的变化不会丢失
+    subscription = event_bus.subscribe(novel_id, request.headers.get('Last-Event-ID', type=int))
+    snapshot = novel.to_dict(Chapter.stats_for([novel_id]).get(novel_id), fields=Novel.SUMMARY_FIELDS)
+    # 长连接期间不占用数据库连接
+    db.session.remove()
+
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            yield _sse('snapshot', snapshot)
+            while True:
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    while subscription.get(timeout=0) is not None:
+                        pass
+                    yield _sse('resync', {})
+
+                message = subscription.get(timeout=Config.SSE_KEEPALIVE)
+                if message is None:
+                    yield ': keepalive\n\n'
+                    continue
+                yield _sse(message['event'], message['data'], message['id'])
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 
 # ==================== 日志 API ====================
 
 @app.route('/api/novels/<int:novel_id>/logs', methods=['GET'])
 def get_logs(novel_id):
-    """获取小说生成日志"""
-    limit = request.args.get('limit', 100, type=int)
-    logs = GenerationLog.query.filter_by(novel_id=novel_id).order_by(
-        GenerationLog.created_at.desc()
-    ).limit(limit).all()
+    """获取小说生成日志
+
+    查询参数：
+        limit: 最多返回条数（默认100，最大500）
+        since_id: 只返回 id 大于该值的日志，按 id 升序；不传时返回最新的 limit 条（倒序）
+        wait: 与 since_id 配合的长轮询秒数（最大 LOG_LONG_POLL_MAX），
+            没有新日志时阻塞到有新日志写入或超时，超时返回空列表
+    """
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+    since_id = request.args.get('since_id', type=int)
+
+    if since_id is None:
+        logs = GenerationLog.query.filter_by(novel_id=novel_id).order_by(
+            GenerationLog.created_at.desc()
+        ).limit(limit).all()
+        return jsonify([log.to_dict() for log in logs])
+
+    def logs_since():
+        return GenerationLog.query.filter(
+            GenerationLog.novel_id == novel_id,
+            GenerationLog.id > since_id
+        ).order_by(GenerationLog.id).limit(limit).all()
+
+    wait = min(max(request.args.get('wait', 0, type=float), 0), Config.LOG_LONG_POLL_MAX)
+    if not wait:
+        return jsonify([log.to_dict() for log in logs_since()])
+
+    # 先订阅再查询，查询之后写入的日志一定会唤醒等待
+    subscription = event_bus.subscribe(novel_id)
+    try:
+        logs = logs_since()
+        if not logs:
+            # 等待期间不占用数据库连接
+            db.session.remove()
+            deadline = time.monotonic() + wait
+            remaining = wait
+            while remaining > 0:
+                message = subscription.get(timeout=remaining)
+                if message is None or message['event'] == 'log':
+                    break
+                remaining = deadline - time.monotonic()
+            logs = logs_since()
+    finally:
+        event_bus.unsubscribe(subscription)
+
     return jsonify([log.to_dict() for log in logs])
 
 
+# ==================== 全文检索 API ====================
+
+@app.route('/api/search', methods=['GET'])
+def search_chapters():
+    """检索章节标题、细纲和正文，按相关度返回命中章节及摘要
+
+    查询参数：
+        q: 检索词，多个词用空格分隔（同时命中）
+        novel_id: 只在该小说中检索
+        field: 只检索 title / outline / content
+        limit: 数量（默认20，最大100）
+        offset: 偏移
+    """
+    q = (request.args.get('q') or '').strip()
+    terms = fulltext.query_terms(q)
+    if not terms:
+        return jsonify({'error': '缺少检索词'}), 400
+
+    field = request.args.get('field')
+    if field and field not in fulltext.INDEXED_FIELDS.values():
+        return jsonify({'error': 'field 可选 title、outline、content'}), 400
+
+    if not fulltext.fts_available(db.session.connection()):
+        return jsonify({'error': '全文索引不可用（需要 SQLite FTS5 并执行迁移）'}), 503
+
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    results = fulltext.search(db.session, q, novel_id=request.args.get('novel_id', type=int),
+                              field=field, limit=limit + 1, offset=offset)
+    has_more = len(results) > limit
+    results = results[:limit]
+
+    # 摘要从原文截取：一条语句只读取命中章节的正文和细纲（按 field 只取需要的列），不加载检查结果等其他大文本
+    snippet_fields = [name for name in ('content', 'detailed_outline')
+                      if not field or fulltext.INDEXED_FIELDS[name] == field]
+    texts = {}
+    if snippet_fields and results:
+        rows = db.session.query(Chapter.id, *(getattr(Chapter, name) for name in snippet_fields)).filter(
+            Chapter.id.in_([result['chapter_id'] for result in results])
+        )
+        texts = {row[0]: row[1:] for row in rows}
+    for result in results:
+        snippets = []
+        for name, value in zip(snippet_fields, texts.get(result['chapter_id'], ())):
+            snippets += [{'field': fulltext.INDEXED_FIELDS[name], 'text': snippet}
+                         for snippet in fulltext.make_snippets(value, terms)]
+        result['snippets'] = snippets[:3]
+
+    return jsonify({
+        'query': q,
+        'results': results,
+        'offset': offset,
+        'has_more': has_more
+    })
+
+
+# ==================== 版本历史 API ====================
+
+@app.route('/api/novels/<int:novel_id>/revisions', methods=['GET'])
+def list_revisions(novel_id):
+    """列出产物的历史版本（不含正文），按版本号倒序
+
+    查询参数：
+        field: settings, outline, detailed_outline, content
+        chapter_number: 章节号，细纲和正文必填
+        limit: 数量（默认50，最大200）
+    """
+    db.get_or_404(Novel, novel_id)
+    field = request.args.get('field')
+    if field not in CHECK_FIELDS:
+        return jsonify({'error': f'field 可选 {", ".join(CHECK_FIELDS)}'}), 400
+
+    chapter_number = 0 if field in NOVEL_FIELDS else request.args.get('chapter_number', type=int)
+    if chapter_number is None:
+        return jsonify({'error': '缺少 chapter_number'}), 400
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    revisions = Revision.query.filter_by(
+        novel_id=novel_id, chapter_number=chapter_number, field=field
+    ).order_by(Revision.revision_number.desc()).limit(limit).all()
+    return jsonify([revision.to_dict() for revision in revisions])
+
+
+@app.route('/api/revisions/<int:revision_id>', methods=['GET'])
+def get_revision(revision_id):
+    """获取某个版本的全文和检查结果"""
+    revision = db.get_or_404(Revision, revision_id)
+    data = revision.to_dict()
+    data['text'] = revision_text(revision)
+    data['check_result'] = json.loads(revision.check_result) if revision.check_result else None
+    return jsonify(data)
+
+
+@app.route('/api/revisions/<int:revision_id>/diff', methods=['GET'])
+def diff_revision(revision_id):
+    """对比两个版本，默认与上一版本对比
+
+    查询参数：
+        against: 对比的版本ID，须属于同一产物
+    """
+    revision = db.get_or_404(Revision, revision_id)
+    if request.args.get('against'):
+        base = db.session.get(Revision, request.args.get('against', type=int) or 0)
+        if base is None:
+            return jsonify({'error': '对比的版本不存在'}), 404
+        if (base.novel_id, base.chapter_number, base.field) != \
+                (revision.novel_id, revision.chapter_number, revision.field):
+            return jsonify({'error': '只能对比同一产物的版本'}), 400
+    else:
+        base = previous_revision(revision)
+
+    base_text = revision_text(base) if base is not None else ''
+    base_label = f'v{base.revision_number}' if base is not None else '(空)'
+    result = diff_text(base_text, revision_text(revision), base_label, f'v{revision.revision_number}')
+    result['from'] = base.to_dict() if base is not None else None
+    result['to'] = revision.to_dict()
+    return jsonify(result)
+
+
+@app.route('/api/revisions/<int:revision_id>/restore', methods=['POST'])
+def restore_revision(revision_id):
+    """把产物恢复为某个历史版本（连同当时的检查结果），并记录为新版本，不调用AI"""
+    revision = db.get_or_404(Revision, revision_id)
+    novel = db.get_or_404(Novel, revision.novel_id)
+    text = revision_text(revision)
+
+    if revision.field in NOVEL_FIELDS:
+        target = novel
+    else:
+        target = Chapter.query.filter_by(novel_id=novel.id, chapter_number=revision.chapter_number).first()
+        if target is None:
+            return jsonify({'error': f'第{revision.chapter_number}章已不存在'}), 404
+
+    restored = record_revision(
+        novel.id, revision.chapter_number, revision.field, text, 'restore',
+        previous=getattr(target, revision.field), restored_from=revision.revision_number
+    )
+    if restored.check_result is None:
+        restored.check_score = revision.check_score
+        restored.passed = revision.passed
+        restored.check_result = revision.check_result
+
+    if revision.field == 'outline':
+        novel_generator.update_outline(novel, text)
+    else:
+        setattr(target, revision.field, text)
+        if revision.field == 'content':
+            target.word_count = len(text)
+    setattr(target, CHECK_FIELDS[revision.field], revision.check_result)
+    db.session.commit()
+    if revision.field == 'content':
+        novel_generator.index_chapter(target)
+
+    return jsonify({
+        'message': f'已恢复到版本 v{revision.revision_number}',
+        'revision': restored.to_dict()
+    })
+
+
 # ==================== 导出 API ====================
 
+def _export_format():
+    """读取导出格式参数，默认TXT"""
+    fmt = request.args.get('format') or (request.get_json(silent=True) or {}).get('format') or 'txt'
+    if fmt not in exporter.FORMATS:
+        abort(make_response(jsonify({'error': f'不支持的导出格式: {fmt}'}), 400))
+    return fmt
+
+
 @app.route('/api/novels/<int:novel_id>/export', methods=['POST'])
 def export_novel(novel_id):
-    """导出小说为TXT"""
+    """导出小说（TXT/EPUB），内容未变化时复用已有文件"""
+    fmt = _export_format()
     try:
-        filepath = exporter.export_to_txt(novel_id)
+        filepath, built = exporter.ensure_artifact(novel_id, fmt)
         return jsonify({
-            'message': '导出成功',
-            'filepath': filepath
+            'message': '导出成功' if built else '导出文件已是最新',
+            'filepath': filepath,
+            'format': fmt,
+            'cached': not built
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 
+@app.route('/api/novels/<int:novel_id>/export', methods=['GET'])
+def get_export_state(novel_id):
+    """查询导出状态：当前内容指纹及各格式文件是否为最新"""
+    try:
+        return jsonify(exporter.export_state(novel_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+
+
+def _negotiate_encoding(fmt: str):
+    """按 Accept-Encoding 选择预压缩副本，不可压缩或客户端不接受时返回 None"""
+    if fmt not in COMPRESSIBLE_FORMATS:
+        return None
+    candidates = [
+        encoding for encoding in exporter.available_encodings()
+        if request.accept_encodings[encoding] > 0
+    ]
+    if not candidates:
+        return None
+    # 质量值相同时按服务端优先级（zstd 优先于 gzip）
+    return max(candidates, key=lambda encoding: request.accept_encodings[encoding])
+
+
 @app.route('/api/novels/<int:novel_id>/download', methods=['GET'])
 def download_novel(novel_id):
-    """下载小说TXT文件"""
-    filepath = exporter.get_export_path(novel_id)
-    if not filepath:
-        return jsonify({'error': '文件不存在，请先导出'}), 404
+    """下载导出文件，文件缺失或已过期时先重新生成
+
+    按 Accept-Encoding 返回预压缩副本，支持 Range 断点续传（206）。
+    """
+    fmt = _export_format()
+    try:
+        filepath, _ = exporter.ensure_artifact(novel_id, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return send_file(filepath, as_attachment=True)
+    encoding = _negotiate_encoding(fmt)
+    if encoding:
+        filepath = exporter.ensure_encoded(filepath, encoding)
+
+    novel = db.session.get(Novel, novel_id)
+    # 文件名含内容指纹和编码后缀，可直接作为强 ETag，供 If-Range 校验续传
+    resp = send_file(filepath, mimetype=MIMETYPES[fmt], as_attachment=True,
+                     download_name=exporter.export_filename(novel, fmt),
+                     conditional=True, etag=os.path.basename(filepath))
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    if fmt in COMPRESSIBLE_FORMATS:
+        resp.vary.add('Accept-Encoding')
+    return resp
+
+
+@app.route('/api/novels/<int:novel_id>/export/stream', methods=['GET'])
+def stream_novel_export(novel_id):
+    """边生成边下载，不在服务器上写文件"""
+    fmt = _export_format()
+    try:
+        chunks = exporter.stream(novel_id, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    filename = exporter.export_filename(db.session.get(Novel, novel_id), fmt)
+    return Response(stream_with_context(chunks), mimetype=MIMETYPES[fmt], headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"
+    })
+
+
+@app.route('/api/export/novels', methods=['GET', 'POST'])
+def bulk_export_novels():
+    """批量导出多部小说，打包为 zip 边生成边下载
+
+    参数（查询参数或 JSON）：
+        ids: 小说ID列表，查询参数中用逗号分隔；不提供时导出全部已完成的小说
+        format: txt（默认）或 epub
+    """
+    fmt = _export_format()
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if ids is None and request.args.get('ids'):
+        ids = request.args['ids']
+    if isinstance(ids, str):
+        ids = [novel_id for novel_id in ids.split(',') if novel_id.strip()]
+
+    if ids is not None:
+        try:
+            novel_ids = list(dict.fromkeys(int(novel_id) for novel_id in ids))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids 必须是小说ID列表'}), 400
+    else:
+        novel_ids = list(db.session.scalars(
+            select(Novel.id).where(Novel.status == 'completed').order_by(Novel.id)
+        ))
+
+    if not novel_ids:
+        return jsonify({'error': '没有可导出的小说'}), 400
+    if len(novel_ids) > Config.BULK_EXPORT_MAX:
+        return jsonify({'error': f'单次最多导出 {Config.BULK_EXPORT_MAX} 部小说'}), 400
+
+    filename = f"novels_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{fmt}.zip"
+    chunks = exporter.stream_bulk(novel_ids, fmt, app)
+    return Response(stream_with_context(chunks), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
 
 
 # ==================== AI配置 API ====================
@@ -446,152 +1056,277 @@ def get_stats():
         'generating_novels': generating_novels,
         'failed_novels': failed_novels,
         'total_tokens': total_tokens,
-        'total_cost': total_cost
+        'total_cost': total_cost,
+        'check_parse_stats': novel_generator.ai_service.get_check_parse_stats(),
+        'event_subscribers': event_bus.subscriber_count()
     })
 
 
-@app.route('/api/token-stats', methods=['GET'])
-def get_token_stats():
-    """获取Token使用统计"""
-    # 获取查询参数
-    days = request.args.get('days', 7, type=int)
-    novel_id = request.args.get('novel_id', type=int)
+def _rollup_sums(model):
+    """汇总表的累加列"""
+    return (
+        func.sum(model.total_tokens).label('total_tokens'),
+        func.sum(model.prompt_tokens).label('prompt_tokens'),
+        func.sum(model.completion_tokens).label('completion_tokens'),
+        func.sum(model.cost).label('total_cost'),
+        func.sum(model.call_count).label('count'),
+        func.sum(model.duration).label('total_duration')
+    )
 
-    # 基础查询
-    query = TokenUsage.query
 
-    # 按小说筛选
-    if novel_id:
-        query = query.filter_by(novel_id=novel_id)
+def _usage_sums():
+    """直接在 token_usages 明细上聚合，列名与 _rollup_sums 一致"""
+    return (
+        func.sum(TokenUsage.total_tokens).label('total_tokens'),
+        func.sum(TokenUsage.prompt_tokens).label('prompt_tokens'),
+        func.sum(TokenUsage.completion_tokens).label('completion_tokens'),
+        func.sum(TokenUsage.cost).label('total_cost'),
+        func.count(TokenUsage.id).label('count'),
+        func.sum(TokenUsage.duration).label('total_duration')
+    )
 
-    # 按时间筛选
-    if days > 0:
-        start_date = datetime.utcnow() - timedelta(days=days)
-        query = query.filter(TokenUsage.created_at >= start_date)
 
-    # 获取所有记录
-    usages = query.order_by(TokenUsage.created_at.desc()).all()
+def _sums_to_dict(row) -> dict:
+    count = row.count or 0
+    return {
+        'total_tokens': int(row.total_tokens or 0),
+        'prompt_tokens': int(row.prompt_tokens or 0),
+        'completion_tokens': int(row.completion_tokens or 0),
+        'total_cost': float(row.total_cost or 0),
+        'count': int(count),
+        'avg_duration': float(row.total_duration or 0) / count if count else 0
+    }
 
-    # 按阶段统计
-    stage_stats = db.session.query(
-        TokenUsage.stage,
-        func.sum(TokenUsage.total_tokens).label('total_tokens'),
-        func.sum(TokenUsage.cost).label('total_cost'),
-        func.count(TokenUsage.id).label('count')
-    ).group_by(TokenUsage.stage)
 
-    if novel_id:
-        stage_stats = stage_stats.filter_by(novel_id=novel_id)
-    if days > 0:
-        start_date = datetime.utcnow() - timedelta(days=days)
-        stage_stats = stage_stats.filter(TokenUsage.created_at >= start_date)
+@app.route('/api/token-stats', methods=['GET'])
+def get_token_stats():
+    """获取Token使用统计
 
-    stage_stats = stage_stats.all()
+    查询参数：
+        days: 最近多少天（按UTC自然日，含今天），0 表示全部
+        novel_id: 只统计某部小说
 
-    # 按日期统计
-    daily_stats = db.session.query(
-        func.date(TokenUsage.created_at).label('date'),
-        func.sum(TokenUsage.total_tokens).label('total_tokens'),
-        func.sum(TokenUsage.cost).label('total_cost')
-    ).group_by(func.date(TokenUsage.created_at))
+    全局统计读取按日汇总表；指定小说时在该小说的明细上聚合（走 novel_id, created_at 索引）。
+    明细记录请使用 /api/token-usages 分页获取。
+    """
+    days = request.args.get('days', 7, type=int)
+    novel_id = request.args.get('novel_id', type=int)
+    start_day = (datetime.utcnow() - timedelta(days=days - 1)).date() if days > 0 else None
 
     if novel_id:
-        daily_stats = daily_stats.filter_by(novel_id=novel_id)
-    if days > 0:
-        start_date = datetime.utcnow() - timedelta(days=days)
-        daily_stats = daily_stats.filter(TokenUsage.created_at >= start_date)
-
-    daily_stats = daily_stats.order_by(func.date(TokenUsage.created_at)).all()
+        sums = _usage_sums()
+        day_column = func.date(TokenUsage.created_at)
+        stage_column = TokenUsage.stage
+
+        def base_query(*columns):
+            query = db.session.query(*columns).filter(TokenUsage.novel_id == novel_id)
+            if start_day:
+                query = query.filter(TokenUsage.created_at >= datetime.combine(start_day, datetime.min.time()))
+            return query
+    else:
+        sums = _rollup_sums(TokenUsageDaily)
+        day_column = TokenUsageDaily.day
+        stage_column = TokenUsageDaily.stage
+
+        def base_query(*columns):
+            query = db.session.query(*columns)
+            if start_day:
+                query = query.filter(TokenUsageDaily.day >= start_day)
+            return query
+
+    totals = base_query(*sums).one()
+    stage_stats = base_query(stage_column.label('stage'), *sums).group_by(stage_column).all()
+    daily_stats = base_query(day_column.label('date'), *sums).group_by(day_column).order_by(day_column).all()
 
     return jsonify({
-        'usages': [usage.to_dict() for usage in usages],
+        'totals': _sums_to_dict(totals),
         'stage_stats': [
-            {
-                'stage': stat.stage,
-                'total_tokens': stat.total_tokens,
-                'total_cost': float(stat.total_cost),
-                'count': stat.count
-            }
+            dict(_sums_to_dict(stat), stage=stat.stage or None)
             for stat in stage_stats
         ],
         'daily_stats': [
-            {
-                'date': str(stat.date) if stat.date else '',
-                'total_tokens': stat.total_tokens,
-                'total_cost': float(stat.total_cost)
-            }
+            dict(_sums_to_dict(stat), date=str(stat.date) if stat.date else '')
             for stat in daily_stats
         ]
     })
 
 
+@app.route('/api/token-usages', methods=['GET'])
+def get_token_usages():
+    """分页获取Token使用明细（按 id 倒序）
+
+    查询参数：
+        novel_id: 小说筛选
+        stage: 阶段筛选
+        created_after / created_before: 时间范围（ISO格式）
+        limit: 每页数量（默认50，最大500）
+        cursor: 上一页返回的 next_cursor
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    cursor = request.args.get('cursor', type=int)
+    try:
+        created_after = _parse_datetime_arg('created_after')
+        created_before = _parse_datetime_arg('created_before')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = TokenUsage.query
+    if request.args.get('novel_id'):
+        query = query.filter(TokenUsage.novel_id == request.args.get('novel_id', type=int))
+    if request.args.get('stage'):
+        query = query.filter(TokenUsage.stage == request.args['stage'])
+    if created_after:
+        query = query.filter(TokenUsage.created_at >= created_after)
+    if created_before:
+        query = query.filter(TokenUsage.created_at < created_before)
+    if cursor:
+        query = query.filter(TokenUsage.id < cursor)
+
+    usages = query.order_by(TokenUsage.id.desc()).limit(limit + 1).all()
+    has_more = len(usages) > limit
+    usages = usages[:limit]
+
+    return jsonify({
+        'items': [usage.to_dict() for usage in usages],
+        'next_cursor': usages[-1].id if has_more else None
+    })
+
+
 @app.route('/api/novels/<int:novel_id>/token-stats', methods=['GET'])
 def get_novel_token_stats(novel_id):
-    """获取单个小说的Token统计"""
+    """获取单个小说的Token统计（读取按章节汇总表）"""
     novel = Novel.query.get_or_404(novel_id)
+    sums = _rollup_sums(TokenUsageChapter)
+
+    def rollup_query(*columns):
+        return db.session.query(*columns).filter(TokenUsageChapter.novel_id == novel_id)
 
     # 按阶段统计
-    stage_stats = db.session.query(
-        TokenUsage.stage,
-        func.sum(TokenUsage.total_tokens).label('total_tokens'),
-        func.sum(TokenUsage.prompt_tokens).label('prompt_tokens'),
-        func.sum(TokenUsage.completion_tokens).label('completion_tokens'),
-        func.sum(TokenUsage.cost).label('total_cost'),
-        func.count(TokenUsage.id).label('count'),
-        func.avg(TokenUsage.duration).label('avg_duration')
-    ).filter_by(novel_id=novel_id).group_by(TokenUsage.stage).all()
+    stage_stats = rollup_query(TokenUsageChapter.stage, *sums).group_by(TokenUsageChapter.stage).all()
 
     # 按章节统计
-    chapter_stats = db.session.query(
-        TokenUsage.chapter_number,
-        func.sum(TokenUsage.total_tokens).label('total_tokens'),
-        func.sum(TokenUsage.cost).label('total_cost')
-    ).filter_by(novel_id=novel_id).filter(
-        TokenUsage.chapter_number.isnot(None)
-    ).group_by(TokenUsage.chapter_number).order_by(TokenUsage.chapter_number).all()
+    chapter_stats = rollup_query(TokenUsageChapter.chapter_number, *sums).filter(
+        TokenUsageChapter.chapter_number > 0
+    ).group_by(TokenUsageChapter.chapter_number).order_by(TokenUsageChapter.chapter_number).all()
 
     # 按操作类型统计
-    operation_stats = db.session.query(
-        TokenUsage.operation,
-        func.sum(TokenUsage.total_tokens).label('total_tokens'),
-        func.sum(TokenUsage.cost).label('total_cost'),
-        func.count(TokenUsage.id).label('count')
-    ).filter_by(novel_id=novel_id).group_by(TokenUsage.operation).all()
+    operation_stats = rollup_query(TokenUsageChapter.operation, *sums).group_by(TokenUsageChapter.operation).all()
 
     return jsonify({
-        'novel': novel.to_dict(),
+        'novel': novel.to_dict(Chapter.stats_for([novel_id]).get(novel_id)),
         'stage_stats': [
-            {
-                'stage': stat.stage,
-                'total_tokens': stat.total_tokens,
-                'prompt_tokens': stat.prompt_tokens,
-                'completion_tokens': stat.completion_tokens,
-                'total_cost': float(stat.total_cost),
-                'count': stat.count,
-                'avg_duration': float(stat.avg_duration) if stat.avg_duration else 0
-            }
+            dict(_sums_to_dict(stat), stage=stat.stage or None)
             for stat in stage_stats
         ],
         'chapter_stats': [
-            {
-                'chapter_number': stat.chapter_number,
-                'total_tokens': stat.total_tokens,
-                'total_cost': float(stat.total_cost)
-            }
+            dict(_sums_to_dict(stat), chapter_number=stat.chapter_number)
             for stat in chapter_stats
         ],
         'operation_stats': [
-            {
-                'operation': stat.operation,
-                'total_tokens': stat.total_tokens,
-                'total_cost': float(stat.total_cost),
-                'count': stat.count
-            }
+            dict(_sums_to_dict(stat), operation=stat.operation or None)
             for stat in operation_stats
         ]
     })
 
 
+# ==================== 明细导出 API ====================
+
+EXPORT_BATCH_SIZE = 1000  # 服务端游标每批读取的行数，也是每个响应分块包含的行数
+
+
+def _export_filters(model, query):
+    """导出接口共用的筛选：novel_id、stage、created_after / created_before"""
+    if request.args.get('novel_id'):
+        query = query.where(model.novel_id == request.args.get('novel_id', type=int))
+    if request.args.get('stage'):
+        query = query.where(model.stage == request.args['stage'])
+    created_after = _parse_datetime_arg('created_after')
+    created_before = _parse_datetime_arg('created_before')
+    if created_after:
+        query = query.where(model.created_at >= created_after)
+    if created_before:
+        query = query.where(model.created_at < created_before)
+    return query
+
+
+def _stream_export(model, name: str, extra_filters=None):
+    """以 NDJSON 或 CSV 分块流式输出明细
+
+    按 id 顺序用 yield_per 分批读取，只取列值不构造 ORM 对象，内存占用与总行数无关。
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': '不支持的格式，可选 ndjson 或 csv'}), 400
+
+    columns = [column.name for column in model.__table__.columns]
+    query = select(*model.__table__.columns)
+    try:
+        query = _export_filters(model, query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if extra_filters is not None:
+        query = extra_filters(query)
+    query = query.order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def serialize(value):
+        return value.isoformat() if isinstance(value, datetime) else value
+
+    def generate():
+        result = db.session.execute(query)
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # 带 BOM，便于 Excel 正确识别中文
+            buffer.write('\ufeff')
+            writer.writerow(columns)
+            for rows in result.partitions():
+                writer.writerows([serialize(value) for value in row] for row in rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for rows in result.partitions():
+                yield ''.join(
+                    json.dumps({column: serialize(value) for column, value in zip(columns, row)},
+                               ensure_ascii=False) + '\n'
+                    for row in rows
+                )
+
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}'
+    })
+
+
+@app.route('/api/export/token-usages', methods=['GET'])
+def export_token_usages():
+    """流式导出Token使用明细
+
+    查询参数：
+        format: ndjson（默认）或 csv
+        novel_id / stage / created_after / created_before: 筛选条件
+    """
+    return _stream_export(TokenUsage, 'token_usages')
+
+
+@app.route('/api/export/logs', methods=['GET'])
+def export_logs():
+    """流式导出生成日志
+
+    查询参数：
+        format: ndjson（默认）或 csv
+        novel_id / stage / created_after / created_before: 筛选条件
+        level: 日志级别筛选
+    """
+    level = request.args.get('level')
+    return _stream_export(
+        GenerationLog, 'generation_logs',
+        (lambda query: query.where(GenerationLog.level == level)) if level else None
+    )
+
+
 # ==================== 初始化数据库 ====================
 
 @app.before_request
@@ -642,9 +1377,18 @@ def resume_unfinished_novels():
 
 
 if __name__ == '__main__':
-    # 初始化数据库
+    # 初始化数据库并执行未应用的迁移
     with app.app_context():
         db.create_all()
+        run_migrations(db.engine.url.database)
+        fulltext.refresh_availability(db.engine)
+        exporter.collect_garbage()
+        if blob_store is not None and db.engine.dialect.name == 'sqlite':
+            connection = db.engine.raw_connection()
+            try:
+                blob_store.collect_garbage(referenced_digests(connection.cursor()))
+            finally:
+                connection.close()
 
     # 恢复未完成的小说生成任务
     resume_unfinished_novels()
@@ -0,0 +1,141 @@
+"""
+大文本列压缩基准：对比不压缩、zlib、zstd 的写入/读取耗时与数据库文件大小
+
+用法：
+    python bench_compression.py --chapters 500 --words 3000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+import text_codec
+from config import Config
+from models import db, configure_engine, Novel, Chapter
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+# 生成近似中文小说用字分布的文本
+COMMON_CHARS = (
+    '的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后'
+    '小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长'
+    '知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力机给等几很业最'
+)
+PUNCTUATION = '，，，。。！？：'
+
+
+def make_words(rng: random.Random, count: int = 3000):
+    return [''.join(rng.choice(COMMON_CHARS) for _ in range(rng.choice((1, 2, 2, 2, 3, 4)))) for _ in range(count)]
+
+
+def make_text(rng: random.Random, words, length: int) -> str:
+    """按 Zipf 分布抽词拼出段落，压缩率接近真实中文文本"""
+    pieces, size = [], 0
+    while size < length:
+        sentence = ''.join(words[min(int(rng.paretovariate(1.1)) - 1, len(words) - 1)]
+                           for _ in range(rng.randint(4, 12)))
+        sentence += rng.choice(PUNCTUATION)
+        if rng.random() < 0.15:
+            sentence += '\n\n'
+        pieces.append(sentence)
+        size += len(sentence)
+    return ''.join(pieces)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='大文本列压缩基准')
+    parser.add_argument('--chapters', type=int, default=500, help='章节数')
+    parser.add_argument('--words', type=int, default=3000, help='每章正文字数')
+    parser.add_argument('--reads', type=int, default=500, help='随机读取单章的次数')
+    return parser.parse_args(argv)
+
+
+def run(codec: str, args) -> dict:
+    Config.TEXT_COMPRESSION = codec
+    tmp_dir = tempfile.mkdtemp(prefix='novel_bench_')
+    path = os.path.join(tmp_dir, 'bench.db')
+    url = f'sqlite:///{path}'
+    engine = create_engine(url, **Config.engine_options(url))
+    configure_engine(engine, journal_mode=Config.SQLITE_JOURNAL_MODE, synchronous=Config.SQLITE_SYNCHRONOUS)
+    db.metadata.create_all(engine)
+
+    # 各算法使用相同的文本
+    rng = random.Random(42)
+    words = make_words(rng)
+
+    with Session(engine) as session:
+        novel = Novel(title='压缩基准', status='completed', settings=make_text(rng, words, 2000),
+                      outline=make_text(rng, words, 5000))
+        session.add(novel)
+        session.commit()
+        novel_id = novel.id
+
+        rows = [
+            dict(chapter_number=i, title=f'第{i}章',
+                 detailed_outline=make_text(rng, words, 800),
+                 content=make_text(rng, words, args.words),
+                 content_check=make_text(rng, words, 400))
+            for i in range(1, args.chapters + 1)
+        ]
+        raw_bytes = sum(len(row[key].encode('utf-8')) for row in rows
+                        for key in ('detailed_outline', 'content', 'content_check'))
+
+        # 与生成流程相同：每章单独提交
+        start = time.time()
+        for row in rows:
+            session.add(Chapter(novel_id=novel_id, status='completed', **row))
+            session.commit()
+        write_elapsed = time.time() - start
+
+    with engine.connect() as conn:
+        conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+    size = os.path.getsize(path)
+
+    with Session(engine) as session:
+        start = time.time()
+        total = sum(len(content) for content, in session.execute(select(Chapter.content)))
+        scan_elapsed = time.time() - start
+        assert total >= args.chapters * args.words
+
+        latencies = []
+        for _ in range(args.reads):
+            number = rng.randint(1, args.chapters)
+            begin = time.time()
+            session.execute(select(Chapter.content).where(
+                Chapter.novel_id == novel_id, Chapter.chapter_number == number)).scalar_one()
+            latencies.append(time.time() - begin)
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        'raw_mb': raw_bytes / 1024 / 1024,
+        'size_mb': size / 1024 / 1024,
+        'write_ms': write_elapsed / args.chapters * 1000,
+        'scan_s': scan_elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000
+    }
+
+
+def main():
+    args = parse_args()
+    codecs = ['none', 'zlib'] + (['zstd'] if text_codec.zstandard else [])
+    print(f"{args.chapters} 章 × {args.words} 字，随机读取 {args.reads} 次\n")
+    print(f"{'算法':<6} {'原文(MB)':>9} {'库文件(MB)':>10} {'每章写入(ms)':>12} {'全表扫描(s)':>11} "
+          f"{'单章p50(ms)':>11} {'单章p99(ms)':>11}")
+    for codec in codecs:
+        r = run(codec, args)
+        print(f"{codec:<6} {r['raw_mb']:>9.1f} {r['size_mb']:>10.1f} {r['write_ms']:>12.2f} {r['scan_s']:>11.3f} "
+              f"{r['p50']:>11.3f} {r['p99']:>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+数据库并发写入基准：对比默认 SQLite 配置与 Config 中的引擎配置
+
+模拟多个生成线程频繁提交小事务（日志、Token记录、状态更新），同时有读线程模拟前端轮询。
+
+用法：
+    python bench_db.py --writers 12 --commits 200 --readers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from config import Config
+from models import db, configure_engine, Novel, GenerationLog, TokenUsage
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='SQLite 并发写入基准')
+    parser.add_argument('--writers', type=int, default=12, help='写线程数（相当于同时生成的小说数）')
+    parser.add_argument('--commits', type=int, default=200, help='每个写线程的提交次数')
+    parser.add_argument('--readers', type=int, default=4, help='轮询读线程数')
+    return parser.parse_args(argv)
+
+
+def make_engine(path: str, tuned: bool):
+    url = f'sqlite:///{path}'
+    if not tuned:
+        # 默认配置：rollback journal，5秒锁等待
+        return create_engine(url, connect_args={'check_same_thread': False})
+
+    engine = create_engine(url, **Config.engine_options(url))
+    configure_engine(
+        engine,
+        journal_mode=Config.SQLITE_JOURNAL_MODE,
+        synchronous=Config.SQLITE_SYNCHRONOUS,
+        busy_timeout=Config.DB_BUSY_TIMEOUT
+    )
+    return engine
+
+
+def run(tuned: bool, args) -> dict:
+    tmp_dir = tempfile.mkdtemp(prefix='novel_bench_')
+    engine = make_engine(os.path.join(tmp_dir, 'bench.db'), tuned)
+    db.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        novels = [Novel(title=f'基准-{i}', status='generating') for i in range(args.writers)]
+        session.add_all(novels)
+        session.commit()
+        novel_ids = [novel.id for novel in novels]
+
+    errors = []
+    latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def writer(novel_id):
+        with Session(engine) as session:
+            for i in range(args.commits):
+                begin = time.time()
+                try:
+                    # 与生成流程相同的提交模式：日志 → Token记录 → 状态更新
+                    kind = i % 3
+                    if kind == 0:
+                        session.add(GenerationLog(novel_id=novel_id, stage='content', message=f'日志 {i}'))
+                    elif kind == 1:
+                        session.add(TokenUsage(novel_id=novel_id, stage='content', operation='bench',
+                                               prompt_tokens=100, completion_tokens=200, total_tokens=300))
+                    else:
+                        session.execute(update(Novel).where(Novel.id == novel_id)
+                                        .values(updated_at=datetime.utcnow()))
+                    session.commit()
+                    with lock:
+                        latencies.append(time.time() - begin)
+                except OperationalError as e:
+                    session.rollback()
+                    with lock:
+                        errors.append(str(e.orig))
+
+    def reader():
+        with Session(engine) as session:
+            while not stop.is_set():
+                try:
+                    session.execute(select(Novel)).all()
+                    session.execute(select(GenerationLog).order_by(GenerationLog.created_at.desc()).limit(100)).all()
+                    session.rollback()
+                except OperationalError as e:
+                    session.rollback()
+                    with lock:
+                        errors.append(str(e.orig))
+                time.sleep(0.01)
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(novel_id,)) for novel_id in novel_ids]
+    for thread in readers:
+        thread.start()
+
+    start = time.time()
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.time() - start
+
+    stop.set()
+    for thread in readers:
+        thread.join()
+    engine.dispose()
+
+    latencies.sort()
+    return {
+        'commits': len(latencies),
+        'errors': len(errors),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'p50': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p99': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    }
+
+
+def main():
+    args = parse_args()
+    print(f"{args.writers} 个写线程 × {args.commits} 次提交，{args.readers} 个读线程\n")
+    print(f"{'配置':<8} {'成功提交':>8} {'锁错误':>6} {'耗时(s)':>8} {'提交/秒':>8} {'p50(ms)':>8} {'p99(ms)':>8}")
+    for name, tuned in (('默认', False), ('调优', True)):
+        r = run(tuned, args)
+        print(f"{name:<8} {r['commits']:>8} {r['errors']:>6} {r['elapsed']:>8.2f} "
+              f"{r['throughput']:>8.1f} {r['p50']:>8.2f} {r['p99']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
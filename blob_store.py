@@ -0,0 +1,134 @@
+"""
+内容寻址的大文本存储：章节正文和细纲存放在文件系统中，数据库行里只保存 SHA-256
+
+文件按哈希前两级分片存放：<目录>/ab/cd/abcdef...，内容为 UTF-8 原文，相同内容只存一份。
+读取使用 mmap，不经过数据库页缓存和 WAL。
+
+用法：
+    python blob_store.py migrate   # 把数据库中已有的大文本移到外部存储
+    python blob_store.py inline    # 把外部存储的内容写回数据库（停用外部存储前执行）
+    python blob_store.py gc        # 删除不再被引用的文件
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import sys
+import tempfile
+import time
+from typing import Iterable, Iterator
+
+from config import Config
+
+# 新写入的文件在该时间（秒）内不被回收，避免删掉尚未提交的事务刚写入的内容
+GC_GRACE_SECONDS = 3600
+
+
+class BlobStore:
+    """内容寻址的文件存储"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    def put(self, data: bytes) -> str:
+        """写入内容，返回其 SHA-256；内容已存在时只刷新修改时间"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            # 刷新时间，防止被并发的回收误删
+            os.utime(path)
+            return digest
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.blob_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> str:
+        """通过 mmap 读取内容"""
+        try:
+            with open(self.path(digest), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ''
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    return str(m, 'utf-8')
+        except FileNotFoundError:
+            raise RuntimeError(f"外部存储中缺少内容 {digest}") from None
+
+    def digests(self) -> Iterator[str]:
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.startswith('.'):
+                    yield name
+
+    def collect_garbage(self, referenced: Iterable[str]) -> int:
+        """删除不在 referenced 中的文件，返回删除数量"""
+        referenced = set(referenced)
+        now = time.time()
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if name in referenced or now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+                    continue
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+# 全局外部存储，未配置 BLOB_STORE_DIR 时为 None（大文本保存在数据库中）
+blob_store = BlobStore(Config.BLOB_STORE_DIR) if Config.BLOB_STORE_DIR else None
+
+
+def main(argv=None):
+    import sqlite3
+    import text_codec
+    from migrate import default_db_path
+
+    parser = argparse.ArgumentParser(description='大文本外部存储维护')
+    parser.add_argument('command', choices=('migrate', 'inline', 'gc'))
+    parser.add_argument('--db', default=None, help='SQLite 数据库文件路径')
+    args = parser.parse_args(argv)
+
+    if blob_store is None:
+        print("未配置 BLOB_STORE_DIR")
+        return 1
+
+    db_path = args.db or default_db_path()
+    if not db_path or not os.path.exists(db_path):
+        print("数据库文件不存在")
+        return 1
+
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        if args.command == 'migrate':
+            print(f"已移出 {text_codec.externalize_existing(cursor, blob_store)} 个字段")
+        elif args.command == 'inline':
+            print(f"已写回 {text_codec.inline_existing(cursor, blob_store)} 个字段")
+        else:
+            referenced = text_codec.referenced_digests(cursor)
+            print(f"已删除 {blob_store.collect_garbage(referenced)} 个不再引用的文件")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
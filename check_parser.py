@@ -0,0 +1,281 @@
+"""
+质量检查结果解析：统一的JSON提取、修复与字段校验
+"""
+import json
+import re
+from typing import Dict, Any, Optional
+
+
+class CheckParseError(ValueError):
+    """检查结果无法解析为有效的JSON"""
+
+
+# 各类检查的评分维度与通过分数线（与 ai_service 中的 Prompt 保持一致）
+CHECK_SPECS = {
+    'settings': {
+        'score_keys': ['completeness', 'consistency', 'innovation', 'feasibility', 'commercial_value'],
+        'pass_score': 35
+    },
+    'outline': {
+        'score_keys': ['structure', 'logic', 'pacing', 'consistency', 'commercial_value'],
+        'pass_score': 35
+    },
+    'detailed_outline': {
+        'score_keys': ['detail', 'executable', 'consistency', 'quality'],
+        'pass_score': 28
+    },
+    'chapter_content': {
+        'score_keys': ['outline_match', 'writing_quality', 'plot_completeness', 'character', 'readability'],
+        'pass_score': 35
+    }
+}
+
+LIST_FIELDS = ('issues', 'suggestions', 'highlights')
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+def build_response_format(check_type: str) -> Dict[str, Any]:
+    """构造 OpenAI 兼容的 json_schema 结构化输出参数"""
+    spec = CHECK_SPECS[check_type]
+    string_list = {'type': 'array', 'items': {'type': 'string'}}
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': f'check_{check_type}',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'scores': {
+                        'type': 'object',
+                        'properties': {key: {'type': 'number'} for key in spec['score_keys']},
+                        'required': spec['score_keys']
+                    },
+                    'total_score': {'type': 'number'},
+                    'passed': {'type': 'boolean'},
+                    'issues': string_list,
+                    'suggestions': string_list,
+                    'highlights': string_list
+                },
+                'required': ['scores', 'total_score', 'passed', 'issues', 'suggestions']
+            }
+        }
+    }
+
+
+def format_instruction(check_type: str) -> str:
+    """解析失败后重新检查时附加的格式要求"""
+    spec = CHECK_SPECS[check_type]
+    example = {
+        'scores': {key: 0 for key in spec['score_keys']},
+        'total_score': 0,
+        'passed': False,
+        'issues': [],
+        'suggestions': [],
+        'highlights': []
+    }
+    return ('请只返回一个符合以下结构的 JSON 对象，不要包含任何解释、Markdown 代码块或其他文字，'
+            f'数值按实际评分填写：\n{json.dumps(example, ensure_ascii=False)}')
+
+
+def repair_json(text: str) -> str:
+    """修复常见的JSON格式问题
+
+    逐字符扫描，仅在字符串外部处理：全角标点、尾随逗号、Python字面量；
+    字符串内部的裸换行会被转义；截断的字符串和括号会被补全。
+    """
+    out = []
+    stack = []
+    in_string = False
+    closing_quote = '"'
+    escaped = False
+    i = 0
+    length = len(text)
+
+    while i < length:
+        ch = text[i]
+
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == closing_quote:
+                in_string = False
+                ch = '"'
+            elif ch == '"':
+                ch = '\\"'
+            elif ch == '\n':
+                ch = '\\n'
+            elif ch == '\r':
+                ch = ''
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch in '"“':
+            in_string = True
+            closing_quote = '”' if ch == '“' else '"'
+            out.append('"')
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            # 去掉尾随逗号
+            while out and out[-1] in ' \t\r\n':
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if stack:
+                stack.pop()
+            out.append(ch)
+        elif ch == '，':
+            out.append(',')
+        elif ch == '：':
+            out.append(':')
+        elif ch.isalpha():
+            j = i
+            while j < length and text[j].isalpha():
+                j += 1
+            word = text[i:j]
+            out.append(_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 补全被截断的内容
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+    while out and out[-1] in ' \t\r\n,:':
+        out.pop()
+    while stack:
+        out.append(stack.pop())
+
+    return ''.join(out)
+
+
+def _scan_object(text: str, start: int) -> Optional[int]:
+    """从 start 处的 '{' 开始增量扫描，返回配对 '}' 之后的位置；未闭合返回 None"""
+    depth = 0
+    in_string = False
+    escaped = False
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+
+def _loads(candidate: str) -> Optional[Any]:
+    """依次尝试原样解析和修复后解析"""
+    for attempt in (candidate, repair_json(candidate)):
+        try:
+            return json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def extract_json(text: str) -> Dict[str, Any]:
+    """从模型输出中提取JSON对象
+
+    兼容纯JSON、markdown代码块、前后夹杂说明文字以及被截断的输出。
+    """
+    if not text or not text.strip():
+        raise CheckParseError('返回内容为空')
+
+    stripped = text.strip()
+    data = _loads(stripped) if stripped.startswith('{') else None
+    if isinstance(data, dict):
+        return data
+
+    pos = stripped.find('{')
+    while pos != -1:
+        end = _scan_object(stripped, pos)
+        candidate = stripped[pos:end] if end else stripped[pos:]
+        data = _loads(candidate)
+        if isinstance(data, dict):
+            return data
+        if end is None:
+            break
+        pos = stripped.find('{', pos + 1)
+
+    raise CheckParseError(f'未找到有效的JSON对象。原始返回: {stripped[:200]}')
+
+
+def _to_number(value) -> Optional[float]:
+    """把分数字段转为数值，兼容 "8分"、"8/10" 等写法"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = _NUMBER_RE.search(value)
+        if match:
+            number = float(match.group())
+            return int(number) if number.is_integer() else number
+    return None
+
+
+def validate_check_result(data: Dict[str, Any], check_type: str) -> Dict[str, Any]:
+    """校验并规范化检查结果字段
+
+    passed 一律按 total_score 与通过线重新判定，避免模型自相矛盾。
+    """
+    if not isinstance(data, dict):
+        raise CheckParseError('检查结果不是JSON对象')
+
+    spec = CHECK_SPECS[check_type]
+    result = dict(data)
+
+    raw_scores = data.get('scores') if isinstance(data.get('scores'), dict) else {}
+    scores = {}
+    for key, value in raw_scores.items():
+        number = _to_number(value)
+        if number is not None:
+            scores[key] = number
+    result['scores'] = scores
+
+    total_score = _to_number(data.get('total_score'))
+    if total_score is None:
+        missing = [key for key in spec['score_keys'] if key not in scores]
+        if missing:
+            raise CheckParseError(f'缺少总分及评分项: {", ".join(missing)}')
+        total_score = sum(scores[key] for key in spec['score_keys'])
+    result['total_score'] = total_score
+    result['passed'] = total_score >= spec['pass_score']
+
+    for field in LIST_FIELDS:
+        value = data.get(field)
+        if value is None:
+            result[field] = []
+        elif isinstance(value, list):
+            result[field] = [str(item) for item in value]
+        else:
+            result[field] = [str(value)]
+
+    return result
+
+
+def parse_check_result(text: str, check_type: str) -> Dict[str, Any]:
+    """提取、修复并校验检查结果"""
+    return validate_check_result(extract_json(text), check_type)
@@ -11,19 +11,76 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///novels.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # 数据库引擎配置（多个生成线程并发写入）
+    DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 30))  # 等待写锁的秒数
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))  # 连接池大小，应不小于同时生成的小说数
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    TEXT_COMPRESSION = os.getenv('TEXT_COMPRESSION', 'zlib')  # 大文本列压缩：zlib、zstd 或 none
+    BLOB_STORE_DIR = os.getenv('BLOB_STORE_DIR', '')  # 章节正文/细纲的外部存储目录，留空则保存在数据库中
+
     # AI模型配置
     AI_API_BASE = os.getenv('AI_API_BASE', 'https://api.openai.com/v1')
     AI_API_KEY = os.getenv('AI_API_KEY', '')
     AI_MODEL = os.getenv('AI_MODEL', 'gpt-4')
+    # 生成类调用使用流式输出，把增量文本实时推送到进度页（需接口支持 stream）
+    AI_STREAM = os.getenv('AI_STREAM', 'false').lower() == 'true'
 
     # 小说生成配置
     DEFAULT_CHAPTER_LENGTH = 3000  # 每章默认字数
     MAX_RETRIES = 3  # AI生成失败最大重试次数
+    CHECK_PARSE_RETRIES = 2  # 检查结果解析失败时重新检查的次数
+    RETRY_DELAY = float(os.getenv('RETRY_DELAY', 2))  # 检查未通过后重新生成前的等待秒数
+    # 生成正文时从前文检索相关片段附加到提示词，任一项为 0 则不检索
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 5))  # 最多附加的片段数
+    RETRIEVAL_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', 1500))  # 片段总 token 上限
+
+    # LLM调用录制目录，设置后每部小说的请求/响应会追加写入 novel_<id>.jsonl.gz
+    LLM_RECORD_DIR = os.getenv('LLM_RECORD_DIR', '')
+
+    # 进度事件流
+    EVENT_HISTORY_SIZE = 200  # 每部小说保留的历史事件数，用于断线重连补发
+    SSE_KEEPALIVE = 15  # SSE 心跳间隔（秒）
+    LOG_LONG_POLL_MAX = 30  # 日志长轮询最长等待秒数
+    # 章节增量同步的回看秒数：updated_at 在提交前生成，时间戳较早的章节可能较晚才提交，
+    # next_since 取查询时刻减去该值（须大于 DB_BUSY_TIMEOUT），客户端按 id 合并重复的章节
+    CHAPTER_SYNC_OVERLAP = float(os.getenv('CHAPTER_SYNC_OVERLAP', 60))
 
     # 导出配置
     EXPORT_DIR = 'exports'
+    EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', 4))  # EPUB 章节渲染及批量导出的并行数
+    BULK_EXPORT_MAX = 200  # 批量导出单次最多的小说数
+    # 由前置 nginx/Apache 直接发送导出文件（X-Sendfile），需在前置服务器上配置对应模块
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+
+    @staticmethod
+    def engine_options(database_uri: str) -> dict:
+        """根据数据库类型生成 SQLAlchemy 引擎参数"""
+        if not database_uri.startswith('sqlite'):
+            return {
+                'pool_size': Config.DB_POOL_SIZE,
+                'max_overflow': Config.DB_MAX_OVERFLOW,
+                'pool_pre_ping': True
+            }
+
+        options = {
+            'connect_args': {
+                'timeout': Config.DB_BUSY_TIMEOUT,
+                'check_same_thread': False
+            }
+        }
+        # 内存数据库使用单连接池，不支持连接池大小参数
+        if ':memory:' not in database_uri and database_uri not in ('sqlite://', 'sqlite:///'):
+            options['pool_size'] = Config.DB_POOL_SIZE
+            options['max_overflow'] = Config.DB_MAX_OVERFLOW
+        return options
 
     @staticmethod
     def init_app(app):
         """初始化应用配置"""
         os.makedirs(Config.EXPORT_DIR, exist_ok=True)
+        app.config.setdefault(
+            'SQLALCHEMY_ENGINE_OPTIONS',
+            Config.engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+        )
@@ -0,0 +1,224 @@
+"""
+EPUB 3 生成：章节 XHTML 在线程池中渲染，zip 容器按条目顺序流式写出
+
+写入目标可以是普通文件，也可以是 ChunkSink。流式输出时使用可回写的 ChunkSink：
+只在条目之间取走数据，zipfile 写完条目后能回填本地文件头中的 CRC 和长度，
+不使用数据描述符（OCF 要求 mimetype 条目的文件头不带数据描述符）。
+任何时刻内存中只有一批章节的正文。
+"""
+import html
+import io
+import struct
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+
+MIMETYPE = 'application/epub+zip'
+
+STYLESHEET = """body { font-family: serif; line-height: 1.8; margin: 0 5%; }
+h1, h2 { text-align: center; margin: 1.5em 0 1em; }
+p { text-indent: 2em; margin: 0.4em 0; }
+"""
+
+
+class ChunkSink:
+    """供生成器逐段取走已写入字节的写入目标
+
+    Args:
+        rewindable: 允许 seek 回尚未取走的数据并改写。zipfile 据此认为目标可 seek，
+            写完条目后回填文件头；调用方必须只在条目之间 drain。
+            为 False 时不支持 seek，zipfile 改用数据描述符，可以在条目中途 drain。
+    """
+
+    def __init__(self, rewindable: bool = False):
+        self.rewindable = rewindable
+        self._buffer = bytearray()
+        self._base = 0  # 已取走的字节数
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        offset = self._position - self._base
+        self._buffer[offset:offset + len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def seekable(self) -> bool:
+        return self.rewindable
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if not self.rewindable:
+            raise io.UnsupportedOperation("ChunkSink 不支持 seek")
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._base + len(self._buffer)
+        if not self._base <= offset <= self._base + len(self._buffer):
+            raise io.UnsupportedOperation("不能 seek 到已取走或尚未写入的位置")
+        self._position = offset
+        return offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._base += len(self._buffer)
+        self._buffer = bytearray()
+        return data
+
+
+def has_ocf_mimetype(data: bytes) -> bool:
+    """zip 开头是否为符合 OCF 的 mimetype 条目：标志位为 0（无数据描述符）、不压缩、无扩展字段"""
+    name = b'mimetype' + MIMETYPE.encode('ascii')
+    if len(data) < 30 + len(name) or data[:4] != b'PK\x03\x04':
+        return False
+    flags, method = struct.unpack('<HH', data[6:10])
+    size, = struct.unpack('<I', data[22:26])
+    extra_length, = struct.unpack('<H', data[28:30])
+    return flags == 0 and method == zipfile.ZIP_STORED and size == len(MIMETYPE) \
+        and extra_length == 0 and data[30:30 + len(name)] == name
+
+
+def chapter_filename(chapter_number: int) -> str:
+    return f'OEBPS/chapter_{chapter_number:04d}.xhtml'
+
+
+def _page(title: str, body: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        'xml:lang="zh-CN" lang="zh-CN">\n'
+        f'<head><meta charset="utf-8"/><title>{html.escape(title)}</title>'
+        '<link rel="stylesheet" type="text/css" href="style.css"/></head>\n'
+        f'<body>\n{body}\n</body>\n</html>\n'
+    ).encode('utf-8')
+
+
+def _paragraphs(text: str) -> str:
+    return '\n'.join(f'<p>{html.escape(line.strip())}</p>' for line in text.splitlines() if line.strip())
+
+
+def chapter_heading(chapter_number: int, title: str) -> str:
+    return f'第{chapter_number}章 {title or ""}'.strip()
+
+
+def render_chapter(row) -> bytes:
+    """渲染单章 XHTML，row 为 (章节号, 标题, 正文)"""
+    chapter_number, title, content = row
+    heading = chapter_heading(chapter_number, title)
+    body = _paragraphs(content) if content else '<p>[本章内容未生成]</p>'
+    return _page(heading, f'<section epub:type="chapter">\n<h2>{html.escape(heading)}</h2>\n{body}\n</section>')
+
+
+def render_text_page(title: str, text: str) -> bytes:
+    return _page(title, f'<section>\n<h2>{html.escape(title)}</h2>\n{_paragraphs(text)}\n</section>')
+
+
+def _container_xml() -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+        '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+        '</container>\n'
+    )
+
+
+def _package_opf(identifier: str, title: str, pages: List[Tuple[str, str, str]]) -> str:
+    """pages: [(id, 文件名, 标题)]，按阅读顺序"""
+    modified = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    manifest = '\n'.join(
+        f'<item id="{page_id}" href="{href}" media-type="application/xhtml+xml"/>'
+        for page_id, href, _ in pages
+    )
+    spine = '\n'.join(f'<itemref idref="{page_id}"/>' for page_id, _, _ in pages)
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="zh-CN">\n'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+        f'<dc:identifier id="book-id">{identifier}</dc:identifier>\n'
+        f'<dc:title>{html.escape(title)}</dc:title>\n'
+        '<dc:language>zh-CN</dc:language>\n'
+        f'<meta property="dcterms:modified">{modified}</meta>\n'
+        '</metadata>\n'
+        '<manifest>\n'
+        '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+        '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>\n'
+        '<item id="css" href="style.css" media-type="text/css"/>\n'
+        f'{manifest}\n'
+        '</manifest>\n'
+        f'<spine toc="ncx">\n{spine}\n</spine>\n'
+        '</package>\n'
+    )
+
+
+def _nav_xhtml(title: str, pages: List[Tuple[str, str, str]]) -> bytes:
+    items = '\n'.join(f'<li><a href="{href}">{html.escape(label)}</a></li>' for _, href, label in pages)
+    return _page(title, f'<nav epub:type="toc" id="toc">\n<h1>目录</h1>\n<ol>\n{items}\n</ol>\n</nav>')
+
+
+def _toc_ncx(identifier: str, title: str, pages: List[Tuple[str, str, str]]) -> str:
+    """EPUB 2 阅读器使用的目录"""
+    points = '\n'.join(
+        f'<navPoint id="{page_id}" playOrder="{order}"><navLabel><text>{html.escape(label)}</text></navLabel>'
+        f'<content src="{href}"/></navPoint>'
+        for order, (page_id, href, label) in enumerate(pages, start=1)
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+        f'<head><meta name="dtb:uid" content="{identifier}"/></head>\n'
+        f'<docTitle><text>{html.escape(title)}</text></docTitle>\n'
+        f'<navMap>\n{points}\n</navMap>\n'
+        '</ncx>\n'
+    )
+
+
+def write_epub(f, title: str, fingerprint: str, settings: str,
+               chapter_index: Iterable[Tuple[int, str]], chapters: Iterable[tuple],
+               workers: int = 4, batch_size: int = 20) -> Iterator[None]:
+    """把 EPUB 写入文件对象，每写完一个条目 yield 一次
+
+    Args:
+        chapter_index: [(章节号, 标题)]，用于生成目录和 manifest，不含正文
+        chapters: 按章节号顺序的 (章节号, 标题, 正文)，可以是数据库的流式结果
+        workers: 渲染章节 XHTML 的线程数
+    """
+    identifier = f'urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, fingerprint)}'
+    pages = []
+    if settings:
+        pages.append(('settings', 'settings.xhtml', '小说设定'))
+    pages.extend(
+        (f'chapter_{number:04d}', chapter_filename(number)[len('OEBPS/'):], chapter_heading(number, chapter_title))
+        for number, chapter_title in chapter_index
+    )
+
+    with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        # mimetype 必须是第一个条目且不压缩
+        zf.writestr(zipfile.ZipInfo('mimetype'), MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        zf.writestr('META-INF/container.xml', _container_xml())
+        zf.writestr('OEBPS/content.opf', _package_opf(identifier, title, pages))
+        zf.writestr('OEBPS/nav.xhtml', _nav_xhtml(title, pages))
+        zf.writestr('OEBPS/toc.ncx', _toc_ncx(identifier, title, pages))
+        zf.writestr('OEBPS/style.css', STYLESHEET)
+        if settings:
+            zf.writestr('OEBPS/settings.xhtml', render_text_page('小说设定', settings))
+        yield
+
+        # 分批渲染，按章节顺序写入；每批渲染完成前不会读取下一批正文
+        chapters = iter(chapters)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while True:
+                batch = list(islice(chapters, batch_size))
+                if not batch:
+                    break
+                for row, document in zip(batch, pool.map(render_chapter, batch)):
+                    zf.writestr(chapter_filename(row[0]), document)
+                    yield
+    yield
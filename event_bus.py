@@ -0,0 +1,97 @@
+"""
+进程内事件总线：生成流程发布进度事件，SSE 接口按小说订阅
+
+事件编号全局单调递增，每部小说保留最近一段历史，
+客户端断线重连时通过 Last-Event-ID 补发错过的事件。
+"""
+import queue
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Any, Optional
+
+from config import Config
+
+
+class Subscription:
+    """单个订阅者的事件队列"""
+
+    def __init__(self, novel_id: int, maxsize: int):
+        self.novel_id = novel_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        # 消费过慢导致队列溢出时置位，订阅端应让客户端重新拉取全量状态
+        self.overflowed = False
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """等待下一条事件，超时返回 None"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """按小说分组的发布/订阅
+
+    Args:
+        history: 每部小说保留的历史事件数，用于断线补发
+        queue_size: 每个订阅者的队列上限
+    """
+
+    def __init__(self, history: int = 200, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._history = defaultdict(lambda: deque(maxlen=history))
+        self._subscribers = defaultdict(set)
+
+    def publish(self, novel_id: int, event: str, data: Dict[str, Any]) -> int:
+        """发布事件，返回事件编号"""
+        with self._lock:
+            event_id = self._next_id
+            self._next_id += 1
+            message = {'id': event_id, 'event': event, 'data': data}
+            self._history[novel_id].append(message)
+            subscribers = list(self._subscribers.get(novel_id, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+        return event_id
+
+    def subscribe(self, novel_id: int, last_event_id: int = None) -> Subscription:
+        """订阅小说事件；给出 last_event_id 时先补发其后的历史事件"""
+        subscription = Subscription(novel_id, self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                history = self._history.get(novel_id, ())
+                # 历史已被截断时无法完整补发，交给客户端重新同步
+                if history and history[0]['id'] > last_event_id + 1:
+                    subscription.overflowed = True
+                for message in history:
+                    if message['id'] > last_event_id:
+                        subscription.queue.put_nowait(message)
+            self._subscribers[novel_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.novel_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.novel_id]
+
+    def forget(self, novel_id: int):
+        """删除小说时清理其历史事件"""
+        with self._lock:
+            self._history.pop(novel_id, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+# 全局事件总线
+event_bus = EventBus(history=Config.EVENT_HISTORY_SIZE)
@@ -1,95 +1,483 @@
+import gzip
+import hashlib
+import json
 import os
-from models import Novel, Chapter
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+from sqlalchemy import select
+from models import db, Novel, Chapter
+from epub_builder import ChunkSink, has_ocf_mimetype, write_epub
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖，未安装时只提供 gzip
+    zstandard = None
+
+# 每批从数据库读取的章节数，同一时刻内存中最多只有这么多章正文
+CHAPTER_BATCH_SIZE = 20
+
+# 各格式的 MIME 类型
+MIMETYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'epub': 'application/epub+zip',
+}
+
+# 导出格式变化时递增，使已有产物的指纹全部失效
+EXPORT_FORMAT_VERSION = 1
+
+# 预压缩副本：Content-Encoding -> 文件后缀，按优先级排列
+ENCODING_SUFFIXES = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+}
+
+# 需要预压缩的格式（EPUB 本身是 zip，再压缩没有收益）
+COMPRESSIBLE_FORMATS = ('txt',)
+
+# 批量打包时复制文件的块大小
+COPY_CHUNK_SIZE = 64 * 1024
+
+# 写入中断残留的临时文件超过该时间（秒）后清理
+STALE_TMP_AGE = 3600
 
 
 class NovelExporter:
-    """小说导出器"""
+    """小说导出器
+
+    导出产物按内容指纹存放在 <export_dir>/novel_<id>/<指纹>.<格式>，
+    内容未变化时直接复用，变化后重新生成并清理旧产物。
+    """
 
-    def __init__(self, export_dir='exports'):
+    FORMATS = ('txt', 'epub')
+
+    def __init__(self, export_dir='exports', workers=4):
         self.export_dir = export_dir
+        # EPUB 章节渲染线程数
+        self.workers = workers
         os.makedirs(export_dir, exist_ok=True)
+        # 同一部小说同时只构建一次
+        self._locks = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
 
     def export_to_txt(self, novel_id: int) -> str:
-        """导出小说为TXT格式"""
+        """导出小说为TXT格式，内容未变化时直接返回已有文件"""
+        path, _ = self.ensure_artifact(novel_id, 'txt')
+        return path
+
+    def ensure_artifact(self, novel_id: int, fmt: str) -> Tuple[str, bool]:
+        """确保指定格式的导出产物是最新的
+
+        Returns:
+            (文件路径, 本次是否重新生成)
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+
+        novel = self._get_exportable_novel(novel_id)
+        fingerprint = self.fingerprint(novel)
+        path = self.artifact_path(novel.id, fingerprint, fmt)
+        if os.path.exists(path):
+            return path, False
+
+        with self._lock_for(novel.id):
+            if os.path.exists(path):
+                return path, False
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, lambda f: self._build(fmt, novel, f))
+            if fmt in COMPRESSIBLE_FORMATS:
+                for encoding in self.available_encodings():
+                    self._compress(path, encoding)
+            self._collect_novel(novel, fingerprint)
+        return path, True
+
+    @staticmethod
+    def available_encodings() -> Tuple[str, ...]:
+        """当前环境可生成的预压缩编码"""
+        return tuple(encoding for encoding in ENCODING_SUFFIXES if encoding != 'zstd' or zstandard)
+
+    def ensure_encoded(self, path: str, encoding: str) -> str:
+        """返回产物的预压缩副本路径，副本缺失时（如旧版本生成的产物）补建"""
+        encoded = path + ENCODING_SUFFIXES[encoding]
+        if not os.path.exists(encoded):
+            self._compress(path, encoding)
+        return encoded
+
+    def _compress(self, path: str, encoding: str):
+        """生成预压缩副本；内容确定，同一产物多次压缩得到相同字节，断点续传不会错位"""
+        def write(f):
+            with open(path, 'rb') as src:
+                if encoding == 'zstd':
+                    zstandard.ZstdCompressor(level=19).copy_stream(src, f)
+                else:
+                    with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=9, mtime=0) as dst:
+                        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+        self._write_atomic(path + ENCODING_SUFFIXES[encoding], write)
+
+    def ensure_many(self, novel_ids, fmt: str, app) -> Iterator[Tuple[int, Optional[str], bool, Optional[str]]]:
+        """批量确保导出产物为最新，按完成顺序逐个返回
+
+        已是最新的产物立即返回，缺失或过期的在线程池中并行生成。
+
+        Yields:
+            (小说ID, 文件路径, 本次是否重新生成, 错误信息)
+        """
+        if fmt not in self.FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+
+        current, pending, skipped = [], [], []
+        for novel_id in novel_ids:
+            try:
+                novel = self._get_exportable_novel(novel_id)
+            except ValueError as e:
+                skipped.append((novel_id, str(e)))
+                continue
+            path = self.artifact_path(novel.id, self.fingerprint(novel), fmt)
+            if os.path.exists(path):
+                current.append((novel_id, path))
+            else:
+                pending.append(novel_id)
+
+        def build(novel_id):
+            with app.app_context():
+                return self.ensure_artifact(novel_id, fmt)
+
+        # 先提交缺失产物的构建，输出已有产物的同时后台并行生成
+        pool = ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(pending) or 1)))
+        futures = {}
+        try:
+            futures.update((pool.submit(build, novel_id), novel_id) for novel_id in pending)
+            for novel_id, error in skipped:
+                yield novel_id, None, False, error
+            for novel_id, path in current:
+                yield novel_id, path, False, None
+            for future in as_completed(futures):
+                try:
+                    path, built = future.result()
+                except Exception as e:
+                    yield futures[future], None, False, str(e)
+                else:
+                    yield futures[future], path, built, None
+        finally:
+            # 客户端中途断开时不再启动排队中的构建
+            # （shutdown 的 cancel_futures 参数需要 Python 3.9，这里逐个取消以兼容 3.8）
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def _build(self, fmt: str, novel: Novel, f):
+        """把指定格式的内容写入二进制文件对象"""
+        if fmt == 'epub':
+            for _ in self._write_epub(novel, f):
+                pass
+            return
+
+        for piece in self.iter_txt(novel):
+            f.write(piece.encode('utf-8'))
+
+    def _write_epub(self, novel: Novel, f) -> Iterator[None]:
+        """写入 EPUB，目录只读取章节号和标题，正文分批流式读取"""
+        chapter_index = db.session.execute(
+            select(Chapter.chapter_number, Chapter.title)
+            .where(Chapter.novel_id == novel.id)
+            .order_by(Chapter.chapter_number)
+        ).all()
+        return write_epub(
+            f, novel.title, self.fingerprint(novel), novel.settings,
+            chapter_index, self._iter_chapters(novel.id),
+            workers=self.workers, batch_size=CHAPTER_BATCH_SIZE
+        )
+
+    def _write_atomic(self, path: str, write):
+        """写入同目录下的临时文件后原子替换，下载方不会读到写了一半的文件"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.export_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _lock_for(self, novel_id: int) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks[novel_id]
+
+    def fingerprint(self, novel: Novel) -> str:
+        """导出内容指纹：小说的标题和更新时间，加上各章节的 id 和更新时间
+
+        只读取元数据列，不加载正文。
+        """
+        digest = hashlib.sha1(
+            f"{EXPORT_FORMAT_VERSION}|{novel.id}|{novel.title}|{novel.updated_at.isoformat() if novel.updated_at else ''}"
+            .encode('utf-8')
+        )
+        rows = db.session.execute(
+            select(Chapter.id, Chapter.updated_at)
+            .where(Chapter.novel_id == novel.id)
+            .order_by(Chapter.chapter_number)
+        )
+        for chapter_id, updated_at in rows:
+            digest.update(f"|{chapter_id}:{updated_at.isoformat() if updated_at else ''}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def novel_dir(self, novel_id: int) -> str:
+        return os.path.join(self.export_dir, f'novel_{novel_id}')
+
+    def artifact_path(self, novel_id: int, fingerprint: str, fmt: str) -> str:
+        return os.path.join(self.novel_dir(novel_id), f'{fingerprint}.{fmt}')
+
+    def export_state(self, novel_id: int) -> dict:
+        """导出状态：当前指纹，以及各格式的产物是否为最新"""
         novel = Novel.query.get(novel_id)
         if not novel:
             raise ValueError(f"小说ID {novel_id} 不存在")
 
-        if novel.status != 'completed':
-            raise ValueError(f"小说尚未完成，当前状态: {novel.status}")
+        fingerprint = self.fingerprint(novel)
+        artifacts = {}
+        for fmt in self.FORMATS:
+            path = self.artifact_path(novel.id, fingerprint, fmt)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                artifacts[fmt] = {
+                    'current': True,
+                    'filename': self.export_filename(novel, fmt),
+                    'size': stat.st_size,
+                    'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+                    # 各预压缩副本的大小
+                    'encoded_sizes': {
+                        encoding: os.path.getsize(path + suffix)
+                        for encoding, suffix in ENCODING_SUFFIXES.items()
+                        if os.path.exists(path + suffix)
+                    }
+                }
+            else:
+                artifacts[fmt] = {'current': False, 'filename': self.export_filename(novel, fmt)}
+
+        return {
+            'novel_id': novel.id,
+            'exportable': novel.status == 'completed',
+            'fingerprint': fingerprint,
+            'artifacts': artifacts
+        }
+
+    def _collect_novel(self, novel: Novel, fingerprint: str):
+        """删除该小说指纹已过期的产物，以及旧版本按标题命名的导出文件"""
+        directory = self.novel_dir(novel.id)
+        for name in os.listdir(directory):
+            if name.startswith(fingerprint) or name.startswith('.export_'):
+                continue
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+        legacy = os.path.join(self.export_dir, self.export_filename(novel, 'txt'))
+        if os.path.isfile(legacy):
+            os.remove(legacy)
+
+    def remove_artifacts(self, novel_id: int):
+        """删除小说时清理其全部导出产物"""
+        shutil.rmtree(self.novel_dir(novel_id), ignore_errors=True)
+
+    def collect_garbage(self) -> int:
+        """清理已删除小说的产物目录和中断残留的临时文件，返回删除的条目数"""
+        existing = {novel_id for novel_id, in db.session.query(Novel.id)}
+        removed = 0
+        now = time.time()
+
+        for name in os.listdir(self.export_dir):
+            path = os.path.join(self.export_dir, name)
+            if not (name.startswith('novel_') and os.path.isdir(path)):
+                continue
+            novel_id = name[len('novel_'):]
+            if not novel_id.isdigit() or int(novel_id) not in existing:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+                continue
+            for entry in os.listdir(path):
+                entry_path = os.path.join(path, entry)
+                if entry.startswith('.export_') and now - os.path.getmtime(entry_path) > STALE_TMP_AGE:
+                    os.remove(entry_path)
+                    removed += 1
+
+        return removed
+
+    def stream_txt(self, novel_id: int) -> Iterator[bytes]:
+        """直接生成TXT的字节流，用于不落盘地输出到HTTP响应"""
+        novel = self._get_exportable_novel(novel_id)
+        return (piece.encode('utf-8') for piece in self.iter_txt(novel))
+
+    def stream_epub(self, novel_id: int) -> Iterator[bytes]:
+        """直接生成EPUB的字节流，每写完一个 zip 条目输出一次"""
+        novel = self._get_exportable_novel(novel_id)
+        # 只在条目之间取走数据，zip 文件头可回填，不使用数据描述符
+        sink = ChunkSink(rewindable=True)
+
+        def generate():
+            checked = False
+            for _ in self._write_epub(novel, sink):
+                data = sink.drain()
+                if data:
+                    if not checked:
+                        if not has_ocf_mimetype(data):
+                            raise RuntimeError("EPUB 开头的 mimetype 条目不符合 OCF 要求")
+                        checked = True
+                    yield data
+            data = sink.drain()
+            if data:
+                yield data
+
+        return generate()
 
-        # 构建文件内容
-        content = self._build_txt_content(novel)
+    def stream_bulk(self, novel_ids, fmt: str, app) -> Iterator[bytes]:
+        """把多部小说的导出文件打包成 zip 字节流
 
-        # 生成文件名
-        filename = f"{novel.title}_{novel.id}.txt"
-        filepath = os.path.join(self.export_dir, filename)
+        哪部先就绪就先写入哪部，末尾附 manifest.json 记录每部小说的结果。
+        EPUB 本身已压缩，按存储方式放入；TXT 使用 deflate。
+        """
+        compression = zipfile.ZIP_STORED if fmt == 'epub' else zipfile.ZIP_DEFLATED
+        artifacts = self.ensure_many(novel_ids, fmt, app)
 
-        # 写入文件
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(content)
+        def generate():
+            sink = ChunkSink()
+            manifest = []
+            with zipfile.ZipFile(sink, 'w', compression=compression) as zf:
+                for novel_id, path, built, error in artifacts:
+                    if error:
+                        manifest.append({'novel_id': novel_id, 'status': 'skipped', 'error': error})
+                        continue
 
-        return filepath
+                    try:
+                        src = open(path, 'rb')
+                    except OSError as e:
+                        # 读取前产物已被新一轮导出替换
+                        manifest.append({'novel_id': novel_id, 'status': 'skipped', 'error': str(e)})
+                        continue
 
-    def _build_txt_content(self, novel: Novel) -> str:
-        """构建TXT文件内容"""
-        lines = []
+                    filename = self.export_filename(db.session.get(Novel, novel_id), fmt)
+                    with src, zf.open(filename, 'w') as dst:
+                        while True:
+                            block = src.read(COPY_CHUNK_SIZE)
+                            if not block:
+                                break
+                            dst.write(block)
+                            data = sink.drain()
+                            if data:
+                                yield data
+                    manifest.append({
+                        'novel_id': novel_id,
+                        'filename': filename,
+                        'status': 'exported' if built else 'cached'
+                    })
+                    yield sink.drain()
 
+                zf.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+            yield sink.drain()
+
+        return generate()
+
+    def stream(self, novel_id: int, fmt: str) -> Iterator[bytes]:
+        if fmt not in self.FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        if fmt == 'epub':
+            return self.stream_epub(novel_id)
+        return self.stream_txt(novel_id)
+
+    def export_filename(self, novel: Novel, fmt: str) -> str:
+        """下载时使用的文件名"""
+        return f"{novel.title}_{novel.id}.{fmt}"
+
+    def _get_exportable_novel(self, novel_id: int) -> Novel:
+        novel = Novel.query.get(novel_id)
+        if not novel:
+            raise ValueError(f"小说ID {novel_id} 不存在")
+
+        if novel.status != 'completed':
+            raise ValueError(f"小说尚未完成，当前状态: {novel.status}")
+
+        return novel
+
+    def iter_txt(self, novel: Novel) -> Iterator[str]:
+        """按顺序生成TXT文件内容的各个片段，拼接后即完整文件"""
+        first = True
+        for line in self._txt_lines(novel):
+            if first:
+                first = False
+                yield line
+            else:
+                yield '\n'
+                yield line
+
+    def _txt_lines(self, novel: Novel) -> Iterator[str]:
+        """TXT文件的各行，章节正文整体作为一行"""
         # 标题
-        lines.append('=' * 60)
-        lines.append(novel.title.center(56))
-        lines.append('=' * 60)
-        lines.append('')
-        lines.append('')
+        yield '=' * 60
+        yield novel.title.center(56)
+        yield '=' * 60
+        yield ''
+        yield ''
 
         # 小说设定（可选）
         if novel.settings:
-            lines.append('【小说设定】')
-            lines.append('')
-            lines.append(novel.settings)
-            lines.append('')
-            lines.append('=' * 60)
-            lines.append('')
-            lines.append('')
+            yield '【小说设定】'
+            yield ''
+            yield novel.settings
+            yield ''
+            yield '=' * 60
+            yield ''
+            yield ''
 
         # 章节内容
-        chapters = Chapter.query.filter_by(novel_id=novel.id).order_by(Chapter.chapter_number).all()
-
-        for chapter in chapters:
+        for chapter_number, title, content in self._iter_chapters(novel.id):
             # 章节标题
-            lines.append(f"第{chapter.chapter_number}章 {chapter.title}")
-            lines.append('')
-            lines.append('')
+            yield f"第{chapter_number}章 {title}"
+            yield ''
+            yield ''
 
             # 章节内容
-            if chapter.content:
-                lines.append(chapter.content)
+            if content:
+                yield content
             else:
-                lines.append('[本章内容未生成]')
+                yield '[本章内容未生成]'
 
-            lines.append('')
-            lines.append('')
-            lines.append('-' * 60)
-            lines.append('')
-            lines.append('')
+            yield ''
+            yield ''
+            yield '-' * 60
+            yield ''
+            yield ''
 
         # 结尾
-        lines.append('')
-        lines.append('=' * 60)
-        lines.append('全文完'.center(56))
-        lines.append('=' * 60)
+        yield ''
+        yield '=' * 60
+        yield '全文完'.center(56)
+        yield '=' * 60
 
-        return '\n'.join(lines)
+    def _iter_chapters(self, novel_id: int):
+        """按章节号分批读取 (章节号, 标题, 正文)，不加载细纲和检查结果"""
+        query = select(Chapter.chapter_number, Chapter.title, Chapter.content).where(
+            Chapter.novel_id == novel_id
+        ).order_by(Chapter.chapter_number).execution_options(yield_per=CHAPTER_BATCH_SIZE)
+        for row in db.session.execute(query):
+            yield row
 
-    def get_export_path(self, novel_id: int) -> str:
-        """获取导出文件路径"""
+    def get_export_path(self, novel_id: int, fmt: str = 'txt') -> Optional[str]:
+        """获取与当前内容一致的导出文件路径，不存在或已过期时返回 None"""
         novel = Novel.query.get(novel_id)
         if not novel:
             return None
 
-        filename = f"{novel.title}_{novel.id}.txt"
-        filepath = os.path.join(self.export_dir, filename)
-
+        filepath = self.artifact_path(novel.id, self.fingerprint(novel), fmt)
         if os.path.exists(filepath):
             return filepath
         return None
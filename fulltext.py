@@ -0,0 +1,202 @@
+"""
+章节全文检索（SQLite FTS5）
+
+FTS5 自带的分词器不切分中文，Python 的 sqlite3 也无法注册自定义分词器，
+因此入库前在 Python 中分词：连续的中日韩文字切成重叠的二元组（"林峰出现" → 林峰 峰出 出现），
+每段末尾再补一个单字，单字查询用前缀匹配即可覆盖所有位置；拉丁字母和数字按单词小写。
+分好的词以空格连接写入 chapter_fts，由 unicode61 分词器按空格切分。
+查询词按同样方式切分后组成短语查询，摘要从章节原文中截取。
+
+索引随章节的插入、更新、删除在同一事务中维护（见 Chapter 的 mapper 事件）。
+"""
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, inspect, text
+
+from models import Chapter
+
+FTS_TABLE = 'chapter_fts'
+
+# 建表语句，rowid 即 chapters.id
+CREATE_SQL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, outline, content,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+"""
+
+# 参与索引的章节字段 → FTS 列
+INDEXED_FIELDS = {'title': 'title', 'detailed_outline': 'outline', 'content': 'content'}
+
+# bm25 列权重：标题 > 细纲 > 正文
+BM25_WEIGHTS = (5.0, 2.0, 1.0)
+
+# 假名、中日韩统一表意文字（含扩展A、兼容区）、谚文
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[0-9A-Za-z\u00c0-\u024f]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+# engine → 是否已建立全文索引表。mapper 事件只查这里，避免每次写章节都查询 sqlite_master；
+# 执行迁移后用 refresh_availability() 重新检测
+_engine_fts = {}
+
+
+def _run_tokens(run: str) -> List[str]:
+    if not _CJK_RE.match(run):
+        return [run.lower()]
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)] + [run[-1]]
+
+
+def tokenize(value: Optional[str]) -> str:
+    """把文本切分为以空格分隔的索引词"""
+    if not value:
+        return ''
+    return ' '.join(token for run in _TOKEN_RE.findall(value) for token in _run_tokens(run))
+
+
+def query_terms(query: str) -> List[str]:
+    """查询串中的检索词（按空白和标点切开）"""
+    return _TOKEN_RE.findall(query or '')
+
+
+def build_match(terms: List[str], column: str = None) -> str:
+    """把检索词转为 FTS5 查询：多字词为二元组短语，单字为前缀匹配，各词之间为 AND"""
+    parts = []
+    for term in terms:
+        if _CJK_RE.match(term):
+            if len(term) == 1:
+                parts.append(f'"{term}"*')
+            else:
+                parts.append('"' + ' '.join(term[i:i + 2] for i in range(len(term) - 1)) + '"')
+        else:
+            parts.append(f'"{term.lower()}"')
+    match = ' '.join(parts)
+    if column:
+        match = f'{column} : ({match})'
+    return match
+
+
+def make_snippets(value: str, terms: List[str], width: int = 30, limit: int = 3,
+                  pre: str = '【', post: str = '】') -> List[str]:
+    """从原文截取包含检索词的片段，命中处用 pre/post 标出"""
+    if not value or not terms:
+        return []
+    pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+
+    snippets = []
+    covered = -1
+    for match in pattern.finditer(value):
+        if match.start() < covered:
+            continue
+        start = max(0, match.start() - width)
+        end = min(len(value), match.end() + width)
+        window = value[start:end].replace('\n', ' ')
+        window = pattern.sub(lambda m: f'{pre}{m.group(0)}{post}', window)
+        snippets.append(('…' if start > 0 else '') + window + ('…' if end < len(value) else ''))
+        covered = end
+        if len(snippets) >= limit:
+            break
+    return snippets
+
+
+def fts_available(connection) -> bool:
+    """数据库中是否已建立全文索引表（非 SQLite 或迁移未执行时为 False）"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    return connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+    ).first() is not None
+
+
+def refresh_availability(engine) -> bool:
+    """重新检测并缓存 engine 上的全文索引表是否存在（迁移 v009 执行后调用）"""
+    with engine.connect() as connection:
+        _engine_fts[engine] = fts_available(connection)
+    return _engine_fts[engine]
+
+
+def _indexing_enabled(connection) -> bool:
+    """章节写入时是否维护索引，按 engine 缓存检测结果"""
+    enabled = _engine_fts.get(connection.engine)
+    if enabled is None:
+        enabled = _engine_fts[connection.engine] = fts_available(connection)
+    return enabled
+
+
+def _index_row(connection, chapter_id: int, values: Dict[str, Optional[str]]):
+    connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': chapter_id})
+    connection.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, title, outline, content) VALUES (:id, :title, :outline, :content)"),
+        {
+            'id': chapter_id,
+            'title': tokenize(values.get('title')),
+            'outline': tokenize(values.get('detailed_outline')),
+            'content': tokenize(values.get('content'))
+        }
+    )
+
+
+@event.listens_for(Chapter, 'after_insert')
+def _chapter_inserted(mapper, connection, target):
+    if _indexing_enabled(connection):
+        _index_row(connection, target.id, {field: getattr(target, field) for field in INDEXED_FIELDS})
+
+
+@event.listens_for(Chapter, 'after_update')
+def _chapter_updated(mapper, connection, target):
+    state = inspect(target)
+    # 只有标题、细纲、正文变化时才重建该行索引，状态更新等不触发
+    if not any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+        return
+    if _indexing_enabled(connection):
+        _index_row(connection, target.id, {field: getattr(target, field) for field in INDEXED_FIELDS})
+
+
+@event.listens_for(Chapter, 'after_delete')
+def _chapter_deleted(mapper, connection, target):
+    if _indexing_enabled(connection):
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': target.id})
+
+
+def search(session, query: str, novel_id: int = None, field: str = None,
+           limit: int = 20, offset: int = 0) -> List[dict]:
+    """检索章节，按 bm25 相关度排序
+
+    Args:
+        field: 只在 title / outline / content 中检索
+    Returns:
+        [{'chapter_id', 'novel_id', 'novel_title', 'chapter_number', 'title', 'score'}]
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    sql = f"""
+        SELECT c.id, c.novel_id, n.title, c.chapter_number, c.title,
+               bm25({FTS_TABLE}, {', '.join(str(weight) for weight in BM25_WEIGHTS)}) AS rank
+        FROM {FTS_TABLE}
+        JOIN chapters c ON c.id = {FTS_TABLE}.rowid
+        JOIN novels n ON n.id = c.novel_id
+        WHERE {FTS_TABLE} MATCH :match
+    """
+    params = {'match': build_match(terms, field), 'limit': limit, 'offset': offset}
+    if novel_id is not None:
+        sql += " AND c.novel_id = :novel_id"
+        params['novel_id'] = novel_id
+    sql += " ORDER BY rank LIMIT :limit OFFSET :offset"
+
+    return [
+        {
+            'chapter_id': chapter_id,
+            'novel_id': row_novel_id,
+            'novel_title': novel_title,
+            'chapter_number': chapter_number,
+            'title': title,
+            'score': round(-rank, 4)
+        }
+        for chapter_id, row_novel_id, novel_title, chapter_number, title, rank
+        in session.execute(text(sql), params)
+    ]
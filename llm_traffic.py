@@ -0,0 +1,126 @@
+"""
+LLM 调用录制与回放
+
+录制：每部小说一个只追加的 gzip JSONL 文件（每条记录一个 gzip 成员，可安全追加），
+第一条为小说参数，其后每次 _call_api 记录一条请求摘要、响应和耗时。
+回放：按 (operation, chapter_number) 分组、按录制顺序依次返回，
+不访问真实接口，可按原速或加速还原调用耗时。
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Any, Optional, Tuple
+
+from models import Novel
+
+RECORD_VERSION = 1
+
+
+def request_digest(data: Dict[str, Any]) -> str:
+    """请求体摘要，用于比对回放时的请求是否与录制一致"""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def log_path(directory: str, novel_id: int) -> str:
+    return os.path.join(directory, f'novel_{novel_id}.jsonl.gz')
+
+
+class TrafficRecorder:
+    """把 LLM 请求/响应追加写入每部小说的录制文件"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, novel_id: int, entry: Dict[str, Any]):
+        """追加一条调用记录，文件不存在时先写入小说参数"""
+        path = log_path(self.directory, novel_id)
+        lines = []
+
+        with self._lock:
+            if not os.path.exists(path):
+                lines.append(self._meta(novel_id))
+            lines.append(dict(entry, type='call', ts=time.time()))
+
+            try:
+                with gzip.open(path, 'at', encoding='utf-8') as f:
+                    for line in lines:
+                        f.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')) + '\n')
+            except OSError as e:
+                print(f"LLM调用录制失败: {str(e)}")
+
+    def _meta(self, novel_id: int) -> Dict[str, Any]:
+        novel = Novel.query.get(novel_id)
+        meta = {'type': 'meta', 'version': RECORD_VERSION, 'novel_id': novel_id, 'ts': time.time()}
+        if novel:
+            meta.update({
+                'title': novel.title,
+                'theme': novel.theme,
+                'background': novel.background,
+                'target_words': novel.target_words,
+                'target_chapters': novel.target_chapters
+            })
+        return meta
+
+
+class TrafficReplayer:
+    """从录制文件回放 LLM 响应
+
+    Args:
+        path: 录制文件路径
+        speed: 回放速度。0 表示不等待，1 表示按原始耗时，10 表示加速10倍
+    """
+
+    def __init__(self, path: str, speed: float = 0.0):
+        self.path = path
+        self.speed = speed
+        self.meta = {}
+        self._queues = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.stats = {'replayed': 0, 'misses': 0, 'mismatches': 0}
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                if entry.get('type') == 'meta':
+                    self.meta = entry
+                else:
+                    self._queues[(entry.get('operation'), entry.get('chapter_number'))].append(entry)
+
+    def replay(self, operation: str, chapter_number: Optional[int],
+               digest: str = None) -> Tuple[int, Optional[Dict[str, Any]], str, Optional[Dict[str, Any]]]:
+        """取出下一条匹配的录制响应
+
+        Returns:
+            (状态码, 响应体, 错误文本, 录制记录)。录制中没有对应调用时返回状态码 0。
+        """
+        with self._lock:
+            queue = self._queues.get((operation, chapter_number))
+            if not queue:
+                self.stats['misses'] += 1
+                return 0, None, f'录制中没有更多 {operation} (第{chapter_number}章) 的调用', None
+            entry = queue.popleft()
+            self.stats['replayed'] += 1
+            if digest and entry.get('request_digest') and digest != entry['request_digest']:
+                self.stats['mismatches'] += 1
+
+        if self.speed > 0 and entry.get('duration'):
+            time.sleep(entry['duration'] / self.speed)
+
+        if entry.get('status') != 200:
+            return entry.get('status') or 0, None, entry.get('error') or '', entry
+
+        body = {
+            'choices': [{'message': {'role': 'assistant', 'content': entry.get('content')}}],
+            'usage': entry.get('usage') or {}
+        }
+        return 200, body, '', entry
@@ -0,0 +1,126 @@
+"""
+压测驱动脚本：在本机用模拟AI服务跑完整的小说生成流程，统计吞吐和并发扩展性
+
+先启动模拟服务：
+    python mock_ai_server.py --port 8001 --latency-mean 0.2
+再运行：
+    python load_test.py --api-base http://127.0.0.1:8001/v1 --novels 8 --concurrency 1,4,8
+
+使用独立的临时数据库，不会影响 instance/novels.db。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='小说生成压测')
+    parser.add_argument('--api-base', default='http://127.0.0.1:8001/v1', help='模拟AI服务地址')
+    parser.add_argument('--novels', type=int, default=4, help='每个并发档位生成的小说数')
+    parser.add_argument('--concurrency', default='1,2,4', help='并发档位，逗号分隔')
+    parser.add_argument('--chapters', type=int, default=3, help='每部小说章节数')
+    parser.add_argument('--words', type=int, default=3000, help='每部小说目标字数')
+    parser.add_argument('--database', default=None, help='数据库URL，默认使用临时SQLite文件')
+    return parser.parse_args(argv)
+
+
+def run_level(app, novel_generator, models, concurrency: int, args) -> dict:
+    """在指定并发下生成一批小说并汇总结果"""
+    db, Novel, TokenUsage = models.db, models.Novel, models.TokenUsage
+
+    with app.app_context():
+        novels = [
+            Novel(
+                title=f'压测小说-c{concurrency}-{i + 1}',
+                theme='压测',
+                background='模拟背景',
+                target_words=args.words,
+                target_chapters=args.chapters,
+                status='pending'
+            )
+            for i in range(args.novels)
+        ]
+        db.session.add_all(novels)
+        db.session.commit()
+        novel_ids = [novel.id for novel in novels]
+
+    def generate(novel_id):
+        with app.app_context():
+            return novel_generator.generate_novel(novel_id)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(generate, novel_ids))
+    elapsed = time.time() - start
+
+    with app.app_context():
+        usages = TokenUsage.query.filter(TokenUsage.novel_id.in_(novel_ids)).all()
+        calls = len(usages)
+        tokens = sum(usage.total_tokens or 0 for usage in usages)
+        avg_call = sum(usage.duration or 0 for usage in usages) / calls if calls else 0
+
+    completed = sum(1 for result in results if result)
+    return {
+        'concurrency': concurrency,
+        'completed': completed,
+        'failed': len(results) - completed,
+        'elapsed': elapsed,
+        'novels_per_hour': completed / elapsed * 3600 if elapsed else 0,
+        'calls': calls,
+        'calls_per_sec': calls / elapsed if elapsed else 0,
+        'tokens': tokens,
+        'avg_call': avg_call
+    }
+
+
+def main():
+    args = parse_args()
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    # 必须在导入 app 之前设置数据库，Config 在导入时读取环境变量
+    tmp_dir = None
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='novel_load_')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'load.db')}"
+
+    import models
+    from app import app, novel_generator
+
+    with app.app_context():
+        models.db.create_all()
+        models.AIConfig.query.update({'is_active': False})
+        models.db.session.add(models.AIConfig(
+            name=f'mock-{int(time.time())}',
+            api_base=args.api_base,
+            api_key='mock',
+            model_name='mock-model',
+            config_type='both',
+            is_active=True
+        ))
+        models.db.session.commit()
+
+    print(f"数据库: {os.environ['DATABASE_URL']}")
+    print(f"每档 {args.novels} 部小说，每部 {args.chapters} 章 / {args.words} 字\n")
+    print(f"{'并发':>4} {'完成':>4} {'失败':>4} {'耗时(s)':>8} {'小说/小时':>10} {'调用/秒':>8} {'平均调用(s)':>11} {'Tokens':>10}")
+
+    for concurrency in levels:
+        r = run_level(app, novel_generator, models, concurrency, args)
+        print(f"{r['concurrency']:>4} {r['completed']:>4} {r['failed']:>4} {r['elapsed']:>8.1f} "
+              f"{r['novels_per_hour']:>10.1f} {r['calls_per_sec']:>8.2f} {r['avg_call']:>11.3f} {r['tokens']:>10}")
+
+    if tmp_dir:
+        print(f"\n临时数据库保留在 {tmp_dir}，可用于分析")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+数据库迁移工具：按版本号顺序执行 migrations/ 下尚未应用的迁移
+
+用法：
+    python migrate.py            # 执行所有未应用的迁移
+    python migrate.py --status   # 查看迁移状态
+    python migrate.py --db path  # 指定数据库文件
+"""
+import argparse
+import importlib
+import os
+import pkgutil
+import re
+import sqlite3
+import sys
+from datetime import datetime
+
+import migrations
+from config import Config
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+MIGRATION_NAME_RE = re.compile(r'^v(\d+)_(\w+)$')
+
+
+def default_db_path(database_uri: str = None) -> str:
+    """由数据库URL推导SQLite文件路径（相对路径与 Flask-SQLAlchemy 一致，位于 instance/ 下）"""
+    database_uri = database_uri or Config.SQLALCHEMY_DATABASE_URI
+    if not database_uri.startswith('sqlite:///'):
+        return None
+    path = database_uri[len('sqlite:///'):]
+    if not path or path == ':memory:':
+        return None
+    if os.path.isabs(path):
+        return path
+    return os.path.join('instance', path)
+
+
+def discover():
+    """按版本号排序的 (版本, 名称, 模块)"""
+    found = []
+    for module_info in pkgutil.iter_modules(migrations.__path__):
+        match = MIGRATION_NAME_RE.match(module_info.name)
+        if match:
+            module = importlib.import_module(f'migrations.{module_info.name}')
+            found.append((int(match.group(1)), match.group(2), module))
+    return sorted(found, key=lambda item: item[0])
+
+
+def _applied_versions(cursor) -> dict:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(200),
+            applied_at DATETIME
+        )
+    """)
+    cursor.execute("SELECT version, applied_at FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+
+def run_migrations(db_path: str = None) -> int:
+    """执行所有未应用的迁移，返回本次执行的数量"""
+    db_path = db_path or default_db_path()
+    if not db_path or not os.path.exists(db_path):
+        print("数据库文件不存在，无需迁移")
+        return 0
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    count = 0
+
+    try:
+        applied = _applied_versions(cursor)
+        conn.commit()
+
+        for version, name, module in discover():
+            if version in applied:
+                continue
+
+            print(f"正在执行迁移 v{version:03d}: {name} ...")
+            try:
+                module.upgrade(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow().isoformat())
+                )
+                conn.commit()
+                count += 1
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"迁移 v{version:03d} 失败: {e}")
+                raise
+
+        if count:
+            print(f"已执行 {count} 个迁移")
+        else:
+            print("数据库已是最新版本")
+    finally:
+        conn.close()
+
+    return count
+
+
+def show_status(db_path: str = None):
+    db_path = db_path or default_db_path()
+    applied = {}
+    if db_path and os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            applied = _applied_versions(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    for version, name, module in discover():
+        state = f"已应用 {applied[version]}" if version in applied else "未应用"
+        print(f"v{version:03d}  {name:<30} {state}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='数据库迁移')
+    parser.add_argument('--db', default=None, help='SQLite 数据库文件路径')
+    parser.add_argument('--status', action='store_true', help='仅查看迁移状态')
+    args = parser.parse_args()
+
+    print("\n" + "="*60)
+    print("数据库迁移")
+    print("="*60 + "\n")
+    if args.status:
+        show_status(args.db)
+    else:
+        try:
+            run_migrations(args.db)
+        except sqlite3.Error:
+            sys.exit(1)
+    print("\n" + "="*60)
+    print("完成")
+    print("="*60 + "\n")
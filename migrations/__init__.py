@@ -0,0 +1,21 @@
+"""
+版本化数据库迁移
+
+每个迁移是一个 vNNN_<说明>.py 模块，提供 upgrade(cursor) 函数，由 migrate.py 按版本号顺序执行。
+迁移需要可重复执行：新建数据库由 db.create_all() 直接建出完整结构，迁移只补齐旧库缺失的部分。
+"""
+
+
+def table_exists(cursor, table: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
+
+def column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute(f"PRAGMA table_info({table})")
+    return column in [row[1] for row in cursor.fetchall()]
+
+
+def index_exists(cursor, index: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (index,))
+    return cursor.fetchone() is not None
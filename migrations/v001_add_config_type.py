@@ -0,0 +1,20 @@
+"""
+为 AIConfig 表添加 config_type 字段
+"""
+from migrations import table_exists, column_exists
+
+
+def upgrade(cursor):
+    if not table_exists(cursor, 'ai_configs') or column_exists(cursor, 'ai_configs', 'config_type'):
+        return
+
+    # 添加新列，已有配置默认同时用于生成和校验
+    cursor.execute("""
+        ALTER TABLE ai_configs
+        ADD COLUMN config_type VARCHAR(20) DEFAULT 'both'
+    """)
+    cursor.execute("""
+        UPDATE ai_configs
+        SET config_type = 'both'
+        WHERE config_type IS NULL
+    """)
@@ -0,0 +1,20 @@
+"""
+为 Novel 表添加 is_paused 字段
+"""
+from migrations import table_exists, column_exists
+
+
+def upgrade(cursor):
+    if not table_exists(cursor, 'novels') or column_exists(cursor, 'novels', 'is_paused'):
+        return
+
+    # 添加新列，默认值为 0 (False)
+    cursor.execute("""
+        ALTER TABLE novels
+        ADD COLUMN is_paused BOOLEAN DEFAULT 0
+    """)
+    cursor.execute("""
+        UPDATE novels
+        SET is_paused = 0
+        WHERE is_paused IS NULL
+    """)
@@ -0,0 +1,26 @@
+"""
+为 Novel 表添加 outline_index 字段，并为已有大纲建立索引
+"""
+from migrations import table_exists, column_exists
+from outline_index import parse_outline, dump_index
+
+
+def upgrade(cursor):
+    if not table_exists(cursor, 'novels'):
+        return
+
+    if not column_exists(cursor, 'novels', 'outline_index'):
+        cursor.execute("""
+            ALTER TABLE novels
+            ADD COLUMN outline_index TEXT
+        """)
+
+    cursor.execute("""
+        SELECT id, outline FROM novels
+        WHERE outline IS NOT NULL AND outline_index IS NULL
+    """)
+    for novel_id, outline in cursor.fetchall():
+        cursor.execute(
+            "UPDATE novels SET outline_index = ? WHERE id = ?",
+            (dump_index(parse_outline(outline)), novel_id)
+        )
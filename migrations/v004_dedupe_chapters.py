@@ -0,0 +1,34 @@
+"""
+清理重复章节，并为 chapters(novel_id, chapter_number) 添加唯一索引
+"""
+from migrations import table_exists, index_exists
+
+
+def upgrade(cursor):
+    if not table_exists(cursor, 'chapters') or index_exists(cursor, 'ux_chapters_novel_chapter'):
+        return
+
+    # 每组重复章节保留一条：已完成优先，其次内容最长，最后取最新的记录
+    cursor.execute("""
+        DELETE FROM chapters
+        WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY novel_id, chapter_number
+                    ORDER BY (status = 'completed') DESC,
+                             LENGTH(COALESCE(content, '')) DESC,
+                             updated_at DESC,
+                             id DESC
+                ) AS rank
+                FROM chapters
+            )
+            WHERE rank = 1
+        )
+    """)
+    if cursor.rowcount:
+        print(f"  已删除 {cursor.rowcount} 条重复章节")
+
+    cursor.execute("""
+        CREATE UNIQUE INDEX ux_chapters_novel_chapter
+        ON chapters (novel_id, chapter_number)
+    """)
@@ -0,0 +1,18 @@
+"""
+为日志、Token统计和小说列表的高频查询添加组合索引
+"""
+from migrations import table_exists
+
+INDEXES = [
+    ('generation_logs', 'ix_generation_logs_novel_created', 'novel_id, created_at'),
+    ('token_usages', 'ix_token_usages_novel_created', 'novel_id, created_at'),
+    ('token_usages', 'ix_token_usages_created_stage', 'created_at, stage'),
+    ('novels', 'ix_novels_status_created', 'status, created_at'),
+]
+
+
+def upgrade(cursor):
+    for table, name, columns in INDEXES:
+        if table_exists(cursor, table):
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    cursor.execute("ANALYZE")
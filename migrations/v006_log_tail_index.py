@@ -0,0 +1,11 @@
+"""
+为按 since_id 增量拉取日志添加 (novel_id, id) 索引
+"""
+from migrations import table_exists
+
+
+def upgrade(cursor):
+    if table_exists(cursor, 'generation_logs'):
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_generation_logs_novel_id ON generation_logs (novel_id, id)"
+        )
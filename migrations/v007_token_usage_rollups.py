@@ -0,0 +1,70 @@
+"""
+创建 Token 使用汇总表，并从 token_usages 明细重建汇总数据
+"""
+from migrations import table_exists
+
+VALUE_COLUMNS = """
+    call_count INTEGER DEFAULT 0,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    total_tokens INTEGER DEFAULT 0,
+    cost FLOAT DEFAULT 0.0,
+    duration FLOAT DEFAULT 0.0
+"""
+
+VALUE_SUMS = """
+    COUNT(*), SUM(COALESCE(prompt_tokens, 0)), SUM(COALESCE(completion_tokens, 0)),
+    SUM(COALESCE(total_tokens, 0)), SUM(COALESCE(cost, 0)), SUM(COALESCE(duration, 0))
+"""
+
+
+def upgrade(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS token_usage_daily (
+            id INTEGER PRIMARY KEY,
+            day DATE NOT NULL,
+            stage VARCHAR(50) NOT NULL DEFAULT '',
+            model_name VARCHAR(100) NOT NULL DEFAULT '',
+            operation VARCHAR(100) NOT NULL DEFAULT '',
+            {VALUE_COLUMNS},
+            CONSTRAINT ux_token_usage_daily_key UNIQUE (day, stage, model_name, operation)
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS token_usage_chapters (
+            id INTEGER PRIMARY KEY,
+            novel_id INTEGER NOT NULL REFERENCES novels (id),
+            chapter_number INTEGER NOT NULL DEFAULT 0,
+            stage VARCHAR(50) NOT NULL DEFAULT '',
+            operation VARCHAR(100) NOT NULL DEFAULT '',
+            {VALUE_COLUMNS},
+            CONSTRAINT ux_token_usage_chapters_key UNIQUE (novel_id, chapter_number, stage, operation)
+        )
+    """)
+
+    if not table_exists(cursor, 'token_usages'):
+        return
+
+    # 明细是唯一的数据来源，整体重建可以覆盖建表后已累加的部分
+    cursor.execute("DELETE FROM token_usage_daily")
+    cursor.execute(f"""
+        INSERT INTO token_usage_daily
+            (day, stage, model_name, operation,
+             call_count, prompt_tokens, completion_tokens, total_tokens, cost, duration)
+        SELECT DATE(created_at), COALESCE(stage, ''), COALESCE(model_name, ''), COALESCE(operation, ''),
+               {VALUE_SUMS}
+        FROM token_usages
+        WHERE created_at IS NOT NULL
+        GROUP BY DATE(created_at), COALESCE(stage, ''), COALESCE(model_name, ''), COALESCE(operation, '')
+    """)
+
+    cursor.execute("DELETE FROM token_usage_chapters")
+    cursor.execute(f"""
+        INSERT INTO token_usage_chapters
+            (novel_id, chapter_number, stage, operation,
+             call_count, prompt_tokens, completion_tokens, total_tokens, cost, duration)
+        SELECT novel_id, COALESCE(chapter_number, 0), COALESCE(stage, ''), COALESCE(operation, ''),
+               {VALUE_SUMS}
+        FROM token_usages
+        GROUP BY novel_id, COALESCE(chapter_number, 0), COALESCE(stage, ''), COALESCE(operation, '')
+    """)
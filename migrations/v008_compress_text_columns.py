@@ -0,0 +1,15 @@
+"""
+压缩章节正文、细纲、检查结果和小说设定/大纲等已有的明文大文本
+
+分批提交，可中断后重新执行；压缩后的空间需执行 VACUUM 才会从数据库文件中释放。
+"""
+from migrations import table_exists
+from text_codec import COMPRESSED_COLUMNS, compress_existing
+
+
+def upgrade(cursor):
+    if not all(table_exists(cursor, table) for table in COMPRESSED_COLUMNS):
+        return
+    count = compress_existing(cursor)
+    if count:
+        print(f"  共压缩 {count} 个字段，可执行 VACUUM 回收数据库文件空间")
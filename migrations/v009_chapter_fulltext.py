@@ -0,0 +1,38 @@
+"""
+建立章节全文索引（FTS5），并为已有章节分批建立索引
+
+SQLite 未编译 FTS5 时跳过，检索接口不可用，其余功能不受影响。
+"""
+import sqlite3
+
+from fulltext import CREATE_SQL, FTS_TABLE, tokenize
+from migrations import table_exists
+from text_codec import MIGRATE_BATCH_SIZE, decode
+
+
+def upgrade(cursor):
+    if not table_exists(cursor, 'chapters'):
+        return
+    try:
+        cursor.execute(CREATE_SQL)
+    except sqlite3.OperationalError as e:
+        print(f"  SQLite 不支持 FTS5，跳过全文索引: {e}")
+        return
+
+    last_id = 0
+    while True:
+        cursor.execute(f"""
+            SELECT id, title, detailed_outline, content FROM chapters
+            WHERE id > ? AND id NOT IN (SELECT rowid FROM {FTS_TABLE})
+            ORDER BY id LIMIT ?
+        """, (last_id, MIGRATE_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, outline, content) VALUES (?, ?, ?, ?)",
+            [(chapter_id, tokenize(title), tokenize(decode(outline)), tokenize(decode(content)))
+             for chapter_id, title, outline, content in rows]
+        )
+        cursor.connection.commit()
+        last_id = rows[-1][0]
@@ -0,0 +1,255 @@
+"""
+本地模拟的 OpenAI 兼容 /chat/completions 服务，用于压测和扩展性测试
+
+把 AI 配置的 api_base 指向 http://127.0.0.1:<port>/v1 即可，不产生任何费用。
+返回内容能通过大纲解析和质量检查的JSON解析。
+
+用法：
+    python mock_ai_server.py --port 8001 --latency lognormal --latency-mean 1.5 \
+        --tokens-per-sec 60 --error-rate 0.02 --rate-limit-rate 0.05
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+from check_parser import CHECK_SPECS
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+app = Flask(__name__)
+
+settings = argparse.Namespace(
+    latency='fixed',
+    latency_mean=0.5,
+    latency_std=0.2,
+    tokens_per_sec=0.0,
+    error_rate=0.0,
+    rate_limit_rate=0.0,
+    check_fail_rate=0.0,
+    max_output_chars=2000,
+    seed=None
+)
+
+_rng = random.Random()
+_rng_lock = threading.Lock()
+
+_stats = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'completion_tokens': 0}
+_stats_lock = threading.Lock()
+
+_CHAPTER_COUNT_RE = re.compile(r'总章节数：(\d+)章')
+_TARGET_WORDS_RE = re.compile(r'目标字数：约?(\d+)字')
+_FILLER = '夜色沉沉，山风卷过林梢，少年握紧手中的长剑，望向远处灯火。'
+
+
+def _random():
+    with _rng_lock:
+        return _rng.random()
+
+
+def _sample_latency() -> float:
+    """按配置的分布采样首字延迟（秒）"""
+    mean, std = settings.latency_mean, settings.latency_std
+    with _rng_lock:
+        if settings.latency == 'uniform':
+            value = _rng.uniform(max(0.0, mean - std), mean + std)
+        elif settings.latency == 'normal':
+            value = _rng.gauss(mean, std)
+        elif settings.latency == 'exponential':
+            value = _rng.expovariate(1 / mean) if mean > 0 else 0.0
+        elif settings.latency == 'lognormal':
+            # 以均值和标准差换算对数正态参数，模拟长尾
+            if mean > 0:
+                sigma2 = math.log(1 + (std / mean) ** 2)
+                mu = math.log(mean) - sigma2 / 2
+                value = _rng.lognormvariate(mu, sigma2 ** 0.5)
+            else:
+                value = 0.0
+        else:
+            value = mean
+    return max(0.0, value)
+
+
+def _count_tokens(text: str) -> int:
+    """粗略估算Token数：中文约每字一个Token"""
+    return max(1, int(len(text) / 1.5))
+
+
+def _filler(length: int) -> str:
+    repeats = length // len(_FILLER) + 1
+    return (_FILLER * repeats)[:length]
+
+
+def _canned_check(prompt: str) -> str:
+    """根据Prompt中的评分字段生成对应的检查JSON"""
+    spec = next(
+        (spec for spec in CHECK_SPECS.values() if f'"{spec["score_keys"][0]}"' in prompt),
+        CHECK_SPECS['settings']
+    )
+    failing = _random() < settings.check_fail_rate
+    per_item = 5 if failing else 9
+    scores = {key: per_item for key in spec['score_keys']}
+    total = per_item * len(scores)
+    return json.dumps({
+        'scores': scores,
+        'total_score': total,
+        'passed': total >= spec['pass_score'],
+        'issues': ['节奏略快'] if failing else [],
+        'suggestions': ['增加细节描写'],
+        'highlights': ['冲突设计紧凑']
+    }, ensure_ascii=False)
+
+
+def _canned_outline(chapter_count: int) -> str:
+    parts = []
+    for number in range(1, chapter_count + 1):
+        parts.append(f'第{number}章：模拟章节{number}\n概要：{_filler(200)}\n')
+    return '\n'.join(parts)
+
+
+def _canned_reply(messages: list, max_tokens: int) -> str:
+    """根据请求内容生成能被下游解析的模拟输出"""
+    prompt = '\n'.join(str(message.get('content', '')) for message in messages)
+
+    if '请以JSON格式输出' in prompt:
+        return _canned_check(prompt)
+
+    match = _CHAPTER_COUNT_RE.search(prompt)
+    if match:
+        return _canned_outline(int(match.group(1)))
+
+    match = _TARGET_WORDS_RE.search(prompt)
+    length = int(match.group(1)) if match else 800
+    return _filler(min(length, max_tokens, settings.max_output_chars))
+
+
+def _record(key: str, amount: int = 1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _error_response():
+    """按配置注入429和5xx错误"""
+    roll = _random()
+    if roll < settings.rate_limit_rate:
+        _record('rate_limited')
+        return jsonify({'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_error'}}), 429, {'Retry-After': '1'}
+    if roll < settings.rate_limit_rate + settings.error_rate:
+        _record('errors')
+        return jsonify({'error': {'message': 'Mock upstream error', 'type': 'server_error'}}), 500
+    return None
+
+
+def _stream(completion_id: str, model: str, content: str, usage: dict):
+    """按 tokens/sec 节奏输出 SSE 分片"""
+    chunk_size = 16
+    delay = (chunk_size / settings.tokens_per_sec) if settings.tokens_per_sec > 0 else 0
+    for start in range(0, len(content), chunk_size):
+        if delay:
+            time.sleep(delay)
+        chunk = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': {'content': content[start:start + chunk_size]}, 'finish_reason': None}]
+        }
+        yield f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'
+
+    final = {
+        'id': completion_id,
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        'usage': usage
+    }
+    yield f'data: {json.dumps(final, ensure_ascii=False)}\n\n'
+    yield 'data: [DONE]\n\n'
+
+
+@app.route('/chat/completions', methods=['POST'])
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """模拟 OpenAI chat completions 接口"""
+    _record('requests')
+    data = request.get_json(force=True, silent=True) or {}
+    messages = data.get('messages', [])
+    model = data.get('model', 'mock-model')
+
+    time.sleep(_sample_latency())
+
+    error = _error_response()
+    if error:
+        return error
+
+    content = _canned_reply(messages, data.get('max_tokens', 4000))
+    prompt_tokens = sum(_count_tokens(str(message.get('content', ''))) for message in messages)
+    completion_tokens = _count_tokens(content)
+    usage = {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+    _record('completion_tokens', completion_tokens)
+    completion_id = f'chatcmpl-{uuid.uuid4().hex[:24]}'
+
+    if data.get('stream'):
+        return Response(_stream(completion_id, model, content, usage), mimetype='text/event-stream')
+
+    if settings.tokens_per_sec > 0:
+        time.sleep(completion_tokens / settings.tokens_per_sec)
+
+    return jsonify({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': usage
+    })
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """模拟服务自身的请求统计"""
+    with _stats_lock:
+        return jsonify(dict(_stats))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='本地模拟 OpenAI 兼容接口')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default='fixed',
+                        choices=['fixed', 'uniform', 'normal', 'lognormal', 'exponential'],
+                        help='首字延迟分布')
+    parser.add_argument('--latency-mean', type=float, default=0.5, help='首字延迟均值（秒）')
+    parser.add_argument('--latency-std', type=float, default=0.2, help='首字延迟标准差/半宽（秒）')
+    parser.add_argument('--tokens-per-sec', type=float, default=0.0, help='输出速度，0 表示不限速')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='5xx 错误比例')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='429 限流比例')
+    parser.add_argument('--check-fail-rate', type=float, default=0.0, help='质量检查不通过的比例')
+    parser.add_argument('--max-output-chars', type=int, default=2000, help='单次输出最大字数')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，便于复现')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    for key, value in vars(args).items():
+        setattr(settings, key, value)
+    _rng.seed(args.seed)
+
+    print(f"模拟AI服务已启动: http://{args.host}:{args.port}/v1")
+    app.run(host=args.host, port=args.port, threaded=True)
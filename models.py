@@ -1,12 +1,37 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func, case
+
+from text_codec import CompressedText
 
 db = SQLAlchemy()
 
 
+def configure_engine(engine, journal_mode: str = 'WAL', synchronous: str = 'NORMAL', busy_timeout: float = 30):
+    """为 SQLite 连接设置并发相关的 PRAGMA
+
+    WAL 让读写互不阻塞，busy_timeout 让写入排队等待而不是直接报 "database is locked"，
+    WAL 下 synchronous=NORMAL 不会损坏数据库，只在断电时可能丢失最后几个事务。
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if engine.url.database not in (None, '', ':memory:'):
+            cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout * 1000)}')
+        cursor.close()
+
+
 class Novel(db.Model):
     """小说主表"""
     __tablename__ = 'novels'
+    __table_args__ = (
+        db.Index('ix_novels_status_created', 'status', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
@@ -20,11 +45,12 @@ class Novel(db.Model):
     current_stage = db.Column(db.String(50))  # settings, outline, detailed_outline, content, export
     is_paused = db.Column(db.Boolean, default=False)  # 是否暂停
 
-    # 生成内容
-    settings = db.Column(db.Text)  # AI生成的小说设定
-    settings_check = db.Column(db.Text)  # AI检查结果
-    outline = db.Column(db.Text)  # 大纲
-    outline_check = db.Column(db.Text)  # 大纲检查结果
+    # 生成内容（大文本列延迟加载，首次访问其中任一列时整组一次性加载；SQLite 上压缩存储）
+    settings = db.deferred(db.Column(CompressedText), group='content')  # AI生成的小说设定
+    settings_check = db.deferred(db.Column(CompressedText), group='content')  # AI检查结果
+    outline = db.deferred(db.Column(CompressedText(external=True)), group='content')  # 大纲
+    outline_check = db.deferred(db.Column(CompressedText), group='content')  # 大纲检查结果
+    outline_index = db.deferred(db.Column(CompressedText), group='content')  # 大纲解析索引（JSON）：章节号 → 标题、位置、概要
 
     # Token消耗统计
     total_tokens = db.Column(db.Integer, default=0)  # 总Token消耗
@@ -41,9 +67,32 @@ class Novel(db.Model):
     chapters = db.relationship('Chapter', backref='novel', lazy='dynamic', cascade='all, delete-orphan')
     logs = db.relationship('GenerationLog', backref='novel', lazy='dynamic', cascade='all, delete-orphan')
     token_usages = db.relationship('TokenUsage', backref='novel', lazy='dynamic', cascade='all, delete-orphan')
-
-    def to_dict(self):
-        return {
+    chapter_token_stats = db.relationship('TokenUsageChapter', lazy='dynamic', cascade='all, delete-orphan')
+    revisions = db.relationship('Revision', lazy='dynamic', cascade='all, delete-orphan')
+
+    # 延迟加载的大文本字段
+    CONTENT_FIELDS = ('settings', 'settings_check', 'outline', 'outline_check')
+
+    # 列表摘要模式返回的字段
+    SUMMARY_FIELDS = (
+        'id', 'title', 'theme', 'target_words', 'target_chapters', 'status', 'current_stage',
+        'is_paused', 'total_tokens', 'total_cost', 'created_at', 'updated_at', 'completed_at',
+        'chapter_count', 'completed_chapters', 'total_word_count'
+    )
+
+    # 全部可返回的字段
+    ALL_FIELDS = SUMMARY_FIELDS + ('background', 'prompt_tokens', 'completion_tokens') + CONTENT_FIELDS
+
+    def to_dict(self, chapter_stats: dict = None, fields=None):
+        """序列化小说
+
+        Args:
+            chapter_stats: Chapter.stats_for() 的结果，由调用方批量查询后传入，
+                本方法不访问数据库
+            fields: 只返回这些字段；不在其中的大文本字段不会触发延迟加载
+        """
+        chapter_stats = chapter_stats or {}
+        data = {
             'id': self.id,
             'title': self.title,
             'theme': self.theme,
@@ -53,10 +102,6 @@ class Novel(db.Model):
             'status': self.status,
             'current_stage': self.current_stage,
             'is_paused': self.is_paused,
-            'settings': self.settings,
-            'settings_check': self.settings_check,
-            'outline': self.outline,
-            'outline_check': self.outline_check,
             'total_tokens': self.total_tokens,
             'prompt_tokens': self.prompt_tokens,
             'completion_tokens': self.completion_tokens,
@@ -64,24 +109,37 @@ class Novel(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'chapter_count': self.chapters.count()
+            'chapter_count': chapter_stats.get('chapter_count', 0),
+            'completed_chapters': chapter_stats.get('completed_chapters', 0),
+            'total_word_count': chapter_stats.get('total_word_count', 0)
         }
 
+        for field in self.CONTENT_FIELDS:
+            if fields is None or field in fields:
+                data[field] = getattr(self, field)
+
+        if fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        return data
+
 
 class Chapter(db.Model):
     """章节表"""
     __tablename__ = 'chapters'
+    __table_args__ = (
+        db.Index('ux_chapters_novel_chapter', 'novel_id', 'chapter_number', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novels.id'), nullable=False)
     chapter_number = db.Column(db.Integer, nullable=False)
     title = db.Column(db.String(200))
 
-    # 细纲和内容
-    detailed_outline = db.Column(db.Text)  # 细纲
-    detailed_outline_check = db.Column(db.Text)  # 细纲检查
-    content = db.Column(db.Text)  # 章节内容
-    content_check = db.Column(db.Text)  # 内容检查
+    # 细纲和内容（SQLite 上压缩存储；配置了外部存储时大文本存到文件系统）
+    detailed_outline = db.Column(CompressedText(external=True))  # 细纲
+    detailed_outline_check = db.Column(CompressedText)  # 细纲检查
+    content = db.Column(CompressedText(external=True))  # 章节内容
+    content_check = db.Column(CompressedText)  # 内容检查
 
     word_count = db.Column(db.Integer, default=0)
     status = db.Column(db.String(50), default='pending')  # pending, generating, completed, failed
@@ -89,6 +147,63 @@ class Chapter(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    @staticmethod
+    def stats_for(novel_ids) -> dict:
+        """一次聚合查询统计多部小说的章节数、已完成章节数和总字数
+
+        Returns:
+            {novel_id: {'chapter_count', 'completed_chapters', 'total_word_count'}}
+        """
+        novel_ids = list(novel_ids)
+        if not novel_ids:
+            return {}
+
+        rows = db.session.query(
+            Chapter.novel_id,
+            func.count(Chapter.id),
+            func.sum(case((Chapter.status == 'completed', 1), else_=0)),
+            func.sum(Chapter.word_count)
+        ).filter(Chapter.novel_id.in_(novel_ids)).group_by(Chapter.novel_id).all()
+
+        return {
+            novel_id: {
+                'chapter_count': count,
+                'completed_chapters': int(completed or 0),
+                'total_word_count': int(words or 0)
+            }
+            for novel_id, count, completed, words in rows
+        }
+
+    @staticmethod
+    def summary_query():
+        """章节摘要查询：只取元数据列，正文和细纲只判断是否存在，不读取内容"""
+        return db.session.query(
+            Chapter.id,
+            Chapter.novel_id,
+            Chapter.chapter_number,
+            Chapter.title,
+            Chapter.status,
+            Chapter.word_count,
+            Chapter.updated_at,
+            Chapter.detailed_outline.isnot(None).label('has_detailed_outline'),
+            Chapter.content.isnot(None).label('has_content')
+        )
+
+    @staticmethod
+    def summary_to_dict(row) -> dict:
+        """序列化 summary_query() 返回的行"""
+        return {
+            'id': row.id,
+            'novel_id': row.novel_id,
+            'chapter_number': row.chapter_number,
+            'title': row.title,
+            'status': row.status,
+            'word_count': row.word_count,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+            'has_detailed_outline': bool(row.has_detailed_outline),
+            'has_content': bool(row.has_content)
+        }
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -109,6 +224,10 @@ class Chapter(db.Model):
 class GenerationLog(db.Model):
     """生成日志表"""
     __tablename__ = 'generation_logs'
+    __table_args__ = (
+        db.Index('ix_generation_logs_novel_created', 'novel_id', 'created_at'),
+        db.Index('ix_generation_logs_novel_id', 'novel_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novels.id'), nullable=False)
@@ -159,6 +278,10 @@ class AIConfig(db.Model):
 class TokenUsage(db.Model):
     """Token使用记录表"""
     __tablename__ = 'token_usages'
+    __table_args__ = (
+        db.Index('ix_token_usages_novel_created', 'novel_id', 'created_at'),
+        db.Index('ix_token_usages_created_stage', 'created_at', 'stage'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novels.id'), nullable=False)
@@ -196,3 +319,155 @@ class TokenUsage(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'duration': self.duration
         }
+
+
+# 汇总表的维度不允许为 NULL（唯一约束中 NULL 互不相等），缺失值统一存为 '' / 0
+class TokenUsageDaily(db.Model):
+    """Token使用按 (日期, 阶段, 模型, 操作) 汇总，写入 TokenUsage 时同步累加"""
+    __tablename__ = 'token_usage_daily'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'stage', 'model_name', 'operation', name='ux_token_usage_daily_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)  # UTC 日期
+    stage = db.Column(db.String(50), nullable=False, default='')
+    model_name = db.Column(db.String(100), nullable=False, default='')
+    operation = db.Column(db.String(100), nullable=False, default='')
+
+    call_count = db.Column(db.Integer, default=0)
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    duration = db.Column(db.Float, default=0.0)  # 累计耗时（秒）
+
+
+class TokenUsageChapter(db.Model):
+    """Token使用按 (小说, 章节, 阶段, 操作) 汇总，写入 TokenUsage 时同步累加
+
+    chapter_number 为 0 表示不属于具体章节的调用（设定、大纲）。
+    """
+    __tablename__ = 'token_usage_chapters'
+    __table_args__ = (
+        db.UniqueConstraint('novel_id', 'chapter_number', 'stage', 'operation', name='ux_token_usage_chapters_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novels.id'), nullable=False)
+    chapter_number = db.Column(db.Integer, nullable=False, default=0)
+    stage = db.Column(db.String(50), nullable=False, default='')
+    operation = db.Column(db.String(100), nullable=False, default='')
+
+    call_count = db.Column(db.Integer, default=0)
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0.0)
+    duration = db.Column(db.Float, default=0.0)  # 累计耗时（秒）
+
+
+class Revision(db.Model):
+    """生成产物（设定、大纲、细纲、正文）的历史版本
+
+    chapter_number 为 0 表示小说级产物（设定、大纲）。每隔若干版本保存一次全文快照，
+    其余版本只保存相对上一版本的差异，由 revisions.py 负责编码和还原。
+    """
+    __tablename__ = 'revisions'
+    __table_args__ = (
+        db.UniqueConstraint('novel_id', 'chapter_number', 'field', 'revision_number', name='ux_revisions_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novels.id'), nullable=False)
+    chapter_number = db.Column(db.Integer, nullable=False, default=0)
+    field = db.Column(db.String(50), nullable=False)  # settings, outline, detailed_outline, content
+    revision_number = db.Column(db.Integer, nullable=False)  # 同一产物内从 1 递增
+    source = db.Column(db.String(20))  # initial, generate, regenerate, restore
+    restored_from = db.Column(db.Integer)  # 恢复自哪个版本号
+
+    is_snapshot = db.Column(db.Boolean, default=False)
+    data = db.Column(CompressedText)  # 快照为全文，否则为差异（JSON）
+    length = db.Column(db.Integer, default=0)  # 该版本全文字数
+
+    # 检查结果
+    check_score = db.Column(db.Float)
+    passed = db.Column(db.Boolean)
+    check_result = db.Column(CompressedText)
+
+    # 生成该版本的Token消耗
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+    total_tokens = db.Column(db.Integer, default=0)
+    cost = db.Column(db.Float, default=0.0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'novel_id': self.novel_id,
+            'chapter_number': self.chapter_number,
+            'field': self.field,
+            'revision_number': self.revision_number,
+            'source': self.source,
+            'restored_from': self.restored_from,
+            'length': self.length,
+            'check_score': self.check_score,
+            'passed': self.passed,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'total_tokens': self.total_tokens,
+            'cost': self.cost,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def accumulate_token_usage(usage: TokenUsage):
+    """把一条 TokenUsage 累加到两张汇总表，由调用方与明细在同一事务中提交"""
+    values = {
+        'call_count': 1,
+        'prompt_tokens': usage.prompt_tokens or 0,
+        'completion_tokens': usage.completion_tokens or 0,
+        'total_tokens': usage.total_tokens or 0,
+        'cost': usage.cost or 0.0,
+        'duration': usage.duration or 0.0
+    }
+    _upsert_rollup(TokenUsageDaily, {
+        'day': (usage.created_at or datetime.utcnow()).date(),
+        'stage': usage.stage or '',
+        'model_name': usage.model_name or '',
+        'operation': usage.operation or ''
+    }, values)
+    _upsert_rollup(TokenUsageChapter, {
+        'novel_id': usage.novel_id,
+        'chapter_number': usage.chapter_number or 0,
+        'stage': usage.stage or '',
+        'operation': usage.operation or ''
+    }, values)
+
+
+def _upsert_rollup(model, keys: dict, values: dict):
+    """按维度累加一行汇总；SQLite/PostgreSQL 用单条 INSERT ... ON CONFLICT 原子完成"""
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**keys, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + stmt.excluded[column] for column in values}
+        )
+        db.session.execute(stmt)
+        return
+
+    row = model.query.filter_by(**keys).with_for_update().first()
+    if row is None:
+        db.session.add(model(**keys, **values))
+    else:
+        for column, value in values.items():
+            setattr(row, column, (getattr(row, column) or 0) + value)
@@ -1,8 +1,14 @@
+import json
 import time
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
 from models import db, Novel, Chapter
 from ai_service import AIService
 from config import Config
+from event_bus import event_bus
+import outline_index
+from passage_index import PassageIndex, format_passages
+from revisions import record_revision, set_check
 
 
 class NovelGenerator:
@@ -11,14 +17,39 @@ class NovelGenerator:
     def __init__(self):
         self.ai_service = AIService()
         self.max_retries = Config.MAX_RETRIES
+        # 已解码的大纲索引缓存：novel_id → (索引JSON文本, 索引)
+        self._outline_index_cache = {}
+        # 生成中小说的前文片段索引：novel_id → PassageIndex，生成结束后释放
+        self._passage_indexes = {}
+
+    def _wait_before_retry(self):
+        """检查未通过后等待再重试；回放时按回放速度缩放，速度为 0 时不等待"""
+        delay = Config.RETRY_DELAY
+        replayer = self.ai_service.replayer
+        if replayer is not None:
+            delay = delay / replayer.speed if replayer.speed > 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+
+    def _check_settled(self, check_result: dict, label: str) -> bool:
+        """检查是否已有结论：通过，或检查结果多次无法解析
+
+        解析失败不代表内容不合格，保留当前内容（检查结果带 needs_recheck 标记）继续后续流程，
+        不为此重新生成整个产物。
+        """
+        if check_result.get('passed', False):
+            return True
+        if check_result.get('parse_failed'):
+            print(f"{label}检查结果无法解析，保留当前内容，待复查")
+            return True
+        return False
 
     def _check_if_paused(self, novel: Novel) -> bool:
         """检查是否被暂停"""
         # 刷新数据库状态
         db.session.refresh(novel)
         if novel.is_paused:
-            novel.status = 'paused'
-            db.session.commit()
+            self._set_status(novel, 'paused')
             print(f"小说 ID:{novel.id} 已暂停")
             return True
         return False
@@ -31,67 +62,103 @@ class NovelGenerator:
 
         try:
             # 更新状态
-            novel.status = 'generating'
             novel.is_paused = False
-            db.session.commit()
+            self._set_status(novel, 'generating')
 
             # 步骤1: 生成并检查小说设定
             if self._check_if_paused(novel):
                 return False
             if not self._generate_and_check_settings(novel):
-                novel.status = 'failed'
-                db.session.commit()
+                self._set_status(novel, 'failed')
                 return False
 
             # 步骤2: 生成并检查大纲
             if self._check_if_paused(novel):
                 return False
             if not self._generate_and_check_outline(novel):
-                novel.status = 'failed'
-                db.session.commit()
+                self._set_status(novel, 'failed')
                 return False
 
             # 步骤3: 为每章生成细纲和内容
             if self._check_if_paused(novel):
                 return False
             if not self._generate_chapters(novel):
-                novel.status = 'failed'
-                db.session.commit()
+                self._set_status(novel, 'failed')
                 return False
 
             # 完成
-            novel.status = 'completed'
             novel.completed_at = datetime.utcnow()
-            db.session.commit()
+            self._set_status(novel, 'completed')
 
             return True
 
         except Exception as e:
             print(f"小说生成异常: {str(e)}")
-            novel.status = 'failed'
-            db.session.commit()
+            db.session.rollback()
+            self._set_status(novel, 'failed')
             return False
+        finally:
+            self._passage_indexes.pop(novel_id, None)
+
+    def publish_novel(self, novel: Novel, **extra):
+        """推送小说状态/阶段变化"""
+        event_bus.publish(novel.id, 'novel', dict({
+            'status': novel.status,
+            'current_stage': novel.current_stage,
+            'is_paused': novel.is_paused
+        }, **extra))
+
+    def _set_status(self, novel: Novel, status: str):
+        novel.status = status
+        db.session.commit()
+        self.publish_novel(novel)
+
+    def _set_stage(self, novel: Novel, stage: str):
+        novel.current_stage = stage
+        db.session.commit()
+        self.publish_novel(novel)
+
+    def _publish_chapter(self, chapter: Chapter, **extra):
+        """推送章节变化，字段与章节列表 view=summary 一致
+
+        在提交后调用，实例已过期，访问其属性会重新加载整行（含正文的解压、外部存储读取）。
+        章节ID从实例标识中取，元数据用摘要查询读取，正文和细纲只判断是否存在。
+        """
+        identity = db.inspect(chapter).identity
+        chapter_id = identity[0] if identity else chapter.id
+        row = Chapter.summary_query().filter(Chapter.id == chapter_id).first()
+        if row is None:
+            return
+        event_bus.publish(row.novel_id, 'chapter', dict(Chapter.summary_to_dict(row), **extra))
+
+    def _set_chapter_status(self, chapter: Chapter, status: str):
+        chapter.status = status
+        db.session.commit()
+        self._publish_chapter(chapter)
 
     def _generate_and_check_settings(self, novel: Novel) -> bool:
         """生成并检查小说设定"""
-        novel.current_stage = 'settings'
-        db.session.commit()
+        self._set_stage(novel, 'settings')
 
         for attempt in range(self.max_retries):
             # 生成设定
-            settings = self.ai_service.generate_settings(
-                theme=novel.theme,
-                background=novel.background,
-                target_words=novel.target_words,
-                target_chapters=novel.target_chapters,
-                novel_id=novel.id
-            )
+            with self.ai_service.track_usage() as usage:
+                settings = self.ai_service.generate_settings(
+                    theme=novel.theme,
+                    background=novel.background,
+                    target_words=novel.target_words,
+                    target_chapters=novel.target_chapters,
+                    novel_id=novel.id
+                )
 
             if not settings:
                 continue
 
+            revision = record_revision(novel.id, 0, 'settings', settings, 'generate',
+                                       usage=usage, previous=novel.settings)
             novel.settings = settings
             db.session.commit()
+            self.publish_novel(novel, updated='settings')
 
             # AI检查设定
             check_result = self.ai_service.check_settings(
@@ -100,37 +167,41 @@ class NovelGenerator:
                 novel_id=novel.id
             )
 
-            novel.settings_check = str(check_result)
+            novel.settings_check = json.dumps(check_result, ensure_ascii=False)
+            set_check(revision, check_result)
             db.session.commit()
 
             # 如果通过检查，返回成功
-            if check_result.get('passed', False):
+            if self._check_settled(check_result, '设定'):
                 return True
 
             # 如果未通过，记录问题并重试
             print(f"设定检查未通过 (尝试 {attempt + 1}/{self.max_retries})")
-            time.sleep(2)
+            self._wait_before_retry()
 
         return False
 
     def _generate_and_check_outline(self, novel: Novel) -> bool:
         """生成并检查大纲"""
-        novel.current_stage = 'outline'
-        db.session.commit()
+        self._set_stage(novel, 'outline')
 
         for attempt in range(self.max_retries):
             # 生成大纲
-            outline = self.ai_service.generate_outline(
-                settings=novel.settings,
-                target_chapters=novel.target_chapters,
-                novel_id=novel.id
-            )
+            with self.ai_service.track_usage() as usage:
+                outline = self.ai_service.generate_outline(
+                    settings=novel.settings,
+                    target_chapters=novel.target_chapters,
+                    novel_id=novel.id
+                )
 
             if not outline:
                 continue
 
-            novel.outline = outline
+            revision = record_revision(novel.id, 0, 'outline', outline, 'generate',
+                                       usage=usage, previous=novel.outline)
+            self.update_outline(novel, outline)
             db.session.commit()
+            self.publish_novel(novel, updated='outline')
 
             # AI检查大纲
             check_result = self.ai_service.check_outline(
@@ -139,21 +210,21 @@ class NovelGenerator:
                 novel_id=novel.id
             )
 
-            novel.outline_check = str(check_result)
+            novel.outline_check = json.dumps(check_result, ensure_ascii=False)
+            set_check(revision, check_result)
             db.session.commit()
 
-            if check_result.get('passed', False):
+            if self._check_settled(check_result, '大纲'):
                 return True
 
             print(f"大纲检查未通过 (尝试 {attempt + 1}/{self.max_retries})")
-            time.sleep(2)
+            self._wait_before_retry()
 
         return False
 
     def _generate_chapters(self, novel: Novel) -> bool:
         """生成所有章节"""
-        novel.current_stage = 'content'
-        db.session.commit()
+        self._set_stage(novel, 'content')
 
         # 解析大纲，创建章节记录
         chapters = self._parse_outline_and_create_chapters(novel)
@@ -161,8 +232,13 @@ class NovelGenerator:
         if not chapters:
             return False
 
+        self._passage_indexes[novel.id] = self._build_passage_index(novel.id)
+
         # 为每章生成内容
         for chapter in chapters:
+            # 恢复生成时跳过已完成的章节
+            if chapter.status == 'completed':
+                continue
             # 检查是否暂停
             if self._check_if_paused(novel):
                 return False
@@ -172,73 +248,136 @@ class NovelGenerator:
         return True
 
     def _parse_outline_and_create_chapters(self, novel: Novel):
-        """解析大纲并创建章节记录"""
-        outline_lines = novel.outline.split('\n')
-        chapters = []
-        current_chapter = None
-        chapter_number = 0
-
-        for line in outline_lines:
-            line = line.strip()
-            if not line:
-                continue
+        """解析大纲并创建章节记录
 
-            # 检测章节标题
-            if line.startswith('第') and '章' in line:
-                if current_chapter:
-                    chapters.append(current_chapter)
-
-                chapter_number += 1
-                # 提取标题
-                title = line.split('：', 1)[-1] if '：' in line else line
-                current_chapter = {
-                    'number': chapter_number,
-                    'title': title,
-                    'outline': line + '\n'
-                }
-            elif current_chapter:
-                current_chapter['outline'] += line + '\n'
-
-        if current_chapter:
-            chapters.append(current_chapter)
-
-        # 创建数据库记录
-        chapter_objects = []
-        for ch in chapters:
-            chapter = Chapter(
+        按 (novel_id, chapter_number) 幂等写入：已存在的章节直接复用，
+        只批量插入缺失的章节，恢复生成时不会产生重复章节。
+        """
+        index = self._get_outline_index(novel)
+        entries = outline_index.ordered_chapters(index)
+
+        existing = self._load_chapters_by_number(novel.id)
+        missing = [
+            Chapter(
                 novel_id=novel.id,
-                chapter_number=ch['number'],
-                title=ch['title'],
+                chapter_number=entry['number'],
+                title=entry['title'],
                 status='pending'
             )
-            db.session.add(chapter)
-            chapter_objects.append(chapter)
+            for entry in entries if entry['number'] not in existing
+        ]
 
-        db.session.commit()
-        return chapter_objects
+        if missing:
+            try:
+                db.session.add_all(missing)
+                db.session.commit()
+            except IntegrityError:
+                # 并发写入时其他线程已创建，回滚后重新读取
+                db.session.rollback()
+            existing = self._load_chapters_by_number(novel.id)
+
+        return [existing[entry['number']] for entry in entries if entry['number'] in existing]
+
+    def _load_chapters_by_number(self, novel_id: int) -> dict:
+        """一次查询取出小说的全部章节，按章节号索引"""
+        chapters = Chapter.query.filter_by(novel_id=novel_id).all()
+        return {chapter.chapter_number: chapter for chapter in chapters}
+
+    def update_outline(self, novel: Novel, outline: str) -> list:
+        """更新大纲并增量更新索引，同步已有章节的标题
+
+        Returns:
+            内容有变化的章节号列表
+        """
+        old_index = outline_index.load_index(novel.outline_index)
+        index, changed = outline_index.update_index(old_index, outline)
+
+        novel.outline = outline
+        novel.outline_index = outline_index.dump_index(index)
+        self._outline_index_cache[novel.id] = (novel.outline_index, index)
+
+        if changed and old_index:
+            for chapter in Chapter.query.filter(
+                Chapter.novel_id == novel.id,
+                Chapter.chapter_number.in_(changed)
+            ):
+                entry = index['chapters'].get(str(chapter.chapter_number))
+                if entry:
+                    chapter.title = entry['title']
+
+        return changed
+
+    def _get_outline_index(self, novel: Novel) -> dict:
+        """获取小说的大纲索引，缺失或过期时重新解析并持久化"""
+        cached = self._outline_index_cache.get(novel.id)
+        if cached and cached[0] == novel.outline_index:
+            return cached[1]
+
+        index = outline_index.load_index(novel.outline_index)
+        if index is None or index['fingerprint'] != outline_index.fingerprint(novel.outline or ''):
+            index = outline_index.parse_outline(novel.outline or '')
+            novel.outline_index = outline_index.dump_index(index)
+            db.session.commit()
+
+        self._outline_index_cache[novel.id] = (novel.outline_index, index)
+        return index
+
+    def get_chapter_info(self, novel: Novel, chapter_number: int) -> str:
+        """从大纲索引中获取指定章节的概要"""
+        entry = self._get_outline_index(novel)['chapters'].get(str(chapter_number))
+        return entry['summary'] if entry else ''
+
+    def _build_passage_index(self, novel_id: int) -> PassageIndex:
+        """用已完成章节的正文建立前文片段索引"""
+        index = PassageIndex()
+        rows = db.session.query(Chapter.chapter_number, Chapter.content).filter(
+            Chapter.novel_id == novel_id,
+            Chapter.status == 'completed',
+            Chapter.content.isnot(None)
+        )
+        for chapter_number, content in rows:
+            index.add_chapter(chapter_number, content)
+        return index
+
+    def index_chapter(self, chapter: Chapter):
+        """章节正文完成或变更后更新正在使用的片段索引"""
+        index = self._passage_indexes.get(chapter.novel_id)
+        if index is not None and chapter.status == 'completed' and chapter.content:
+            index.add_chapter(chapter.chapter_number, chapter.content)
+
+    def get_related_context(self, novel: Novel, chapter: Chapter) -> str:
+        """按章节标题和细纲检索前文中相关的片段，供正文生成参考"""
+        if Config.RETRIEVAL_TOP_K <= 0 or Config.RETRIEVAL_TOKEN_BUDGET <= 0 or chapter.chapter_number <= 1:
+            return ''
+        # 生成流程之外（如重新生成）临时建立索引
+        index = self._passage_indexes.get(novel.id) or self._build_passage_index(novel.id)
+        passages = index.search(
+            f"{chapter.title or ''}\n{chapter.detailed_outline or ''}",
+            before_chapter=chapter.chapter_number,
+            top_k=Config.RETRIEVAL_TOP_K,
+            token_budget=Config.RETRIEVAL_TOKEN_BUDGET
+        )
+        return format_passages(passages)
 
     def _generate_chapter(self, novel: Novel, chapter: Chapter) -> bool:
         """生成单个章节的细纲和内容"""
-        chapter.status = 'generating'
-        db.session.commit()
+        self._set_chapter_status(chapter, 'generating')
 
         # 获取章节信息
-        chapter_info = self._get_chapter_info_from_outline(novel.outline, chapter.chapter_number)
+        chapter_info = self.get_chapter_info(novel, chapter.chapter_number)
 
         # 步骤1: 生成并检查细纲
         if not self._generate_and_check_detailed_outline(novel, chapter, chapter_info):
-            chapter.status = 'failed'
-            db.session.commit()
+            self._set_chapter_status(chapter, 'failed')
             return False
 
         # 步骤2: 生成并检查正文
         if not self._generate_and_check_content(novel, chapter):
-            chapter.status = 'failed'
-            db.session.commit()
+            self._set_chapter_status(chapter, 'failed')
             return False
 
-        chapter.status = 'completed'
-        db.session.commit()
+        self._set_chapter_status(chapter, 'completed')
+        self.index_chapter(chapter)
         return True
 
     def _generate_and_check_detailed_outline(self, novel: Novel, chapter: Chapter, chapter_info: str) -> bool:
@@ -247,20 +386,24 @@ class NovelGenerator:
 
         for attempt in range(self.max_retries):
             # 生成细纲
-            detailed_outline = self.ai_service.generate_detailed_outline(
-                chapter_info=chapter_info,
-                settings=novel.settings,
-                outline=novel.outline,
-                chapter_number=chapter.chapter_number,
-                target_words=words_per_chapter,
-                novel_id=novel.id
-            )
+            with self.ai_service.track_usage() as usage:
+                detailed_outline = self.ai_service.generate_detailed_outline(
+                    chapter_info=chapter_info,
+                    settings=novel.settings,
+                    outline=novel.outline,
+                    chapter_number=chapter.chapter_number,
+                    target_words=words_per_chapter,
+                    novel_id=novel.id
+                )
 
             if not detailed_outline:
                 continue
 
+            revision = record_revision(novel.id, chapter.chapter_number, 'detailed_outline', detailed_outline,
+                                       'generate', usage=usage, previous=chapter.detailed_outline)
             chapter.detailed_outline = detailed_outline
             db.session.commit()
+            self._publish_chapter(chapter, detailed_outline=detailed_outline)
 
             # AI检查细纲
             check_result = self.ai_service.check_detailed_outline(
@@ -271,38 +414,45 @@ class NovelGenerator:
                 chapter_number=chapter.chapter_number
             )
 
-            chapter.detailed_outline_check = str(check_result)
+            chapter.detailed_outline_check = json.dumps(check_result, ensure_ascii=False)
+            set_check(revision, check_result)
             db.session.commit()
 
-            if check_result.get('passed', False):
+            if self._check_settled(check_result, f'第{chapter.chapter_number}章细纲'):
                 return True
 
             print(f"第{chapter.chapter_number}章细纲检查未通过 (尝试 {attempt + 1}/{self.max_retries})")
-            time.sleep(2)
+            self._wait_before_retry()
 
         return False
 
     def _generate_and_check_content(self, novel: Novel, chapter: Chapter) -> bool:
         """生成并检查章节内容"""
         words_per_chapter = novel.target_words // novel.target_chapters
+        related_context = self.get_related_context(novel, chapter)
 
         for attempt in range(self.max_retries):
             # 生成正文
-            content = self.ai_service.generate_chapter_content(
-                detailed_outline=chapter.detailed_outline,
-                settings=novel.settings,
-                chapter_title=chapter.title,
-                target_words=words_per_chapter,
-                novel_id=novel.id,
-                chapter_number=chapter.chapter_number
-            )
+            with self.ai_service.track_usage() as usage:
+                content = self.ai_service.generate_chapter_content(
+                    detailed_outline=chapter.detailed_outline,
+                    settings=novel.settings,
+                    chapter_title=chapter.title,
+                    target_words=words_per_chapter,
+                    novel_id=novel.id,
+                    chapter_number=chapter.chapter_number,
+                    related_context=related_context
+                )
 
             if not content:
                 continue
 
+            revision = record_revision(novel.id, chapter.chapter_number, 'content', content, 'generate',
+                                       usage=usage, previous=chapter.content)
             chapter.content = content
             chapter.word_count = len(content)
             db.session.commit()
+            self._publish_chapter(chapter)
 
             # AI检查内容
             check_result = self.ai_service.check_chapter_content(
@@ -313,30 +463,14 @@ class NovelGenerator:
                 chapter_number=chapter.chapter_number
             )
 
-            chapter.content_check = str(check_result)
+            chapter.content_check = json.dumps(check_result, ensure_ascii=False)
+            set_check(revision, check_result)
             db.session.commit()
 
-            if check_result.get('passed', False):
+            if self._check_settled(check_result, f'第{chapter.chapter_number}章内容'):
                 return True
 
             print(f"第{chapter.chapter_number}章内容检查未通过 (尝试 {attempt + 1}/{self.max_retries})")
-            time.sleep(2)
+            self._wait_before_retry()
 
         return False
-
-    def _get_chapter_info_from_outline(self, outline: str, chapter_number: int) -> str:
-        """从大纲中提取指定章节的信息"""
-        lines = outline.split('\n')
-        chapter_lines = []
-        capturing = False
-
-        for line in lines:
-            if f'第{chapter_number}章' in line:
-                capturing = True
-                chapter_lines.append(line)
-            elif capturing:
-                if line.strip().startswith('第') and '章' in line:
-                    break
-                chapter_lines.append(line)
-
-        return '\n'.join(chapter_lines)
@@ -0,0 +1,144 @@
+"""
+大纲索引：把大纲文本一次性解析为 章节号 → 标题/位置/概要 的结构化索引
+"""
+import hashlib
+import json
+import re
+from typing import Dict, Any, Optional, List
+
+# 章节标题行，如 "第12章：标题"、"第十二章 标题"、"**第3章** 标题"
+CHAPTER_HEADING_RE = re.compile(
+    r'^[#*\s]*第\s*([0-9零〇一二两三四五六七八九十百千]+)\s*章[*\s]*[：:、.\-—\s]*(.*?)[*\s]*$'
+)
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100, '千': 1000}
+
+INDEX_VERSION = 1
+
+
+def chinese_to_int(text: str) -> Optional[int]:
+    """把章节号转为整数，支持阿拉伯数字和中文数字"""
+    if text.isdigit():
+        return int(text)
+
+    total = 0
+    digit = 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            total += (digit or 1) * _CN_UNITS[ch]
+            digit = 0
+        else:
+            return None
+    return total + digit
+
+
+def fingerprint(text: str) -> str:
+    """文本指纹"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def parse_outline(outline: str) -> Dict[str, Any]:
+    """解析大纲文本
+
+    Returns:
+        {
+            'version': 索引格式版本,
+            'fingerprint': 大纲全文指纹,
+            'chapters': {
+                '章节号': {'number', 'title', 'start', 'end', 'summary', 'hash'}
+            }
+        }
+        start/end 为该章在大纲中的字符区间，summary 为该区间的文本。
+    """
+    chapters = {}
+    current = None
+    sequence = 0
+    offset = 0
+
+    for raw_line in (outline or '').splitlines(keepends=True):
+        line_start = offset
+        offset += len(raw_line)
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        match = CHAPTER_HEADING_RE.match(line)
+        if match:
+            if current:
+                chapters[str(current['number'])] = current
+
+            sequence += 1
+            number = chinese_to_int(match.group(1)) or sequence
+            # 编号重复或倒退时按顺序编号，避免覆盖前面的章节
+            if str(number) in chapters:
+                number = sequence
+            sequence = number
+            current = {
+                'number': number,
+                'title': match.group(2) or line,
+                'start': line_start,
+                'end': offset
+            }
+        elif current:
+            current['end'] = offset
+
+    if current:
+        chapters[str(current['number'])] = current
+
+    for entry in chapters.values():
+        entry['summary'] = outline[entry['start']:entry['end']].strip()
+        entry['hash'] = fingerprint(entry['summary'])
+
+    return {
+        'version': INDEX_VERSION,
+        'fingerprint': fingerprint(outline or ''),
+        'chapters': chapters
+    }
+
+
+def update_index(old_index: Optional[Dict[str, Any]], outline: str):
+    """大纲重新生成后更新索引
+
+    Returns:
+        (新索引, 概要有变化或被删除的章节号列表)。各章位置按新大纲重新计算，
+        只通过比较每章概要的指纹判断是否变化。
+    """
+    new_index = parse_outline(outline)
+    old_chapters = (old_index or {}).get('chapters', {})
+    changed = []
+
+    for key, entry in new_index['chapters'].items():
+        old_entry = old_chapters.get(key)
+        if old_entry and old_entry.get('hash') == entry['hash']:
+            continue
+        changed.append(entry['number'])
+
+    removed = [int(key) for key in old_chapters if key not in new_index['chapters']]
+    return new_index, sorted(changed + removed)
+
+
+def load_index(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """读取持久化的索引，格式不符时返回 None"""
+    if not text:
+        return None
+    try:
+        index = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(index, dict) or index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def dump_index(index: Dict[str, Any]) -> str:
+    """序列化索引以便持久化"""
+    return json.dumps(index, ensure_ascii=False)
+
+
+def ordered_chapters(index: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按章节号排序的章节条目"""
+    return sorted(index['chapters'].values(), key=lambda entry: entry['number'])
@@ -0,0 +1,168 @@
+"""
+小说内的前文片段检索
+
+每部小说一个内存中的倒排索引：已完成章节的正文按段落切成片段，
+以二元组为词项（与全文检索相同的分词），用 BM25 对片段打分。
+生成新章节时用其细纲检索前文中最相关的片段（人物上次出场、物品的来历等），
+在 token 预算内附加到正文生成的提示词中，代替整段粘贴前文。
+"""
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from fulltext import _CJK_RE, tokenize
+
+# 片段目标长度（字），过长的段落按该长度切开
+PASSAGE_CHARS = 300
+
+# BM25 参数
+K1 = 1.2
+B = 0.75
+
+# 越靠后的章节加分越多（最多加 RECENCY_WEIGHT 倍），相关度相近时优先取最近的前文
+RECENCY_WEIGHT = 0.2
+
+# 同一章最多选取的片段数，避免结果集中在一章
+MAX_PER_CHAPTER = 2
+
+
+def estimate_tokens(value: str) -> int:
+    """粗略估算 token 数：中日韩文字按每字一个，其余字符按四个一个"""
+    cjk = len(_CJK_RE.findall(value))
+    return cjk + math.ceil((len(value) - cjk) / 4)
+
+
+def split_passages(content: str) -> List[str]:
+    """按段落把正文切成片段：短段落合并到接近 PASSAGE_CHARS，长段落按 PASSAGE_CHARS 切开"""
+    passages = []
+    current = ''
+    for paragraph in (line.strip() for line in (content or '').splitlines()):
+        if not paragraph:
+            continue
+        while len(paragraph) > PASSAGE_CHARS * 2:
+            if current:
+                passages.append(current)
+                current = ''
+            passages.append(paragraph[:PASSAGE_CHARS])
+            paragraph = paragraph[PASSAGE_CHARS:]
+        if current and len(current) + len(paragraph) > PASSAGE_CHARS:
+            passages.append(current)
+            current = ''
+        current = f'{current}\n{paragraph}' if current else paragraph
+        if len(current) >= PASSAGE_CHARS:
+            passages.append(current)
+            current = ''
+    if current:
+        passages.append(current)
+    return passages
+
+
+class PassageIndex:
+    """单部小说的片段倒排索引，按章节增量更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_id = 0
+        # 片段ID → (章节号, 文本, 词频)
+        self._passages: Dict[int, Tuple[int, str, Counter]] = {}
+        # 章节号 → 片段ID列表
+        self._chapters: Dict[int, List[int]] = {}
+        # 词项 → {片段ID: 词频}
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        # 片段ID → 词项总数
+        self._lengths: Dict[int, int] = {}
+
+    def add_chapter(self, chapter_number: int, content: str):
+        """索引一章正文；已索引过的章节先移除旧片段"""
+        with self._lock:
+            self._remove_chapter(chapter_number)
+            ids = []
+            for text in split_passages(content):
+                counts = Counter(tokenize(text).split())
+                if not counts:
+                    continue
+                passage_id = self._next_id
+                self._next_id += 1
+                self._passages[passage_id] = (chapter_number, text, counts)
+                self._lengths[passage_id] = sum(counts.values())
+                for term, count in counts.items():
+                    self._postings[term][passage_id] = count
+                ids.append(passage_id)
+            self._chapters[chapter_number] = ids
+
+    def _remove_chapter(self, chapter_number: int):
+        for passage_id in self._chapters.pop(chapter_number, []):
+            _, _, counts = self._passages.pop(passage_id)
+            del self._lengths[passage_id]
+            for term in counts:
+                postings = self._postings[term]
+                postings.pop(passage_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, before_chapter: int, top_k: int, token_budget: int) -> List[dict]:
+        """检索 before_chapter 之前各章中与 query 最相关的片段
+
+        文档数、平均长度和词项的文档频率只统计 before_chapter 之前的片段，
+        重新生成中间章节时，之后章节的内容不影响打分。
+        按相关度依次选取，超出 token 预算的片段跳过，最多 top_k 段；结果按章节顺序返回。
+
+        Returns:
+            [{'chapter_number', 'text', 'score', 'tokens'}]
+        """
+        terms = set(tokenize(query).split())
+        with self._lock:
+            # 可检索片段 → 长度
+            eligible = {
+                passage_id: self._lengths[passage_id]
+                for chapter_number, ids in self._chapters.items() if chapter_number < before_chapter
+                for passage_id in ids
+            }
+            count = len(eligible)
+            if not terms or not count:
+                return []
+            average_length = sum(eligible.values()) / count
+
+            scores = defaultdict(float)
+            for term in terms:
+                postings = [(passage_id, frequency)
+                            for passage_id, frequency in self._postings.get(term, {}).items()
+                            if passage_id in eligible]
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, frequency in postings:
+                    scores[passage_id] += idf * frequency * (K1 + 1) / (
+                        frequency + K1 * (1 - B + B * eligible[passage_id] / average_length)
+                    )
+
+            ranked = sorted(
+                ((score * (1 + RECENCY_WEIGHT * self._passages[passage_id][0] / before_chapter), passage_id)
+                 for passage_id, score in scores.items()),
+                reverse=True
+            )
+
+            selected = []
+            used = 0
+            per_chapter = Counter()
+            for score, passage_id in ranked:
+                if len(selected) >= top_k:
+                    break
+                chapter_number, text, _ = self._passages[passage_id]
+                tokens = estimate_tokens(text)
+                if per_chapter[chapter_number] >= MAX_PER_CHAPTER or used + tokens > token_budget:
+                    continue
+                selected.append((chapter_number, passage_id, text, score, tokens))
+                per_chapter[chapter_number] += 1
+                used += tokens
+
+        return [
+            {'chapter_number': chapter_number, 'text': text, 'score': round(score, 4), 'tokens': tokens}
+            for chapter_number, _, text, score, tokens in sorted(selected)
+        ]
+
+
+def format_passages(passages: List[dict]) -> str:
+    """把检索结果整理为提示词中的前文片段"""
+    return '\n\n'.join(f"（第{passage['chapter_number']}章）\n{passage['text']}" for passage in passages)
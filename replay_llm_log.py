@@ -0,0 +1,100 @@
+"""
+回放脚本：用录制的 LLM 调用日志离线重跑一部小说的生成流程
+
+不访问模型接口，用于复现线上慢、重试风暴、费用异常等问题，并分析流程和数据库开销。
+
+用法：
+    python replay_llm_log.py llm_traffic/novel_12.jsonl.gz --speed 10
+    python replay_llm_log.py llm_traffic/novel_12.jsonl.gz --speed 0 --profile
+
+使用独立的临时数据库，不会影响 instance/novels.db。
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import tempfile
+import time
+
+# 设置输出编码为UTF-8
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='回放 LLM 调用日志')
+    parser.add_argument('log', help='录制文件路径 (novel_<id>.jsonl.gz)')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='回放速度：0 不等待，1 原速，10 加速10倍')
+    parser.add_argument('--database', default=None, help='数据库URL，默认使用临时SQLite文件')
+    parser.add_argument('--profile', action='store_true', help='输出 cProfile 热点')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+
+    # 必须在导入 app 之前设置数据库；回放时不再录制
+    tmp_dir = None
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix='novel_replay_')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp_dir, 'replay.db')}"
+    os.environ['LLM_RECORD_DIR'] = ''
+
+    from models import db, Novel, TokenUsage
+    from app import app, novel_generator
+    from llm_traffic import TrafficReplayer
+
+    replayer = TrafficReplayer(args.log, speed=args.speed)
+    meta = replayer.meta
+
+    with app.app_context():
+        db.create_all()
+        novel = Novel(
+            title=meta.get('title') or '回放小说',
+            theme=meta.get('theme', ''),
+            background=meta.get('background', ''),
+            target_words=meta.get('target_words') or 30000,
+            target_chapters=meta.get('target_chapters') or 10,
+            status='pending'
+        )
+        db.session.add(novel)
+        db.session.commit()
+        novel_id = novel.id
+
+    novel_generator.ai_service.replayer = replayer
+    print(f"回放 {args.log}（原小说ID: {meta.get('novel_id')}，速度: {args.speed or '不等待'}）")
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.time()
+    with app.app_context():
+        if profiler:
+            profiler.enable()
+        success = novel_generator.generate_novel(novel_id)
+        if profiler:
+            profiler.disable()
+    elapsed = time.time() - start
+
+    with app.app_context():
+        novel = Novel.query.get(novel_id)
+        calls = TokenUsage.query.filter_by(novel_id=novel_id).count()
+        print(f"\n结果: {'完成' if success else '未完成'} (状态: {novel.status})")
+        print(f"耗时: {elapsed:.2f}s，成功调用: {calls}，Tokens: {novel.total_tokens}，费用: ${novel.total_cost:.4f}")
+    print(f"回放统计: {replayer.stats}")
+    if replayer.stats['mismatches']:
+        print("注意：部分请求与录制不一致，当前代码的Prompt或流程可能已变化")
+
+    if profiler:
+        print()
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    if tmp_dir:
+        print(f"临时数据库保留在 {tmp_dir}")
+
+
+if __name__ == '__main__':
+    main()
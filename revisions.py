@@ -0,0 +1,172 @@
+"""
+生成产物的版本历史
+
+每次生成、重新生成或恢复都记录一个版本。每 SNAPSHOT_INTERVAL 个版本保存一次全文快照，
+其余版本只保存相对上一版本的行级差异：JSON 数组，元素为 [起, 止)（复用上一版本的行）
+或字符串（新增文本）。还原任一版本最多应用 SNAPSHOT_INTERVAL - 1 次差异。
+"""
+import difflib
+import json
+from typing import Optional
+
+from sqlalchemy import func
+
+from models import db, Revision
+
+# 每隔多少个版本保存一次全文快照
+SNAPSHOT_INTERVAL = 10
+
+# 可记录版本的产物及其检查结果字段
+CHECK_FIELDS = {
+    'settings': 'settings_check',
+    'outline': 'outline_check',
+    'detailed_outline': 'detailed_outline_check',
+    'content': 'content_check',
+}
+
+# 小说级产物，chapter_number 记为 0
+NOVEL_FIELDS = ('settings', 'outline')
+
+
+def make_delta(old: str, new: str) -> list:
+    """计算从 old 到 new 的行级差异"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(''.join(new_lines[j1:j2]))
+    return delta
+
+
+def apply_delta(old: str, delta: list) -> str:
+    old_lines = old.splitlines(keepends=True)
+    return ''.join(''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in delta)
+
+
+def _artifact_filter(novel_id: int, chapter_number: int, field: str):
+    return (
+        Revision.novel_id == novel_id,
+        Revision.chapter_number == chapter_number,
+        Revision.field == field
+    )
+
+
+def latest_revision(novel_id: int, chapter_number: int, field: str) -> Optional[Revision]:
+    return Revision.query.filter(*_artifact_filter(novel_id, chapter_number, field)) \
+        .order_by(Revision.revision_number.desc()).first()
+
+
+def previous_revision(revision: Revision) -> Optional[Revision]:
+    return Revision.query.filter(
+        *_artifact_filter(revision.novel_id, revision.chapter_number, revision.field),
+        Revision.revision_number < revision.revision_number
+    ).order_by(Revision.revision_number.desc()).first()
+
+
+def revision_text(revision: Revision) -> str:
+    """从最近的快照开始依次应用差异，还原该版本全文"""
+    if revision.is_snapshot:
+        return revision.data or ''
+
+    artifact = _artifact_filter(revision.novel_id, revision.chapter_number, revision.field)
+    snapshot_number = db.session.query(func.max(Revision.revision_number)).filter(
+        *artifact,
+        Revision.is_snapshot.is_(True),
+        Revision.revision_number <= revision.revision_number
+    ).scalar()
+    chain = Revision.query.filter(
+        *artifact,
+        Revision.revision_number >= snapshot_number,
+        Revision.revision_number <= revision.revision_number
+    ).order_by(Revision.revision_number).all()
+
+    text = chain[0].data or ''
+    for step in chain[1:]:
+        text = apply_delta(text, json.loads(step.data))
+    return text
+
+
+def record_revision(novel_id: int, chapter_number: int, field: str, text: str, source: str,
+                    usage: dict = None, previous: str = None, restored_from: int = None) -> Revision:
+    """记录产物的新版本，由调用方与产物本身在同一事务中提交
+
+    Args:
+        usage: AIService.track_usage() 统计的生成消耗
+        previous: 产物被覆盖前的值；该产物还没有任何版本时，先把它记为初始版本
+    Returns:
+        新版本；内容与最新版本相同时不记录，返回最新版本
+    """
+    last = latest_revision(novel_id, chapter_number, field)
+    if last is None and previous and previous != text:
+        last = _add_revision(novel_id, chapter_number, field, previous, 'initial', None, None)
+
+    last_text = revision_text(last) if last is not None else None
+    if last_text == text:
+        # 重试生成出相同内容时，消耗计入已有版本
+        _add_usage(last, usage)
+        return last
+
+    revision = _add_revision(novel_id, chapter_number, field, text, source, last, last_text)
+    revision.restored_from = restored_from
+    _add_usage(revision, usage)
+    return revision
+
+
+def _add_usage(revision: Revision, usage: Optional[dict]):
+    if not usage:
+        return
+    revision.prompt_tokens = (revision.prompt_tokens or 0) + usage.get('prompt_tokens', 0)
+    revision.completion_tokens = (revision.completion_tokens or 0) + usage.get('completion_tokens', 0)
+    revision.total_tokens = (revision.total_tokens or 0) + usage.get('total_tokens', 0)
+    revision.cost = (revision.cost or 0.0) + usage.get('cost', 0.0)
+
+
+def _add_revision(novel_id: int, chapter_number: int, field: str, text: str, source: str,
+                  last: Optional[Revision], last_text: Optional[str]) -> Revision:
+    number = last.revision_number + 1 if last is not None else 1
+    data, is_snapshot = text, True
+    if last is not None and number % SNAPSHOT_INTERVAL != 1:
+        delta = json.dumps(make_delta(last_text, text), ensure_ascii=False, separators=(',', ':'))
+        # 改动过大时差异不比全文小，直接存快照
+        if len(delta) < len(text):
+            data, is_snapshot = delta, False
+
+    revision = Revision(
+        novel_id=novel_id,
+        chapter_number=chapter_number,
+        field=field,
+        revision_number=number,
+        source=source,
+        is_snapshot=is_snapshot,
+        data=data,
+        length=len(text)
+    )
+    db.session.add(revision)
+    db.session.flush()
+    return revision
+
+
+def set_check(revision: Optional[Revision], check_result: dict):
+    """把检查结果记到版本上"""
+    if revision is None:
+        return
+    revision.check_score = check_result.get('total_score')
+    revision.passed = bool(check_result.get('passed', False))
+    revision.check_result = json.dumps(check_result, ensure_ascii=False)
+
+
+def diff_text(old: str, new: str, old_label: str, new_label: str) -> dict:
+    """两个版本的统一格式差异及增删行数"""
+    lines = list(difflib.unified_diff(
+        old.splitlines(keepends=True), new.splitlines(keepends=True),
+        fromfile=old_label, tofile=new_label
+    ))
+    return {
+        'diff': ''.join(line if line.endswith('\n') else line + '\n' for line in lines),
+        'added_lines': sum(1 for line in lines if line.startswith('+') and not line.startswith('+++')),
+        'removed_lines': sum(1 for line in lines if line.startswith('-') and not line.startswith('---'))
+    }
@@ -126,23 +126,74 @@ const api = {
 
     // 小说相关API
     novels: {
-        getAll: () => api.get('/novels'),
+        // 分页获取小说列表，返回 {items, next_cursor}
+        list: (params = {}) => {
+            const query = new URLSearchParams(params).toString();
+            return api.get(`/novels${query ? `?${query}` : ''}`);
+        },
+        // 按游标依次拉取全部分页
+        async getAll(params = {}) {
+            const novels = [];
+            let cursor = null;
+            do {
+                const page = await api.novels.list(cursor ? { ...params, cursor } : params);
+                novels.push(...page.items);
+                cursor = page.next_cursor;
+            } while (cursor);
+            return novels;
+        },
         getById: (id) => api.get(`/novels/${id}`),
         create: (data) => api.post('/novels', data),
         delete: (id) => api.delete(`/novels/${id}`),
         start: (id) => api.post(`/novels/${id}/start`, {}),
         export: (id) => api.post(`/novels/${id}/export`, {}),
-        getChapters: (id) => api.get(`/novels/${id}/chapters`),
-        getLogs: (id) => api.get(`/novels/${id}/logs`),
+        // 分页获取章节，返回 {items, next_cursor, next_since}
+        getChaptersPage: (id, params = {}) => {
+            const query = new URLSearchParams(params).toString();
+            return api.get(`/novels/${id}/chapters${query ? `?${query}` : ''}`);
+        },
+        // 拉取全部分页，返回 {items, next_since}
+        // next_since 取各页中最小的（即第一页的），翻页期间提交的更新留给下一次同步；重复的章节按 id 合并
+        async getChapters(id, params = {}) {
+            const items = [];
+            let nextSince = null;
+            let after = null;
+            do {
+                const page = await api.novels.getChaptersPage(id, after !== null ? { ...params, after } : params);
+                items.push(...page.items);
+                if (page.next_since && (!nextSince || page.next_since < nextSince)) {
+                    nextSince = page.next_since;
+                }
+                after = page.next_cursor;
+            } while (after !== null);
+            return { items, next_since: nextSince };
+        },
+        // 订阅生成进度事件流（SSE）
+        events: (id) => new EventSource(`${API_BASE}/novels/${id}/events`),
+        // 不传参数时返回最新日志（倒序）；传 since_id 时返回其后的新日志（正序），wait 为长轮询秒数
+        getLogs: (id, params = {}) => {
+            const query = new URLSearchParams(params).toString();
+            return api.get(`/novels/${id}/logs${query ? `?${query}` : ''}`);
+        },
         getTokenStats: (id) => api.get(`/novels/${id}/token-stats`)
     },
 
+    // 章节API
+    chapters: {
+        getById: (id) => api.get(`/chapters/${id}`)
+    },
+
     // 统计API
     stats: {
         getGlobal: () => api.get('/stats'),
         getTokenStats: (params) => {
             const query = new URLSearchParams(params).toString();
             return api.get(`/token-stats?${query}`);
+        },
+        // 分页获取Token使用明细，返回 {items, next_cursor}
+        getTokenUsages: (params = {}) => {
+            const query = new URLSearchParams(params).toString();
+            return api.get(`/token-usages${query ? `?${query}` : ''}`);
         }
     },
 
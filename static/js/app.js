@@ -101,7 +101,7 @@ const app = {
     // 加载最近的小说
     async loadRecentNovels() {
         try {
-            const novels = await api.novels.getAll();
+            const { items: novels } = await api.novels.list({ limit: 5 });
             const container = document.getElementById('recentNovels');
 
             if (novels.length === 0) {
@@ -114,7 +114,7 @@ const app = {
                 return;
             }
 
-            container.innerHTML = novels.slice(0, 5).map(novel =>
+            container.innerHTML = novels.map(novel =>
                 novelManager.createNovelCard(novel)
             ).join('');
         } catch (error) {
@@ -190,6 +190,9 @@ const app = {
         if (modalId === 'progressModal') {
             novelManager.stopProgressMonitoring();
         }
+        if (modalId === 'logsModal') {
+            novelManager.stopLogTail();
+        }
     },
 
     // 显示模态框
@@ -9,22 +9,24 @@ const tokenManager = {
             const params = { days };
             if (novelId) params.novel_id = novelId;
 
-            const data = await api.stats.getTokenStats(params);
-
-            // 计算总计
-            let totalTokens = 0, totalPrompt = 0, totalCompletion = 0, totalCost = 0;
-            data.usages.forEach(u => {
-                totalTokens += u.total_tokens || 0;
-                totalPrompt += u.prompt_tokens || 0;
-                totalCompletion += u.completion_tokens || 0;
-                totalCost += u.cost || 0;
-            });
+            // 汇总统计和最近50条明细分别获取
+            const usageParams = { limit: 50 };
+            if (novelId) usageParams.novel_id = novelId;
+            if (Number(days) > 0) {
+                // 与统计口径一致：按 UTC 自然日，含今天
+                usageParams.created_after = new Date(Date.now() - (days - 1) * 86400000).toISOString().slice(0, 10);
+            }
+            const [data, usages] = await Promise.all([
+                api.stats.getTokenStats(params),
+                api.stats.getTokenUsages(usageParams)
+            ]);
 
             // 更新统计卡片
-            document.getElementById('tokenStatsTotal').textContent = utils.formatNumber(totalTokens);
-            document.getElementById('tokenStatsPrompt').textContent = utils.formatNumber(totalPrompt);
-            document.getElementById('tokenStatsCompletion').textContent = utils.formatNumber(totalCompletion);
-            document.getElementById('tokenStatsCost').textContent = `$${totalCost.toFixed(2)}`;
+            const totals = data.totals;
+            document.getElementById('tokenStatsTotal').textContent = utils.formatNumber(totals.total_tokens);
+            document.getElementById('tokenStatsPrompt').textContent = utils.formatNumber(totals.prompt_tokens);
+            document.getElementById('tokenStatsCompletion').textContent = utils.formatNumber(totals.completion_tokens);
+            document.getElementById('tokenStatsCost').textContent = `$${totals.total_cost.toFixed(2)}`;
 
             // 按阶段统计表格
             this.renderStageStats(data.stage_stats);
@@ -33,7 +35,7 @@ const tokenManager = {
             this.renderDailyStats(data.daily_stats);
 
             // 详细记录列表
-            this.renderUsagesList(data.usages);
+            this.renderUsagesList(usages.items);
         } catch (error) {
             console.error('加载Token统计失败:', error);
         }
@@ -111,7 +113,7 @@ const tokenManager = {
             'check': '质量检查'
         };
 
-        const html = usages.slice(0, 50).map(usage => `
+        const html = usages.map(usage => `
             <div style="border-bottom: 1px solid #f0f0f0; padding: 15px;">
                 <div style="display: flex; justify-content: space-between; margin-bottom: 8px;">
                     <strong style="color: var(--text-color);">${stageNames[usage.stage] || usage.stage} - ${usage.operation}</strong>
@@ -131,7 +133,7 @@ const tokenManager = {
     // 加载小说列表用于筛选
     async loadNovelListForFilter() {
         try {
-            const novels = await api.novels.getAll();
+            const novels = await api.novels.getAll({ fields: 'id,title', limit: 200 });
             const select = document.getElementById('tokenNovelFilter');
 
             select.innerHTML = '<option value="">全部小说</option>' +
@@ -3,6 +3,18 @@ const novelManager = {
     // 当前监控的小说ID
     monitoringNovelId: null,
     monitoringInterval: null,
+    // 进度事件流（SSE）及当前弹窗展示的小说
+    eventSource: null,
+    progressNovel: null,
+    livePreviewKey: null,
+    // 日志弹窗的长轮询，每次打开递增，用于结束上一轮
+    logTailToken: 0,
+
+    // 进度弹窗的章节缓存：按 id 合并增量更新，细纲按需加载
+    chapterCache: new Map(),
+    chapterSince: null,
+    chapterOutlines: new Map(),
+    openOutlines: new Set(),
 
     // 加载小说列表
     async loadNovels() {
@@ -133,8 +145,9 @@ const novelManager = {
     // 查看进度（实时更新）
     async viewProgress(novelId) {
         try {
+            this.resetChapterCache();
             const novel = await api.novels.getById(novelId);
-            const chapters = await api.novels.getChapters(novelId);
+            const chapters = await this.syncChapters(novelId);
 
             // 显示进度模态框
             this.showProgressModal(novel, chapters);
@@ -147,11 +160,91 @@ const novelManager = {
         }
     },
 
+    // 清空章节缓存
+    resetChapterCache() {
+        this.chapterCache = new Map();
+        this.chapterSince = null;
+        this.chapterOutlines = new Map();
+        this.openOutlines = new Set();
+    },
+
+    // 只拉取上次同步后变化的章节摘要，合并进缓存
+    async syncChapters(novelId) {
+        const params = { view: 'summary' };
+        if (this.chapterSince) params.since = this.chapterSince;
+
+        const { items, next_since } = await api.novels.getChapters(novelId, params);
+        items.forEach(ch => {
+            const cached = this.chapterCache.get(ch.id);
+            if (cached && cached.updated_at !== ch.updated_at) {
+                this.chapterOutlines.delete(ch.id);
+            }
+            this.chapterCache.set(ch.id, ch);
+        });
+        this.chapterSince = next_since;
+
+        return [...this.chapterCache.values()].sort((a, b) => a.chapter_number - b.chapter_number);
+    },
+
+    // 展开细纲时按需加载章节详情
+    async toggleChapterOutline(detailsEl, chapterId) {
+        if (!detailsEl.open) {
+            this.openOutlines.delete(chapterId);
+            return;
+        }
+        this.openOutlines.add(chapterId);
+        if (this.chapterOutlines.has(chapterId)) return;
+
+        const body = detailsEl.querySelector('.chapter-outline-body');
+        body.textContent = '加载中...';
+        try {
+            const chapter = await api.chapters.getById(chapterId);
+            this.chapterOutlines.set(chapterId, chapter.detailed_outline || '');
+            body.textContent = chapter.detailed_outline || '';
+        } catch (error) {
+            body.textContent = '加载失败: ' + error.message;
+        }
+    },
+
+    // 单个章节条目HTML，进度事件到达时按条目替换
+    renderChapterItem(ch) {
+        return `
+                <div class="chapter-item-mini ${ch.status}" data-chapter-id="${ch.id}">
+                    <div class="chapter-item-header">
+                        <span class="chapter-number">第${ch.chapter_number}章</span>
+                        <span class="chapter-title">${ch.title}</span>
+                        <span class="chapter-status-icon">
+                            ${ch.status === 'completed' ? '✓' : ch.status === 'generating' ? '⏳' : '⏸'}
+                        </span>
+                    </div>
+                    ${ch.has_detailed_outline ? `
+                        <div class="chapter-outline-preview">
+                            <details style="margin-top: 8px;" ${this.openOutlines.has(ch.id) ? 'open' : ''} ontoggle="novelManager.toggleChapterOutline(this, ${ch.id})">
+                                <summary style="cursor: pointer; color: var(--primary-color); font-weight: 500;">
+                                    <strong>📝 细纲</strong> (点击展开)
+                                </summary>
+                                <div class="chapter-outline-body" style="margin-top: 10px; padding: 12px; background: rgba(245, 247, 250, 0.8); border-radius: 8px; white-space: pre-wrap; line-height: 1.6; font-size: 0.9em;">${this.chapterOutlines.get(ch.id) || ''}</div>
+                            </details>
+                        </div>
+                    ` : ch.status === 'generating' ? `
+                        <div class="chapter-outline-preview">
+                            <p style="color: var(--text-secondary); font-style: italic; margin-top: 8px;">⏳ 正在生成细纲...</p>
+                        </div>
+                    ` : ''}
+                    ${ch.word_count ? `
+                        <div class="chapter-word-count">字数: ${utils.formatNumber(ch.word_count)}</div>
+                    ` : ''}
+                </div>
+        `;
+    },
+
     // 显示进度模态框
     showProgressModal(novel, chapters) {
         const modal = document.getElementById('progressModal');
         const title = document.getElementById('progressModalTitle');
         const content = document.getElementById('progressModalContent');
+        this.progressNovel = novel;
+        this.livePreviewKey = null;
 
         title.innerHTML = `
             ${novel.title || '未命名小说'}
@@ -264,42 +357,15 @@ const novelManager = {
                     <div class="section-content">
                         <div class="chapter-progress">
                             <div class="chapter-progress-info">
-                                <span>进度: ${completedChapters} / ${totalChapters} 章</span>
-                                <span>${progressPercent}%</span>
+                                <span id="progressChapterCount">进度: ${completedChapters} / ${totalChapters} 章</span>
+                                <span id="progressChapterPercent">${progressPercent}%</span>
                             </div>
                             <div class="progress-bar">
-                                <div class="progress-bar-fill" style="width: ${progressPercent}%"></div>
+                                <div id="progressChapterBar" class="progress-bar-fill" style="width: ${progressPercent}%"></div>
                             </div>
                         </div>
-                        <div class="chapters-list">
-                            ${chapters.map(ch => `
-                                <div class="chapter-item-mini ${ch.status}">
-                                    <div class="chapter-item-header">
-                                        <span class="chapter-number">第${ch.chapter_number}章</span>
-                                        <span class="chapter-title">${ch.title}</span>
-                                        <span class="chapter-status-icon">
-                                            ${ch.status === 'completed' ? '✓' : ch.status === 'generating' ? '⏳' : '⏸'}
-                                        </span>
-                                    </div>
-                                    ${ch.detailed_outline ? `
-                                        <div class="chapter-outline-preview">
-                                            <details style="margin-top: 8px;">
-                                                <summary style="cursor: pointer; color: var(--primary-color); font-weight: 500;">
-                                                    <strong>📝 细纲</strong> (点击展开)
-                                                </summary>
-                                                <div style="margin-top: 10px; padding: 12px; background: rgba(245, 247, 250, 0.8); border-radius: 8px; white-space: pre-wrap; line-height: 1.6; font-size: 0.9em;">${ch.detailed_outline}</div>
-                                            </details>
-                                        </div>
-                                    ` : ch.status === 'generating' ? `
-                                        <div class="chapter-outline-preview">
-                                            <p style="color: var(--text-secondary); font-style: italic; margin-top: 8px;">⏳ 正在生成细纲...</p>
-                                        </div>
-                                    ` : ''}
-                                    ${ch.word_count ? `
-                                        <div class="chapter-word-count">字数: ${utils.formatNumber(ch.word_count)}</div>
-                                    ` : ''}
-                                </div>
-                            `).join('')}
+                        <div class="chapters-list" id="progressChaptersList">
+                            ${chapters.map(ch => this.renderChapterItem(ch)).join('')}
                         </div>
                     </div>
                 </div>
@@ -326,70 +392,203 @@ const novelManager = {
                 <div class="progress-steps">
                     ${stepsHTML}
                 </div>
+                <div id="progressTokenInfo" style="margin: 10px 0; font-size: 0.9em; color: #666;">
+                    ${this.formatTokenInfo(novel.total_tokens, novel.total_cost)}
+                </div>
+                <div id="progressLatestLog" style="margin-bottom: 10px; font-size: 0.9em; color: var(--text-secondary);"></div>
                 <div class="generation-content">
                     ${contentSections}
                 </div>
+                <div id="progressLivePreview" class="generation-section active" style="display: none;">
+                    <div class="section-header">
+                        <h4 id="progressLivePreviewTitle">实时输出</h4>
+                        <span class="loading-spinner"></span>
+                    </div>
+                    <div class="section-content">
+                        <pre id="progressLivePreviewText"></pre>
+                    </div>
+                </div>
             </div>
         `;
 
         modal.classList.add('active');
     },
 
-    // 开始实时监控
+    // 开始实时监控：订阅进度事件流，只按事件更新变化的部分
     startProgressMonitoring(novelId) {
         // 清除之前的监控
         this.stopProgressMonitoring();
-
         this.monitoringNovelId = novelId;
-        this.monitoringInterval = setInterval(async () => {
-            try {
-                const novel = await api.novels.getById(novelId);
-                const chapters = await api.novels.getChapters(novelId);
-
-                // 保存当前滚动位置
-                const modalBody = document.querySelector('#progressModal .modal-body');
-                const scrollPosition = modalBody ? modalBody.scrollTop : 0;
-
-                // 更新进度显示
-                this.showProgressModal(novel, chapters);
-
-                // 恢复滚动位置
-                if (modalBody) {
-                    const newModalBody = document.querySelector('#progressModal .modal-body');
-                    if (newModalBody) {
-                        newModalBody.scrollTop = scrollPosition;
-                    }
-                }
-
-                // 如果完成或失败，停止监控
-                if (novel.status === 'completed' || novel.status === 'failed') {
-                    this.stopProgressMonitoring();
-                    if (novel.status === 'completed') {
-                        utils.showMessage('小说生成完成！');
-                    } else {
-                        utils.showMessage('小说生成失败，请查看日志了解详情。');
-                    }
-                }
-            } catch (error) {
-                console.error('更新进度失败:', error);
+
+        if (!window.EventSource) {
+            this.startProgressPolling(novelId);
+            return;
+        }
+
+        const source = api.novels.events(novelId);
+        this.eventSource = source;
+        const on = (type, handler) => source.addEventListener(type, event => {
+            if (this.eventSource !== source) return;
+            handler(JSON.parse(event.data));
+        });
+
+        // 连接（或重连）建立时补齐订阅前发生的变化，未变化的请求会命中 304
+        on('snapshot', () => this.refreshProgress(novelId));
+        on('resync', () => this.refreshProgress(novelId));
+        on('novel', data => this.handleNovelEvent(novelId, data));
+        on('chapter', data => this.applyChapterEvent(data));
+        on('tokens', data => {
+            if (this.progressNovel) {
+                this.progressNovel.total_tokens = data.novel_total_tokens;
+                this.progressNovel.total_cost = data.novel_total_cost;
+            }
+            const el = document.getElementById('progressTokenInfo');
+            if (el) el.innerHTML = this.formatTokenInfo(data.novel_total_tokens, data.novel_total_cost);
+        });
+        on('log', data => {
+            const el = document.getElementById('progressLatestLog');
+            if (el) el.textContent = `[${utils.formatDate(data.created_at)}] ${data.message}`;
+        });
+        on('delta', data => this.appendLivePreview(data));
+    },
+
+    // 浏览器不支持 SSE 时退回定时轮询
+    startProgressPolling(novelId) {
+        this.monitoringInterval = setInterval(() => this.refreshProgress(novelId), 3000);
+    },
+
+    // 重新拉取小说和变化的章节，整体重绘进度弹窗
+    async refreshProgress(novelId) {
+        try {
+            const novel = await api.novels.getById(novelId);
+            const chapters = await this.syncChapters(novelId);
+            if (this.monitoringNovelId !== novelId) return;
+
+            this.renderProgressKeepingScroll(novel, chapters);
+            this.checkProgressFinished(novel);
+        } catch (error) {
+            console.error('更新进度失败:', error);
+        }
+    },
+
+    // 重绘进度弹窗并保持滚动位置
+    renderProgressKeepingScroll(novel, chapters) {
+        // 保存当前滚动位置
+        const modalBody = document.querySelector('#progressModal .modal-body');
+        const scrollPosition = modalBody ? modalBody.scrollTop : 0;
+
+        this.showProgressModal(novel, chapters);
+
+        // 恢复滚动位置
+        const newModalBody = document.querySelector('#progressModal .modal-body');
+        if (newModalBody) {
+            newModalBody.scrollTop = scrollPosition;
+        }
+    },
+
+    // 如果完成或失败，停止监控
+    checkProgressFinished(novel) {
+        if (novel.status === 'completed' || novel.status === 'failed') {
+            this.stopProgressMonitoring();
+            if (novel.status === 'completed') {
+                utils.showMessage('小说生成完成！');
+            } else {
+                utils.showMessage('小说生成失败，请查看日志了解详情。');
             }
-        }, 3000); // 每3秒更新一次
+        }
+    },
+
+    // 状态/阶段变化：阶段切换或设定、大纲更新时重新拉取大文本，其余只更新状态
+    handleNovelEvent(novelId, data) {
+        const novel = this.progressNovel;
+        if (!novel || data.updated || novel.current_stage !== data.current_stage || novel.status !== data.status) {
+            this.refreshProgress(novelId);
+            return;
+        }
+        Object.assign(novel, data);
+    },
+
+    // 章节变化：合并进缓存，只替换对应的章节条目
+    applyChapterEvent(data) {
+        const { detailed_outline: detailedOutline, ...chapter } = data;
+        const cached = this.chapterCache.get(chapter.id);
+        if (detailedOutline !== undefined) {
+            this.chapterOutlines.set(chapter.id, detailedOutline);
+        }
+        this.chapterCache.set(chapter.id, { ...cached, ...chapter });
+        if (!this.chapterSince || chapter.updated_at > this.chapterSince) {
+            this.chapterSince = chapter.updated_at;
+        }
+
+        const chapters = [...this.chapterCache.values()].sort((a, b) => a.chapter_number - b.chapter_number);
+        const item = document.querySelector(`#progressChaptersList [data-chapter-id="${chapter.id}"]`);
+        if (!item) {
+            if (this.progressNovel) this.renderProgressKeepingScroll(this.progressNovel, chapters);
+            return;
+        }
+        item.outerHTML = this.renderChapterItem(this.chapterCache.get(chapter.id));
+
+        const completed = chapters.filter(ch => ch.status === 'completed').length;
+        const total = this.progressNovel ? this.progressNovel.target_chapters : chapters.length;
+        const percent = total > 0 ? (completed / total * 100).toFixed(1) : 0;
+        document.getElementById('progressChapterCount').textContent = `进度: ${completed} / ${total} 章`;
+        document.getElementById('progressChapterPercent').textContent = `${percent}%`;
+        document.getElementById('progressChapterBar').style.width = `${percent}%`;
+
+        if (chapter.status !== 'generating') this.hideLivePreview(chapter.chapter_number);
+    },
+
+    // 流式输出的增量文本，只保留末尾一段
+    appendLivePreview(data) {
+        const container = document.getElementById('progressLivePreview');
+        const text = document.getElementById('progressLivePreviewText');
+        if (!container || !text) return;
+
+        const key = `${data.operation}:${data.chapter_number}`;
+        if (this.livePreviewKey !== key) {
+            this.livePreviewKey = key;
+            text.textContent = '';
+            document.getElementById('progressLivePreviewTitle').textContent = data.chapter_number
+                ? `实时输出 · 第${data.chapter_number}章 ${utils.getStageLabel(data.stage)}`
+                : `实时输出 · ${utils.getStageLabel(data.stage)}`;
+        }
+        text.textContent = (text.textContent + data.text).slice(-2000);
+        container.style.display = '';
+    },
+
+    // 章节结束后隐藏它的实时输出
+    hideLivePreview(chapterNumber) {
+        if (this.livePreviewKey && !this.livePreviewKey.endsWith(`:${chapterNumber}`)) return;
+        const container = document.getElementById('progressLivePreview');
+        if (container) container.style.display = 'none';
+        this.livePreviewKey = null;
+    },
+
+    formatTokenInfo(totalTokens, totalCost) {
+        return totalTokens
+            ? `Token: ${utils.formatNumber(totalTokens)} | 费用: $${(totalCost || 0).toFixed(2)}`
+            : '';
     },
 
     // 停止实时监控
     stopProgressMonitoring() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
         if (this.monitoringInterval) {
             clearInterval(this.monitoringInterval);
             this.monitoringInterval = null;
         }
         this.monitoringNovelId = null;
+        this.livePreviewKey = null;
     },
 
     // 查看详情
     async viewDetail(novelId) {
         try {
             const novel = await api.novels.getById(novelId);
-            const chapters = await api.novels.getChapters(novelId);
+            const { items: chapters } = await api.novels.getChapters(novelId, { view: 'summary' });
 
             const modal = document.getElementById('novelDetailModal');
             const title = document.getElementById('modalNovelTitle');
@@ -459,22 +658,55 @@ const novelManager = {
             const modal = document.getElementById('logsModal');
             const content = document.getElementById('logsContent');
 
-            content.innerHTML = logs.map(log => `
-                <div class="log-entry ${log.level}" style="padding: 12px; margin-bottom: 10px; border-left: 4px solid var(--primary-color); background: #f8f9fa; border-radius: 5px;">
-                    <div style="font-size: 0.85em; color: #999; margin-bottom: 5px;">
-                        ${utils.formatDate(log.created_at)}
-                    </div>
-                    <div><strong>${log.stage}</strong>: ${log.message}</div>
-                </div>
-            `).join('') || '<p style="text-align: center; color: #999; padding: 40px;">暂无日志</p>';
+            content.innerHTML = logs.map(log => this.renderLogEntry(log)).join('')
+                || '<p class="logs-empty" style="text-align: center; color: #999; padding: 40px;">暂无日志</p>';
 
             modal.classList.add('active');
+
+            const lastId = logs.reduce((max, log) => Math.max(max, log.id), 0);
+            this.tailLogs(novelId, lastId);
         } catch (error) {
             console.error('加载日志失败:', error);
             utils.showMessage('加载日志失败: ' + error.message);
         }
     },
 
+    renderLogEntry(log) {
+        return `
+            <div class="log-entry ${log.level}" style="padding: 12px; margin-bottom: 10px; border-left: 4px solid var(--primary-color); background: #f8f9fa; border-radius: 5px;">
+                <div style="font-size: 0.85em; color: #999; margin-bottom: 5px;">
+                    ${utils.formatDate(log.created_at)}
+                </div>
+                <div><strong>${log.stage}</strong>: ${log.message}</div>
+            </div>
+        `;
+    },
+
+    // 弹窗打开期间长轮询新日志，只拉取增量并插到顶部
+    async tailLogs(novelId, sinceId) {
+        const token = ++this.logTailToken;
+        while (token === this.logTailToken) {
+            try {
+                const logs = await api.novels.getLogs(novelId, { since_id: sinceId, wait: 25 });
+                if (token !== this.logTailToken) return;
+                if (logs.length === 0) continue;
+
+                const content = document.getElementById('logsContent');
+                const empty = content.querySelector('.logs-empty');
+                if (empty) empty.remove();
+                content.insertAdjacentHTML('afterbegin', logs.slice().reverse().map(log => this.renderLogEntry(log)).join(''));
+                sinceId = logs[logs.length - 1].id;
+            } catch (error) {
+                console.error('拉取新日志失败:', error);
+                await new Promise(resolve => setTimeout(resolve, 3000));
+            }
+        }
+    },
+
+    stopLogTail() {
+        this.logTailToken++;
+    },
+
     // 导出小说
     async exportNovel(novelId) {
         try {
@@ -0,0 +1,224 @@
+"""
+大文本列的压缩存储
+
+压缩后的值以 BLOB 存入原来的 TEXT 列，前两个字节是格式标记：
+    b'\\x00z'  zlib
+    b'\\x00s'  zstd（需安装 zstandard）
+    b'\\x00b'  内容在外部存储中（见 blob_store.py），其后是 SHA-256
+短文本和未迁移的旧数据仍是普通 TEXT，读取时原样返回，因此新旧数据可以混存。
+只在 SQLite 上压缩；其他数据库的 TEXT 列不能存二进制，按明文读写。
+"""
+import zlib
+from typing import Optional, Union
+
+from sqlalchemy.types import Text, TypeDecorator
+
+from blob_store import blob_store
+from config import Config
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖
+    zstandard = None
+
+MARKER_ZLIB = b'\x00z'
+MARKER_ZSTD = b'\x00s'
+MARKER_BLOB = b'\x00b'
+
+# 小于该字节数的文本不压缩，压缩收益抵不过开销
+MIN_COMPRESS_SIZE = 256
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# 不小于该字节数的正文/细纲在配置了外部存储时存到文件系统
+BLOB_MIN_SIZE = 4096
+
+# 迁移时每批处理的行数
+MIGRATE_BATCH_SIZE = 200
+
+# 压缩存储的列
+COMPRESSED_COLUMNS = {
+    'novels': ('settings', 'settings_check', 'outline', 'outline_check', 'outline_index'),
+    'chapters': ('detailed_outline', 'detailed_outline_check', 'content', 'content_check'),
+}
+
+# 可以存到外部存储的列
+EXTERNAL_COLUMNS = {
+    'novels': ('outline',),
+    'chapters': ('detailed_outline', 'content'),
+}
+
+
+def active_codec() -> Optional[str]:
+    """当前配置的压缩算法，none 表示不压缩；未安装 zstandard 时退回 zlib"""
+    codec = Config.TEXT_COMPRESSION
+    if codec == 'none':
+        return None
+    if codec == 'zstd' and zstandard is None:
+        return 'zlib'
+    return codec
+
+
+def encode(text: str, codec: Optional[str]) -> Union[str, bytes]:
+    """压缩文本；不压缩或压缩后反而更大时返回原文本"""
+    if codec is None:
+        return text
+    raw = text.encode('utf-8')
+    if len(raw) < MIN_COMPRESS_SIZE:
+        return text
+
+    if codec == 'zstd':
+        packed = MARKER_ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    else:
+        packed = MARKER_ZLIB + zlib.compress(raw, ZLIB_LEVEL)
+    return packed if len(packed) < len(raw) else text
+
+
+def decode(value: Union[str, bytes, None]) -> Optional[str]:
+    """解压数据库中的值，明文原样返回"""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    marker, payload = value[:2], value[2:]
+    if marker == MARKER_ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if marker == MARKER_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("数据使用 zstd 压缩，请先安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload).decode('utf-8')
+    if marker == MARKER_BLOB:
+        if blob_store is None:
+            raise RuntimeError("数据存放在外部存储中，请配置 BLOB_STORE_DIR")
+        return blob_store.get(payload.decode('ascii'))
+    # 没有格式标记的二进制按 UTF-8 文本处理
+    return value.decode('utf-8')
+
+
+def externalize(text: str, store) -> Union[str, bytes]:
+    """把大文本写入外部存储，返回行中保存的引用；文本较短时按普通方式压缩"""
+    raw = text.encode('utf-8')
+    if len(raw) < BLOB_MIN_SIZE:
+        return encode(text, active_codec())
+    return MARKER_BLOB + store.put(raw).encode('ascii')
+
+
+class CompressedText(TypeDecorator):
+    """透明压缩的 TEXT 列，ORM 读写的始终是 str
+
+    Args:
+        external: 配置了外部存储时，大文本存到文件系统，行中只保存哈希
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, external: bool = False):
+        super().__init__()
+        self.external = external
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != 'sqlite':
+            return value
+        if self.external and blob_store is not None:
+            return externalize(value, blob_store)
+        return encode(value, active_codec())
+
+    def process_result_value(self, value, dialect):
+        return decode(value)
+
+
+def _rewrite(cursor, table: str, column: str, condition: str, params: tuple, transform,
+             batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """按 id 分批读取满足条件的值并用 transform 改写，每批提交一次
+
+    transform 返回 None 表示该值不需要改写。中断后重新执行会从未处理的行继续。
+    """
+    changed = 0
+    last_id = 0
+    while True:
+        cursor.execute(f"""
+            SELECT id, {column} FROM {table}
+            WHERE id > ? AND {column} IS NOT NULL AND {condition}
+            ORDER BY id LIMIT ?
+        """, (last_id,) + params + (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for row_id, value in rows:
+            new_value = transform(value)
+            if new_value is not None:
+                updates.append((new_value, row_id))
+        cursor.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", updates)
+        cursor.connection.commit()
+
+        changed += len(updates)
+        last_id = rows[-1][0]
+    print(f"  {table}.{column}: 已处理至第 {last_id} 行")
+    return changed
+
+
+def compress_existing(cursor, codec: Optional[str] = None, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """分批压缩已有的明文行
+
+    Returns:
+        压缩的值的数量
+    """
+    codec = codec or active_codec()
+    if codec is None:
+        return 0
+
+    def transform(text):
+        packed = encode(text, codec)
+        return packed if isinstance(packed, bytes) else None
+
+    return sum(
+        _rewrite(cursor, table, column,
+                 f"typeof({column}) = 'text' AND length(CAST({column} AS BLOB)) >= ?", (MIN_COMPRESS_SIZE,),
+                 transform, batch_size)
+        for table, columns in COMPRESSED_COLUMNS.items() for column in columns
+    )
+
+
+def externalize_existing(cursor, store) -> int:
+    """把数据库中已有的大文本移到外部存储，返回移出的值的数量"""
+    def transform(value):
+        packed = externalize(decode(value), store)
+        return packed if isinstance(packed, bytes) and packed.startswith(MARKER_BLOB) else None
+
+    return sum(
+        _rewrite(cursor, table, column,
+                 f"NOT (typeof({column}) = 'blob' AND substr({column}, 1, 2) = ?)", (MARKER_BLOB,), transform)
+        for table, columns in EXTERNAL_COLUMNS.items() for column in columns
+    )
+
+
+def inline_existing(cursor, store) -> int:
+    """把外部存储中的内容写回数据库（按当前压缩配置），返回写回的值的数量"""
+    codec = active_codec()
+
+    def transform(value):
+        return encode(store.get(bytes(value)[2:].decode('ascii')), codec)
+
+    return sum(
+        _rewrite(cursor, table, column,
+                 f"typeof({column}) = 'blob' AND substr({column}, 1, 2) = ?", (MARKER_BLOB,), transform)
+        for table, columns in EXTERNAL_COLUMNS.items() for column in columns
+    )
+
+
+def referenced_digests(cursor) -> set:
+    """数据库中引用的全部外部存储哈希"""
+    digests = set()
+    for table, columns in EXTERNAL_COLUMNS.items():
+        for column in columns:
+            cursor.execute(
+                f"SELECT substr({column}, 3) FROM {table} "
+                f"WHERE typeof({column}) = 'blob' AND substr({column}, 1, 2) = ?",
+                (MARKER_BLOB,)
+            )
+            digests.update(bytes(value).decode('ascii') for value, in cursor.fetchall())
+    return digests